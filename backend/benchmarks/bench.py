@@ -0,0 +1,272 @@
+"""
+Benchmarks of the inference and ingestion hot paths
+
+Synthetic ThingSpeak feeds are generated from processed_data.csv (the real
+readings replayed with fresh entry ids and timestamps, plus a share of
+missing and malformed fields), and every benchmark reports the median, p95
+and mean wall time in milliseconds over a fixed number of repeats:
+
+- parse.*        adapter.process_thingspeak_data / parse_thingspeak_feeds
+- model.*        predict_proba of each base model and the meta-model, 1 row and a batch
+- meta_features  get_meta_features (the four base models, stacked)
+- predict.*      predict_with_models (1 row) and predict_batch
+- api.predict    POST /predict end to end, ThingSpeak stubbed with synthetic feeds
+- train.*        one grid search per base model on a subsample (--training, slow)
+
+The report is JSON so runs can be compared across commits. Every median is
+checked against the absolute ceiling in thresholds.json and, with
+--baseline, against a previous report (slower by more than --tolerance
+fails). The exit code is 1 on any regression.
+
+Usage (from backend/):
+    python benchmarks/bench.py --output bench.json
+    python benchmarks/bench.py --baseline bench.json --tolerance 0.25
+    python benchmarks/bench.py --only parse,models --training
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+DATA_FILE = os.path.join(SRC_DIR, 'processed_data.csv')
+THRESHOLDS_FILE = os.path.join(BENCH_DIR, 'thresholds.json')
+
+# Benchmark the plain request path: no background polling, worker pool, batching or caching
+os.environ.update({'FEED_POLL_INTERVAL': '0', 'INFERENCE_WORKERS': '0',
+                   'BATCH_MAX_WAIT_MS': '0', 'MODEL_CACHE_SIZE': '0'})
+sys.path.insert(0, SRC_DIR)
+
+
+def load_readings(path=DATA_FILE):
+    """Sensor rows, labels and timestamps of processed_data.csv, oldest first"""
+    raw = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=(2, 3, 4, 5, 7))
+    dates = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=(0, 1), dtype=str)
+    timestamps = np.array([f"{d[6:10]}-{d[3:5]}-{d[0:2]}T{int(t[:-6]):02d}{t[-6:]}" for d, t in dates],
+                          dtype='datetime64[s]')
+    order = np.argsort(timestamps, kind='stable')
+    return raw[order, :4], raw[order, 4].astype(int), timestamps[order]
+
+
+def synthetic_feeds(readings, n, seed=0, missing_rate=0.01, invalid_rate=0.002, start=None):
+    """
+    ThingSpeak feed entries replaying n consecutive readings from a random offset
+
+    Args:
+        readings (np.ndarray): Sensor rows to replay
+        n (int): Entries to generate
+        missing_rate, invalid_rate (float): Share of fields left empty / made non-numeric
+        start (datetime64, optional): Time of the first entry; readings are 12 s apart
+
+    Returns:
+        list: Feed dicts with entry_id, created_at and field1..field4 strings
+    """
+    rng = np.random.default_rng(seed)
+    offset = int(rng.integers(0, max(len(readings) - n, 1)))
+    rows = readings[np.arange(offset, offset + n) % len(readings)]
+    start = np.datetime64('2025-07-21T08:54:00', 's') if start is None else start
+    fields = rng.random((n, 4))
+    feeds = []
+    for i, row in enumerate(rows):
+        entry = {'entry_id': i + 1, 'created_at': f"{start + np.timedelta64(12 * i, 's')}Z"}
+        for j, value in enumerate(row):
+            if fields[i, j] < missing_rate:
+                entry[f'field{j + 1}'] = None
+            elif fields[i, j] < missing_rate + invalid_rate:
+                entry[f'field{j + 1}'] = 'nan?'
+            else:
+                entry[f'field{j + 1}'] = f"{value:g}"
+        feeds.append(entry)
+    return feeds
+
+
+def measure(fn, repeat=50, warmup=3):
+    """Median, p95 and mean milliseconds of fn() over `repeat` calls after `warmup` calls"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': round(statistics.median(times), 4),
+        'p95_ms': round(float(np.percentile(times, 95)), 4),
+        'mean_ms': round(statistics.fmean(times), 4),
+        'repeat': repeat,
+    }
+
+
+def bench_parse(readings, args):
+    from adapter import parse_thingspeak_feeds, process_thingspeak_data
+
+    results = {}
+    for n in (10, args.batch_rows):
+        feeds = synthetic_feeds(readings, n, seed=n)
+        results[f'parse.process_thingspeak_data.{n}'] = measure(lambda: process_thingspeak_data(feeds), args.repeat)
+        results[f'parse.parse_thingspeak_feeds.{n}'] = measure(lambda: parse_thingspeak_feeds(feeds), args.repeat)
+    return results
+
+
+def bench_models(readings, args):
+    from predict import get_meta_features, predict_batch, predict_with_models, model_inputs, run_ensemble
+    from registry import registry
+
+    model_set = registry.get()
+    rng = np.random.default_rng(1)
+    batch = readings[rng.integers(0, len(readings), args.batch_rows)]
+    single = batch[:1]
+    results = {}
+    for rows, X in (('1', single), (str(args.batch_rows), batch)):
+        X_scaled = model_set.scaler.transform(model_inputs(X, model_set))
+        for name, model in model_set.base_models.items():
+            results[f'model.{name}.{rows}'] = measure(lambda: model.predict_proba(X_scaled), args.repeat)
+        meta_X = get_meta_features(model_set.base_models, X_scaled)
+        results[f'model.meta.{rows}'] = measure(lambda: model_set.meta_model.predict_proba(meta_X), args.repeat)
+        results[f'meta_features.{rows}'] = measure(
+            lambda: get_meta_features(model_set.base_models, X_scaled), args.repeat)
+        results[f'predict.run_ensemble.{rows}'] = measure(lambda: run_ensemble(X, model_set), args.repeat)
+    results['predict.predict_with_models.1'] = measure(lambda: predict_with_models(single[0].tolist()), args.repeat)
+    results[f'predict.predict_batch.{args.batch_rows}'] = measure(lambda: predict_batch(batch), args.repeat)
+    return results
+
+
+def bench_api(readings, args):
+    import api
+
+    feeds = synthetic_feeds(readings, 10, seed=2)
+    api.fetch_thingspeak_data = lambda api_key, *a, **kw: feeds
+    client = api.app.test_client()
+
+    def call(mode):
+        response = client.post('/predict', json={'api_key': 'BENCHMARK', 'mode': mode})
+        if response.status_code != 200:
+            raise RuntimeError(f"/predict returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    return {
+        'api.predict': measure(lambda: call('average'), args.repeat),
+        'api.predict.per_reading': measure(lambda: call('per_reading'), args.repeat),
+    }
+
+
+def bench_training(readings, labels, args):
+    from sklearn.preprocessing import StandardScaler
+
+    from training import SEARCH_SPACES, run_searches
+
+    rng = np.random.default_rng(3)
+    rows = rng.choice(len(readings), min(args.train_rows, len(readings)), replace=False)
+    X = StandardScaler().fit_transform(readings[rows])
+    y = labels[rows]
+    results = {}
+    for name in SEARCH_SPACES:
+        start = time.perf_counter()
+        run_searches(X, y, names=[name], max_workers=args.workers, cache_path=None)
+        elapsed = (time.perf_counter() - start) * 1000
+        results[f'train.{name}'] = {'median_ms': round(elapsed, 1), 'p95_ms': round(elapsed, 1),
+                                    'mean_ms': round(elapsed, 1), 'repeat': 1, 'rows': len(rows)}
+    return results
+
+
+def environment():
+    """Versions and machine facts stored with the report"""
+    import sklearn
+    import xgboost
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'xgboost': xgboost.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'inference_engine': os.getenv('INFERENCE_ENGINE', 'sklearn'),
+    }
+
+
+def check(results, thresholds, baseline, tolerance):
+    """Names of benchmarks over their absolute ceiling or slower than baseline * (1 + tolerance)"""
+    regressions = []
+    for name, stats in results.items():
+        ceiling = thresholds.get(name)
+        if ceiling is not None and stats['median_ms'] > ceiling:
+            regressions.append({'benchmark': name, 'median_ms': stats['median_ms'], 'threshold_ms': ceiling})
+        previous = (baseline or {}).get(name)
+        if previous is not None and stats['median_ms'] > previous['median_ms'] * (1 + tolerance):
+            regressions.append({'benchmark': name, 'median_ms': stats['median_ms'],
+                                'baseline_ms': previous['median_ms'], 'tolerance': tolerance})
+    return regressions
+
+
+GROUPS = ('parse', 'models', 'api', 'training')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the E-Nose inference and ingestion paths")
+    parser.add_argument('--only', default=None, help=f"Comma separated groups out of {', '.join(GROUPS)}")
+    parser.add_argument('--training', action='store_true', help="Also time one grid search per base model")
+    parser.add_argument('--repeat', type=int, default=50, help="Timed calls per benchmark")
+    parser.add_argument('--batch-rows', type=int, default=1000, help="Rows in the batch benchmarks")
+    parser.add_argument('--train-rows', type=int, default=2000, help="Rows sampled for the training benchmark")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size for the training benchmark")
+    parser.add_argument('--thresholds', default=THRESHOLDS_FILE, help="Absolute median ceilings (ms) per benchmark")
+    parser.add_argument('--baseline', default=None, help="Earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown against the baseline")
+    parser.add_argument('--output', default=None, help="Write the JSON report here as well")
+    args = parser.parse_args()
+
+    groups = set(args.only.split(',')) if args.only else {'parse', 'models', 'api'}
+    if args.training:
+        groups.add('training')
+    unknown = groups - set(GROUPS)
+    if unknown:
+        parser.error(f"Unknown groups: {sorted(unknown)}")
+
+    readings, labels, _ = load_readings()
+    results = {}
+    if 'parse' in groups:
+        results.update(bench_parse(readings, args))
+    if 'models' in groups:
+        results.update(bench_models(readings, args))
+    if 'api' in groups:
+        results.update(bench_api(readings, args))
+    if 'training' in groups:
+        results.update(bench_training(readings, labels, args))
+
+    thresholds = {}
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)['median_ms']
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    regressions = check(results, thresholds, baseline, args.tolerance)
+    report = {'environment': environment(), 'results': results, 'regressions': regressions}
+    text = json.dumps(report, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
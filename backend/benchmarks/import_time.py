@@ -0,0 +1,109 @@
+"""
+Import-time and cold-start benchmark with a startup budget
+
+Each target runs in a fresh interpreter (so nothing is cached in
+sys.modules) several times; the median wall time is compared with the
+budget in startup_budget.json, and the modules a target must not pull in
+(e.g. xgboost/sklearn for `import predict`) are checked too. The result
+is written as JSON so runs can be compared across commits; the exit code
+is 1 when a budget is exceeded.
+
+Usage (from backend/):
+    python benchmarks/import_time.py [--repeat 5] [--output import_time.json] [--importtime]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+BUDGET_FILE = os.path.join(BENCH_DIR, 'startup_budget.json')
+
+# Child program: time the statement, then report elapsed time and which watched modules got loaded
+PROBE = '''
+import json, sys, time
+sys.path.insert(0, {src!r})
+watched = {watched!r}
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print("@@" + json.dumps({{"seconds": elapsed, "loaded": [m for m in watched if m in sys.modules]}}))
+'''
+
+
+def run_target(statement, watched, repeat, env):
+    """Median seconds and loaded watched modules of `statement` over `repeat` fresh interpreters"""
+    times, loaded = [], set()
+    program = PROBE.format(src=SRC_DIR, watched=list(watched), statement=statement)
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', program], cwd=SRC_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        report = json.loads(next(line[2:] for line in output.splitlines() if line.startswith('@@')))
+        times.append(report['seconds'])
+        loaded.update(report['loaded'])
+    return statistics.median(times), sorted(loaded)
+
+
+def top_imports(statement, limit=10):
+    """Slowest imports (cumulative microseconds) of a statement according to -X importtime"""
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {SRC_DIR!r}); {statement}"],
+        cwd=SRC_DIR, capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        rows.append((int(cumulative), name))
+    return [{'module': name, 'cumulative_us': us} for us, name in sorted(rows, reverse=True)[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and cold-start times against the startup budget")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument('--budget', default=BUDGET_FILE, help="Budget JSON file")
+    parser.add_argument('--output', default=None, help="Write the JSON report here as well")
+    parser.add_argument('--importtime', action='store_true', help="Include the slowest imports of each target")
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+    # Keep the benchmark independent of a local config: no polling, no worker pool
+    env = dict(os.environ, FEED_POLL_INTERVAL='0', INFERENCE_WORKERS='0')
+
+    report, failures = {'python': sys.version.split()[0], 'targets': {}}, []
+    for name, target in budget['targets'].items():
+        seconds, loaded = run_target(target['statement'], target.get('forbidden_modules', []), args.repeat, env)
+        result = {
+            'statement': target['statement'],
+            'median_seconds': round(seconds, 4),
+            'budget_seconds': target['max_seconds'],
+            'forbidden_modules_loaded': loaded,
+        }
+        if args.importtime:
+            result['slowest_imports'] = top_imports(target['statement'])
+        result['ok'] = seconds <= target['max_seconds'] and not loaded
+        if not result['ok']:
+            failures.append(name)
+        report['targets'][name] = result
+        status = 'ok' if result['ok'] else 'OVER BUDGET'
+        print(f"{name:<16} {seconds:7.3f}s  (budget {target['max_seconds']}s)  {status}"
+              + (f"  loaded {loaded}" if loaded else ''), file=sys.stderr)
+
+    report['ok'] = not failures
+    text = json.dumps(report, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,12 +12,24 @@ This package contains the main source code for the E-Nose project including:
 __version__ = "1.0.0"
 __author__ = "E-Nose"
 
-# Import main modules for easier access
-
-from config import config
-from predict import predict_with_models
+# Main modules are imported on first attribute access, so importing the
+# package does not load the YAML config or the model stack
 
 __all__ = [
     'config',
-    'predict_with_models'
-] 
\ No newline at end of file
+    'predict_with_models',
+    'registry'
+]
+
+
+def __getattr__(name):
+    if name == 'config':
+        from config import config
+        return config
+    if name == 'predict_with_models':
+        from predict import predict_with_models
+        return predict_with_models
+    if name == 'registry':
+        from registry import registry
+        return registry
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
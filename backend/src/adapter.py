@@ -1,29 +1,194 @@
 import requests
 import csv
+import os
+import threading
+from collections import OrderedDict
 
+import numpy as np
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def fetch_thingspeak_data(api_key, results=10):
+
+THINGSPEAK_BASE_URL = "https://api.thingspeak.com"
+# Used when neither the caller nor THINGSPEAK_CHANNEL_ID names a channel
+DEFAULT_CHANNEL_ID = "3018524"
+
+# ThingSpeak returns at most 8000 entries per request
+MAX_RESULTS = 8000
+# Bounds of the feed cache: (channel_id, api_key) pairs kept, and entries kept per pair
+CACHE_MAX_CHANNELS = 256
+CACHE_MAX_KEEP = 500
+
+
+class ThingSpeakClient:
+    """
+    ThingSpeak feed client with pooled connections, retries and a feed cache
+
+    Feeds are cached per (channel_id, api_key). Once the cache holds enough
+    entries, repeat polls only ask ThingSpeak for entries created since the
+    last seen one and merge them in by entry_id. The cache is an LRU of at
+    most max_channels pairs with at most max_keep entries each; windows
+    larger than max_keep are always fetched in full. A call may override the
+    timeout and skip the retries, for callers that must give up on a device
+    within a fixed time.
+
+    Args:
+        base_url (str): ThingSpeak server, overridable for a local stub server
+        timeout (float or tuple): Connect/read timeout in seconds
+        retries (int): Retries for connection errors and 429/5xx responses
+        backoff_factor (float): Exponential backoff factor between retries
+        pool_maxsize (int): Pooled connections kept per host
+        max_channels (int): (channel_id, api_key) pairs kept in the feed cache
+        max_keep (int): Feed entries cached per pair
+    """
+
+    def __init__(self, base_url=THINGSPEAK_BASE_URL, timeout=(3.05, 10), retries=3,
+                 backoff_factor=0.5, pool_maxsize=10, max_channels=CACHE_MAX_CHANNELS,
+                 max_keep=CACHE_MAX_KEEP):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_channels = max_channels
+        self.max_keep = max_keep
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Same pooling without retries, for fetch_feeds(..., retry=False)
+        self.single_session = requests.Session()
+        single = HTTPAdapter(max_retries=0, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.single_session.mount("http://", single)
+        self.single_session.mount("https://", single)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_feeds(self, channel_id, params, timeout=None, retry=True):
+        """GET the channel feed; returns the feeds list or None on failure"""
+        url = f"{self.base_url}/channels/{channel_id}/feeds.json"
+        session = self.session if retry else self.single_session
+        response = session.get(url, params=params, timeout=timeout or self.timeout)
+        if response.status_code == 200:
+            return response.json().get("feeds", [])
+        print(f"Failed to fetch data. Status code: {response.status_code}")
+        return None
+
+    def fetch_feeds(self, api_key, results=10, channel_id=None, timeout=None, retry=True):
+        """
+        Fetch the latest feed entries of a channel
+
+        Args:
+            api_key (str): ThingSpeak read API key
+            results (int): Number of most recent entries to return
+            channel_id (str): ThingSpeak channel id, default_channel_id() when omitted
+            timeout (float or tuple, optional): Connect/read timeout of this call instead of the client's
+            retry (bool): Retry connection errors and 429/5xx responses
+
+        Returns:
+            list: Feed entries oldest first, or None if failed
+        """
+        channel_id = channel_id or default_channel_id()
+        results = max(1, min(int(results), MAX_RESULTS))
+        key = (str(channel_id), api_key)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+
+        try:
+            if cached and cached["start"] and len(cached["feeds"]) >= results:
+                # Conditional poll: only entries created since the last seen one
+                params = {"api_key": api_key, "results": MAX_RESULTS, "start": cached["start"]}
+                fresh = self._get_feeds(channel_id, params, timeout, retry)
+                if fresh is None:
+                    return None
+                last_id = cached["last_entry_id"]
+                new_entries = [e for e in fresh if (e.get("entry_id") or 0) > last_id]
+                feeds = cached["feeds"] + new_entries
+            else:
+                feeds = self._get_feeds(channel_id, {"api_key": api_key, "results": results}, timeout, retry)
+                if feeds is None:
+                    return None
+        except Exception as e:
+            print(f"Error fetching data: {str(e)}")
+            return None
+
+        if feeds:
+            # Keep as many entries as the largest window asked for so far, up to max_keep
+            keep = min(max(results, cached["keep"] if cached else 0), self.max_keep)
+            last = feeds[-1]
+            with self._lock:
+                self._cache[key] = {
+                    "feeds": feeds[-keep:],
+                    "keep": keep,
+                    "last_entry_id": last.get("entry_id") or 0,
+                    "start": _thingspeak_start(last.get("created_at")),
+                }
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_channels:
+                    self._cache.popitem(last=False)
+        return feeds[-results:]
+
+    def invalidate(self, api_key=None, channel_id=None):
+        """Drop cached feeds, optionally only those of one api_key and/or channel"""
+        with self._lock:
+            for key in list(self._cache):
+                if (channel_id is None or key[0] == str(channel_id)) and (api_key is None or key[1] == api_key):
+                    del self._cache[key]
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+        self.single_session.close()
+
+
+def _thingspeak_start(created_at):
+    """Convert a feed created_at ('2025-07-22T12:09:24Z') to ThingSpeak's start parameter format"""
+    if not created_at:
+        return None
+    return created_at.replace("T", " ").rstrip("Z")
+
+
+def default_channel_id():
+    """Channel fetched when none is given: THINGSPEAK_CHANNEL_ID, else DEFAULT_CHANNEL_ID"""
+    return os.getenv("THINGSPEAK_CHANNEL_ID") or DEFAULT_CHANNEL_ID
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide ThingSpeakClient, creating it on first use"""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = ThingSpeakClient()
+    return _default_client
+
+
+def fetch_thingspeak_data(api_key, results=10, channel_id=None, timeout=None, retry=True):
     """
     Fetch data from ThingSpeak API
     
     Args:
         api_key (str): ThingSpeak API key
-        results (int): Number of results to fetch (default: 50)
+        results (int): Number of results to fetch (default: 10)
+        channel_id (str): ThingSpeak channel id, default_channel_id() when omitted
+        timeout (float, optional): Connect/read timeout of this call (default: the client's)
+        retry (bool): Retry connection errors and 429/5xx responses (default: True)
     
     Returns:
         list: List of feed data or None if failed
     """
-    try:
-        response = requests.get(f"https://api.thingspeak.com/channels/3018524/feeds.json?api_key={api_key}&results={results}")
-        
-        if response.status_code == 200:
-            return response.json().get("feeds", [])
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Error fetching data: {str(e)}")
-        return None
+    return get_client().fetch_feeds(api_key, results, channel_id, timeout=timeout, retry=retry)
 
 
 def save_data_to_csv(data, filename="output.csv"):
@@ -53,6 +218,103 @@ def save_data_to_csv(data, filename="output.csv"):
         return False
 
 
+# Map ThingSpeak fields to our sensors: MQ136, MQ137, TEMP, HUMI
+FIELD_MAPPING = ["field1", "field2", "field3", "field4"]
+
+
+def _field_matrix(data):
+    """Convert the four sensor fields of all entries to a float64 (N, 4) matrix with NaN for missing/invalid values"""
+    flat = [entry.get(field_name) for entry in data for field_name in FIELD_MAPPING]
+    flat = ["nan" if field_value is None or field_value == "" else field_value for field_value in flat]
+    try:
+        # String -> float conversion happens in one NumPy call
+        values = np.array(flat, dtype=np.float64)
+    except (ValueError, TypeError):
+        # Some value is not numeric: fall back to converting element by element
+        values = np.empty(len(flat), dtype=np.float64)
+        for index, field_value in enumerate(flat):
+            try:
+                values[index] = float(field_value)
+            except (ValueError, TypeError):
+                values[index] = np.nan
+    return values.reshape(len(data), len(FIELD_MAPPING))
+
+
+def _timestamps(data):
+    """created_at of all entries as datetime64[s], NaT where it is missing or malformed"""
+    # created_at is UTC ('...Z'); drop the suffix so NumPy parses it as a naive timestamp
+    created_at = [entry.get("created_at") or "NaT" for entry in data]
+    created_at = [value.rstrip("Z") if isinstance(value, str) else "NaT" for value in created_at]
+    try:
+        return np.array(created_at, dtype="datetime64[s]")
+    except ValueError:
+        timestamps = np.empty(len(created_at), dtype="datetime64[s]")
+        for index, value in enumerate(created_at):
+            try:
+                timestamps[index] = np.datetime64(value, "s")
+            except ValueError:
+                timestamps[index] = np.datetime64("NaT")
+        return timestamps
+
+
+def _round2(values):
+    """Round to 2 decimals exactly like Python's round() for every element"""
+    rounded = np.round(values, 2)
+    # np.round scales by 100 first, which can land on the wrong side of a tie;
+    # redo values sitting next to a .xx5 boundary with Python's correctly rounded round()
+    scaled = np.abs(values * 100.0)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in zip(*np.nonzero(near_tie)):
+        rounded[index] = round(float(values[index]), 2)
+    return rounded
+
+
+def parse_thingspeak_feeds(data, dtype=np.float32):
+    """
+    Parse ThingSpeak feed entries into arrays in one vectorized pass
+
+    Args:
+        data (list): List of ThingSpeak feed data
+        dtype: Floating point type of the sensor values (default: float32)
+
+    Returns:
+        tuple: (values (N, 4) with NaN for missing or invalid fields,
+                mask (N, 4) bool, True where the field held a valid number,
+                timestamps (N,) datetime64[s] from created_at, NaT where it is missing or malformed,
+                entry_ids (N,) int64)
+    """
+    if not data:
+        return (np.empty((0, len(FIELD_MAPPING)), dtype=dtype), np.empty((0, len(FIELD_MAPPING)), dtype=bool),
+                np.empty(0, dtype="datetime64[s]"), np.empty(0, dtype=np.int64))
+
+    values = _field_matrix(data)
+    mask = ~np.isnan(values)
+
+    timestamps = _timestamps(data)
+    entry_ids = np.array([entry.get("entry_id") or 0 for entry in data], dtype=np.int64)
+
+    return values.astype(dtype, copy=False), mask, timestamps, entry_ids
+
+
+def feeds_to_sensor_matrix(data):
+    """
+    Sensor matrix with process_thingspeak_data semantics
+
+    Values are rounded to 2 decimals, missing or invalid fields become 0.0 and
+    entries without any valid field are dropped.
+
+    Args:
+        data (list): List of ThingSpeak feed data
+
+    Returns:
+        tuple: (values (M, 4) float64, timestamps (M,) datetime64[s], entry_ids (M,) int64)
+    """
+    values, mask, timestamps, entry_ids = parse_thingspeak_feeds(data, dtype=np.float64)
+    keep = mask.any(axis=1)
+    values = np.where(mask, _round2(values), 0.0)
+    return values[keep], timestamps[keep], entry_ids[keep]
+
+
 def process_thingspeak_data(data):
     """
     Process ThingSpeak data to extract array of sensor values
@@ -68,34 +330,8 @@ def process_thingspeak_data(data):
     
     # Extract all valid sensor readings as array
     try:
-        sensor_arrays = []
-        
-        # Map ThingSpeak fields to our sensors: MQ136, MQ137, TEMP, HUMI
-        field_mapping = ["field1", "field2", "field3", "field4"]
-
-        # Process each entry to get sensor values
-        for entry in data:
-            sensor_values = []
-            has_valid_data = False
-            
-            for field_name in field_mapping:
-                field_value = entry.get(field_name)
-                if field_value is not None and field_value != "":
-                    try:
-                        value = float(field_value)
-                        sensor_values.append(round(value, 2))
-                        has_valid_data = True
-                    except (ValueError, TypeError):
-                        sensor_values.append(0.0)  # Default to 0 for invalid data
-                else:
-                    sensor_values.append(0.0)  # Default to 0 for missing data
-            
-            # Only add if we have at least some valid data
-            if has_valid_data:
-                sensor_arrays.append(sensor_values)
-        
-        print(f"Processed {len(sensor_arrays)} valid entries from {len(data)} total entries")
-        return sensor_arrays
+        values, _, _ = feeds_to_sensor_matrix(data)
+        return values.tolist()
         
     except Exception as e:
         print(f"Error processing sensor values: {str(e)}")
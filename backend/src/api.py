@@ -1,15 +1,30 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import json
 import logging
+import queue
 import sys
 import os
+import time
 from datetime import datetime
 
 # Add src directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from adapter import fetch_thingspeak_data, process_thingspeak_data
-from predict import predict_with_models, mask_sensor_names
+from adapter import default_channel_id, fetch_thingspeak_data, feeds_to_sensor_matrix
+import numpy as np
+
+from predict import (predict_batch, predict_with_models, classify_readings, window_input, mask_sensor_names,
+                     masked_model_name, row_predictions, INFERENCE_CASCADE, INFERENCE_ENGINE, RESPONSE_ORDER)
+from registry import registry
+from ingest import start_poller_from_env
+from batching import batcher_from_env
+from cache import cache_from_env
+from fleet import fleet_from_env, parse_devices
+from history import RESOLUTIONS, history_from_env
+from metrics import LatencyMetrics, StageTimer, sample_lines
+from serving import Overloaded, PredictionTimeout, pool_from_env
+from stream import TooManySubscribers, score_rows, stream_hub_from_env
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -19,6 +34,138 @@ CORS(app)  # Enable CORS for frontend
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Load and validate the model ensemble once at startup
+registry.load()
+
+# Readings and served predictions per device, kept in SQLite with rollups (opt-in: set HISTORY_DB)
+history = history_from_env()
+
+# Worker processes for CPU-bound inference (INFERENCE_WORKERS, 0 = in the request thread)
+inference_pool = pool_from_env()
+
+# Per-device streaming state, scored on the inference pool; polled channels feed it as well
+stream_hub = stream_hub_from_env(on_events=None if history is None else history.record_events,
+                                 score=lambda inputs: inference_pool.call(score_rows, inputs))
+
+# Keep configured ThingSpeak channels buffered in the background (FEED_POLL_INTERVAL > 0)
+poller = start_poller_from_env(on_readings=stream_hub.push_readings)
+
+# Stage and request latency histograms served at /metrics
+latency_metrics = LatencyMetrics()
+
+# Per-request timing breakdown in the response metadata by default (or with "timings": true)
+RESPONSE_TIMINGS = os.getenv('RESPONSE_TIMINGS', 'False').lower() == 'true'
+
+
+def record_cascade(predictions, model_version):
+    """Count the early exits and escalations of a cascade pass, if the predictions come from one"""
+    escalated = predictions.get('meta', {}).get('escalated')
+    if escalated is not None:
+        latency_metrics.record_cascade(escalated, model_version)
+
+
+def run_batch(rows):
+    """predict_batch on the inference pool, recording the stages of the ensemble pass"""
+    result = inference_pool.call(predict_batch, rows, timings=True)
+    latency_metrics.record(result.pop('timings'), result['model_version'])
+    record_cascade(result['predictions'], result['model_version'])
+    return result
+
+
+# Coalesce concurrent /predict rows into one batch per pool call (BATCH_MAX_WAIT_MS, 0 = off)
+batcher = batcher_from_env(run_batch=run_batch, threads=max(inference_pool.workers, 1))
+
+
+# Recently predicted rows per model-set version (MODEL_CACHE_SIZE, 0 = off)
+prediction_cache = cache_from_env()
+
+# Concurrent ThingSpeak fetches for /predict/fleet (FLEET_MAX_CONCURRENCY, FLEET_DEVICE_TIMEOUT)
+fleet_fetcher = fleet_from_env()
+FLEET_MAX_DEVICES = int(os.getenv('FLEET_MAX_DEVICES', 100))
+
+
+def predict_row(row, deadline, model_version=None, timer=None):
+    """
+    Masked per-model predictions of one input row
+
+    Served from the prediction cache when the (quantized) row was seen under
+    the same model version, otherwise batched with concurrent requests when enabled.
+    A fresh prediction is cached under the version of the model set that made
+    it, which may be newer than `model_version` while a swap reaches the workers.
+    The stages of an unbatched ensemble pass are added to `timer`.
+    """
+    if prediction_cache is not None:
+        cached = prediction_cache.get(model_version, row)
+        if cached is not None:
+            return cached
+    if batcher is None:
+        result = inference_pool.call(predict_with_models, row, timings=True, deadline=deadline)
+        latency_metrics.record(result['timings'], result['model_version'])
+        record_cascade(result['predictions'], result['model_version'])
+        if timer is not None:
+            timer.add(result['timings'])
+    else:
+        result = batcher.predict(row, timeout=max(deadline - time.monotonic(), 0.0))
+    predictions = result['predictions']
+    if prediction_cache is not None:
+        prediction_cache.put(result['model_version'], row, predictions)
+    return predictions
+
+
+def streamed_features(buffer_key, model_set):
+    """Rolling feature row the stream hub keeps for a polled channel (keyed by its channel id), or None"""
+    if model_set.features is None or buffer_key is None:
+        return None
+    return stream_hub.latest_features(buffer_key[0], model_set.features)
+
+
+def record_history(device, sensor_matrix, reading_times, entry_ids, predictions, model_version, source):
+    """Append a scored window's readings and its meta prediction (stamped with the serving time) to the history"""
+    if history is None:
+        return
+    history.record_readings(device, sensor_matrix, reading_times, entry_ids)
+    meta = predictions.get('meta', {})
+    history.record_prediction(device, meta.get('class_label'), meta.get('probability'), model_version,
+                              source=source)
+
+
+def model_versions(model_set):
+    """Short content hash of every model of the set under its masked name"""
+    return {masked_model_name(name): model_set.model_hashes.get(name) for name in RESPONSE_ORDER}
+
+
+def overloaded_response(error):
+    """503 with Retry-After when the inference pool is full"""
+    response = jsonify({
+        'error': 'Server busy, retry later',
+        'details': str(error)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def timeout_response(error):
+    """504 when inference misses PREDICTION_TIMEOUT"""
+    return jsonify({
+        'error': 'Prediction timed out',
+        'details': str(error),
+        'timeout_seconds': inference_pool.timeout
+    }), 504
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    """Count every routed request in the latency histogram, labelled by its URL rule"""
+    started = g.pop('request_started', None)
+    if started is not None and request.url_rule is not None and request.endpoint != 'metrics':
+        latency_metrics.observe_request(request.url_rule.rule, request.method, response.status_code,
+                                        time.perf_counter() - started, registry.version)
+    return response
+
 # Health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -27,9 +174,41 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'service': 'e-nose-api',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'model_version': registry.version,
+        'model_format': registry.model_format,
+        'inference_engine': INFERENCE_ENGINE,
+        'inference_cascade': INFERENCE_CASCADE,
+        'inference': inference_pool.info(),
+        'batching': None if batcher is None else batcher.metrics.snapshot(),
+        'prediction_cache': None if prediction_cache is None else prediction_cache.info(),
+        'fleet': fleet_fetcher.info(),
+        'history': None if history is None else history.info()
     })
 
+# Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latency histograms and serving counters in the Prometheus text format"""
+    version = {'model_version': registry.version}
+    pool = inference_pool.info()
+    lines = sample_lines('enose_model_info', 'gauge', 'Model-set version being served', [(version, 1)])
+    lines += sample_lines('enose_inference_calls_total', 'counter', 'Inference pool calls by outcome',
+                          [({'outcome': key}, pool[key]) for key in ('completed', 'rejected', 'timed_out', 'failed')])
+    lines += sample_lines('enose_inference_workers', 'gauge', 'Inference worker processes', [({}, pool['workers'])])
+    if batcher is not None:
+        batching = batcher.metrics.snapshot()
+        lines += sample_lines('enose_batches_total', 'counter', 'Micro-batches run', [({}, batching['batches'])])
+        lines += sample_lines('enose_batched_rows_total', 'counter', 'Rows predicted in micro-batches',
+                              [({}, batching['items'])])
+    if prediction_cache is not None:
+        cache = prediction_cache.info()
+        lines += sample_lines('enose_prediction_cache_total', 'counter', 'Prediction cache lookups and removals',
+                              [({'event': key}, cache[key])
+                               for key in ('hits', 'misses', 'evictions', 'expired', 'invalidations')])
+        lines += sample_lines('enose_prediction_cache_size', 'gauge', 'Cached rows', [({}, cache['size'])])
+    return Response(latency_metrics.render(lines), mimetype='text/plain; version=0.0.4')
+
 # Predict endpoint with ThingSpeak data
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -38,9 +217,17 @@ def predict():
     
     Expected JSON payload:
     {
-        "api_key": "P91SEPV5ZZG00Y4S"
+        "api_key": "P91SEPV5ZZG00Y4S",
+        "channel_id": "3018524",   (optional, defaults to THINGSPEAK_CHANNEL_ID)
+        "mode": "average",         (optional, "average" or "per_reading")
+        "timings": true            (optional, per-stage milliseconds in metadata.timings_ms)
     }
+
+    With mode "per_reading" every reading of the window is also classified
+    and summarized under "per_reading".
     """
+    deadline = time.monotonic() + inference_pool.timeout
+    timer = StageTimer()
     try:
         data = request.get_json()
         
@@ -53,41 +240,76 @@ def predict():
             }), 400
         
         api_key = data['api_key']
-        
-        # Fetch data from ThingSpeak
-        thingspeak_data = fetch_thingspeak_data(api_key)
-        
-        if not thingspeak_data:
-            return jsonify({
-                'error': 'Failed to fetch data from ThingSpeak',
-                'api_key': api_key
-            }), 503
-        
-        # Process data to get sensor arrays
-        sensor_arrays = process_thingspeak_data(thingspeak_data)
-        
-        if not sensor_arrays:
+        channel_id = data.get('channel_id')
+        mode = data.get('mode', 'average')
+        if mode not in ('average', 'per_reading'):
             return jsonify({
-                'error': 'Failed to process ThingSpeak data',
-                'raw_data_count': len(thingspeak_data)
-            }), 422
-        
-        # Calculate average for prediction (backward compatibility)
-        sensor_values = []
-        for i in range(4):  # 4 sensors: MQ136, MQ137, TEMP, HUMI
-            values = [arr[i] for arr in sensor_arrays if len(arr) > i]
-            if values:
-                avg_value = round(sum(values) / len(values), 2)
-                sensor_values.append(avg_value)
-            else:
-                sensor_values.append(0.0)
+                'error': f'Unknown mode: {mode}',
+                'supported_modes': ['average', 'per_reading']
+            }), 400
         
-        # Make prediction using average values
-        result = predict_with_models(sensor_values)
+        # Serve from the background poller's buffer when this channel is polled
+        buffer_key, buffer = (None, None) if poller is None else poller.get_buffer(api_key, channel_id)
+        if buffer is not None and len(buffer) > 0:
+            with timer.stage('fetch'):
+                sensor_matrix, reading_times, entry_ids = buffer.snapshot()
+            thingspeak_meta = {
+                'source': 'buffer',
+                'records_fetched': len(sensor_matrix),
+                **poller.freshness(buffer_key)
+            }
+        else:
+            # Fetch data from ThingSpeak
+            with timer.stage('fetch'):
+                thingspeak_data = fetch_thingspeak_data(api_key, channel_id=channel_id)
+
+            if not thingspeak_data:
+                return jsonify({
+                    'error': 'Failed to fetch data from ThingSpeak',
+                    'api_key': api_key
+                }), 503
+
+            # Process data to get sensor arrays
+            with timer.stage('parse'):
+                sensor_matrix, reading_times, entry_ids = feeds_to_sensor_matrix(thingspeak_data)
+
+            if len(sensor_matrix) == 0:
+                return jsonify({
+                    'error': 'Failed to process ThingSpeak data',
+                    'raw_data_count': len(thingspeak_data)
+                }), 422
+
+            thingspeak_meta = {
+                'source': 'live',
+                'records_fetched': len(thingspeak_data),
+                'latest_entry_time': thingspeak_data[-1].get('created_at')
+            }
         
-        # Add input data and raw sensor arrays to result
-        result['input_data'] = sensor_values
-        result['sensor_arrays'] = sensor_arrays
+        sensor_arrays = sensor_matrix.tolist()
+        sensor_values = np.round(sensor_matrix.mean(axis=0), 2).tolist()
+
+        # Rolling-feature models take the device's incrementally kept window when it is streamed
+        model_set = registry.get()
+        with timer.stage('input'):
+            feature_row = streamed_features(buffer_key, model_set)
+            row, prediction_input = window_input(sensor_matrix, reading_times, feature_row, model_set)
+
+        # One row per request: coalesced with concurrent requests, scored on the inference pool
+        with timer.stage('inference'):
+            predictions = predict_row(row, deadline, model_set.version, timer)
+        record_history(buffer_key[0] if buffer_key is not None else channel_id or default_channel_id(),
+                       sensor_matrix, reading_times, entry_ids, predictions, model_set.version, 'predict')
+        result = {
+            'input_data': sensor_values,
+            'predictions': predictions,
+            'sensor_arrays': sensor_arrays
+        }
+
+        # Score every reading of the window in one pass
+        if mode == 'per_reading':
+            with timer.stage('per_reading'):
+                result['per_reading'] = inference_pool.call(classify_readings, sensor_matrix, reading_times,
+                                                            deadline=deadline)
         
         # Add ThingSpeak metadata with masked sensor names
         original_sensor_names = ['MQ136', 'MQ137', 'TEMP', 'HUMI']
@@ -97,22 +319,25 @@ def predict():
             'timestamp': datetime.now().isoformat(),
             'sensor_names': masked_sensor_names,
             'thingspeak': {
-                'records_fetched': len(thingspeak_data),
-                'latest_entry_time': thingspeak_data[-1].get('created_at'),
+                **thingspeak_meta,
                 'api_key': api_key
             },
-            'model_versions': {
-                'base_1': 'v1.0',
-                'base_2': 'v1.0',
-                'base_3': 'v1.0',
-                'base_4': 'v1.0',
-                'meta': 'v1.0'
-            }
+            'prediction_input': prediction_input,
+            'model_version': model_set.version,
+            # Content hash of each model's artifact (base_1..base_4, meta)
+            'model_versions': model_versions(model_set)
         }
+        latency_metrics.record(timer.timings, model_set.version)
+        if data.get('timings', RESPONSE_TIMINGS):
+            result['metadata']['timings_ms'] = timer.breakdown_ms()
         
-        logger.info(f"ThingSpeak prediction successful, {len(thingspeak_data)} records fetched")
+        logger.info(f"ThingSpeak prediction successful, {thingspeak_meta['records_fetched']} records from {thingspeak_meta['source']}")
         return jsonify(result)
-        
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except PredictionTimeout as e:
+        return timeout_response(e)
     except Exception as e:
         logger.error(f"ThingSpeak prediction error: {str(e)}")
         return jsonify({
@@ -120,6 +345,382 @@ def predict():
             'details': str(e)
         }), 500
 
+# Fleet predict endpoint: many ThingSpeak channels, one batched inference
+@app.route('/predict/fleet', methods=['POST'])
+def predict_fleet():
+    """
+    Fetch every device's latest window concurrently and classify all of them in one batch
+
+    Expected JSON payload:
+    {
+        "devices": [{"channel_id": "3018524", "api_key": "P91SEPV5ZZG00Y4S"}, ...],
+        "results": 10              (optional, readings fetched per device)
+    }
+
+    A device without channel_id uses THINGSPEAK_CHANNEL_ID. Devices whose fetch
+    fails or times out are reported with their error; the others are still
+    classified (HTTP 200 as long as one device succeeded).
+    """
+    deadline = time.monotonic() + inference_pool.timeout
+    timer = StageTimer()
+    try:
+        data = request.get_json(silent=True)
+        if not data or 'devices' not in data:
+            return jsonify({
+                'error': 'Missing devices in request body',
+                'expected_format': {
+                    'devices': [{'channel_id': '3018524', 'api_key': 'P91SEPV5ZZG00Y4S'}]
+                }
+            }), 400
+        try:
+            devices = parse_devices(data['devices'], FLEET_MAX_DEVICES)
+            results = int(data.get('results', 10))
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'error': 'Invalid devices',
+                'details': str(e)
+            }), 400
+
+        # Polled channels are served from their buffers, the rest fetched concurrently
+        buffered, to_fetch = {}, []
+        for i, (channel_id, api_key) in enumerate(devices):
+            buffer_key, buffer = (None, None) if poller is None else poller.get_buffer(api_key, channel_id)
+            if buffer is not None and len(buffer) > 0:
+                buffered[i] = (buffer_key, buffer)
+            else:
+                to_fetch.append(i)
+        with timer.stage('fetch'):
+            fetched = fleet_fetcher.fetch([devices[i] for i in to_fetch], fetch_thingspeak_data, results, deadline)
+
+        model_set = registry.get()
+        reports = [None] * len(devices)
+        windows = {}
+        with timer.stage('parse'):
+            for i, (buffer_key, buffer) in buffered.items():
+                sensor_matrix, reading_times, entry_ids = buffer.snapshot()
+                windows[i] = (sensor_matrix, reading_times, entry_ids, buffer_key,
+                              {'source': 'buffer', 'records_fetched': len(sensor_matrix),
+                               **poller.freshness(buffer_key)})
+            for i, outcome in zip(to_fetch, fetched):
+                if outcome['status'] != 'ok':
+                    reports[i] = {'channel_id': outcome['channel_id'], 'status': outcome['status'],
+                                  'error': outcome['error']}
+                    continue
+                feeds = outcome['feeds']
+                sensor_matrix, reading_times, entry_ids = feeds_to_sensor_matrix(feeds)
+                if len(sensor_matrix) == 0:
+                    reports[i] = {'channel_id': outcome['channel_id'], 'status': 'error',
+                                  'error': 'Failed to process ThingSpeak data'}
+                    continue
+                windows[i] = (sensor_matrix, reading_times, entry_ids, None,
+                              {'source': 'live', 'records_fetched': len(feeds),
+                               'latest_entry_time': feeds[-1].get('created_at'), 'fetch_ms': outcome['fetch_ms']})
+
+        with timer.stage('input'):
+            order = sorted(windows)
+            rows = []
+            for i in order:
+                sensor_matrix, reading_times, _, buffer_key, _ = windows[i]
+                feature_row = streamed_features(buffer_key, model_set)
+                row, prediction_input = window_input(sensor_matrix, reading_times, feature_row, model_set)
+                rows.append(row)
+
+        if rows:
+            # One pass through the ensemble for the whole fleet
+            with timer.stage('inference'):
+                batch = inference_pool.call(predict_batch, np.vstack(rows), timings=True, deadline=deadline)
+            latency_metrics.record(batch['timings'], model_set.version)
+            record_cascade(batch['predictions'], model_set.version)
+            timer.add(batch['timings'])
+            for position, i in enumerate(order):
+                sensor_matrix, reading_times, entry_ids, _, thingspeak_meta = windows[i]
+                predictions = row_predictions(batch['predictions'], position)
+                record_history(devices[i][0], sensor_matrix, reading_times, entry_ids, predictions,
+                               model_set.version, 'fleet')
+                reports[i] = {
+                    'channel_id': devices[i][0],
+                    'status': 'ok',
+                    'input_data': np.round(sensor_matrix.mean(axis=0), 2).tolist(),
+                    'predictions': predictions,
+                    'thingspeak': thingspeak_meta
+                }
+        latency_metrics.record(timer.timings, model_set.version)
+
+        succeeded = len(rows)
+        result = {
+            'count': len(devices),
+            'succeeded': succeeded,
+            'failed': len(devices) - succeeded,
+            'devices': reports,
+            'metadata': {
+                'timestamp': datetime.now().isoformat(),
+                'sensor_names': mask_sensor_names(['MQ136', 'MQ137', 'TEMP', 'HUMI']),
+                'prediction_input': prediction_input if rows else None,
+                'model_version': model_set.version,
+                'model_versions': model_versions(model_set)
+            }
+        }
+        if data.get('timings', RESPONSE_TIMINGS):
+            result['metadata']['timings_ms'] = timer.breakdown_ms()
+
+        logger.info(f"Fleet prediction: {succeeded}/{len(devices)} devices classified")
+        return jsonify(result), 200 if succeeded else 503
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except PredictionTimeout as e:
+        return timeout_response(e)
+    except Exception as e:
+        logger.error(f"Fleet prediction error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error during fleet prediction',
+            'details': str(e)
+        }), 500
+
+# Batch predict endpoint for many sensor vectors
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_route():
+    """
+    Predict smell category for many sensor vectors in one pass
+
+    Expected JSON payload:
+    {
+        "sensor_data": [[MQ136, MQ137, TEMP, HUMI], ...]
+    }
+    """
+    try:
+        data = request.get_json(silent=True)
+
+        if not data or 'sensor_data' not in data:
+            return jsonify({
+                'error': 'Missing sensor_data in request body',
+                'expected_format': {
+                    'sensor_data': [[1650.0, 1560.0, 34.1, 99.2]]
+                }
+            }), 400
+
+        try:
+            result = inference_pool.call(predict_batch, data['sensor_data'], timings=True)
+            model_version = result.pop('model_version')
+            latency_metrics.record(result.pop('timings'), model_version)
+            record_cascade(result['predictions'], model_version)
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'error': 'Invalid sensor_data',
+                'details': str(e)
+            }), 400
+        except Overloaded as e:
+            return overloaded_response(e)
+        except PredictionTimeout as e:
+            return timeout_response(e)
+
+        original_sensor_names = ['MQ136', 'MQ137', 'TEMP', 'HUMI']
+        result['metadata'] = {
+            'timestamp': datetime.now().isoformat(),
+            'sensor_names': mask_sensor_names(original_sensor_names),
+            'model_version': model_version
+        }
+
+        logger.info(f"Batch prediction successful, {result['count']} rows")
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(f"Batch prediction error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error during batch prediction',
+            'details': str(e)
+        }), 500
+
+# Push new readings for continuous monitoring
+@app.route('/stream/<device_id>/readings', methods=['POST'])
+def stream_push(device_id):
+    """
+    Score new readings of a device and update its smoothed state
+
+    Expected JSON payload (one of):
+    {
+        "feeds": [ThingSpeak feed entries with entry_id, created_at, field1..field4]
+    }
+    {
+        "sensor_data": [[MQ136, MQ137, TEMP, HUMI], ...]
+    }
+    """
+    try:
+        data = request.get_json(silent=True)
+
+        if not data or ('feeds' not in data and 'sensor_data' not in data):
+            return jsonify({
+                'error': 'Missing feeds or sensor_data in request body',
+                'expected_format': {
+                    'feeds': [{'entry_id': 1, 'created_at': '2025-07-22T12:09:24Z',
+                               'field1': '1652', 'field2': '1587', 'field3': '34.1', 'field4': '99.2'}]
+                }
+            }), 400
+
+        try:
+            if 'feeds' in data:
+                events = stream_hub.push_feeds(device_id, data['feeds'])
+            else:
+                events = stream_hub.push_readings(device_id, data['sensor_data'])
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({
+                'error': 'Invalid readings',
+                'details': str(e)
+            }), 400
+        except Overloaded as e:
+            return overloaded_response(e)
+        except PredictionTimeout as e:
+            return timeout_response(e)
+
+        return jsonify({
+            'device_id': device_id,
+            'events': events,
+            'state': stream_hub.get_state(device_id)
+        })
+
+    except Exception as e:
+        logger.error(f"Stream push error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error during stream push',
+            'details': str(e)
+        }), 500
+
+# Current smoothed state of a device
+@app.route('/stream/<device_id>/state', methods=['GET'])
+def stream_state(device_id):
+    """Return the smoothed classification state of a device"""
+    state = stream_hub.get_state(device_id)
+    if state is None:
+        return jsonify({
+            'error': 'No readings received for device',
+            'device_id': device_id
+        }), 404
+    return jsonify(state)
+
+# Server-Sent Events feed of scored readings
+@app.route('/stream/<device_id>', methods=['GET'])
+def stream_events(device_id):
+    """Stream every scored reading of a device as Server-Sent Events"""
+    keepalive = float(os.getenv('STREAM_KEEPALIVE', 15))
+    # Each open stream holds a server thread, so their number is capped (STREAM_MAX_SUBSCRIBERS)
+    try:
+        subscriber = stream_hub.subscribe(device_id)
+    except TooManySubscribers as e:
+        return overloaded_response(e)
+
+    def generate():
+        try:
+            state = stream_hub.get_state(device_id)
+            if state is not None:
+                yield f"event: state\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: reading\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            stream_hub.unsubscribe(device_id, subscriber)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also release the slot when the response is closed before the generator started
+    response.call_on_close(lambda: stream_hub.unsubscribe(device_id, subscriber))
+    return response
+
+# History of readings and predictions
+HISTORY_MAX_ROWS = 10000
+# Longest span answered with raw rows / minute rollups when resolution is "auto"
+HISTORY_AUTO_RAW_SECONDS = 6 * 3600
+HISTORY_AUTO_MINUTE_SECONDS = 7 * 86400
+
+
+def parse_time(value, default):
+    """Unix seconds of an ISO 8601 time ('2025-07-21T08:54:00Z') or a number of seconds"""
+    if value is None or value == '':
+        return int(default)
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    timestamp = np.datetime64(value.strip().rstrip('Z').replace(' ', 'T'), 's')
+    if np.isnat(timestamp):
+        raise ValueError(f"Invalid time {value!r}")
+    return int(timestamp.astype(np.int64))
+
+
+def history_disabled_response():
+    return jsonify({
+        'error': 'History is disabled',
+        'details': 'Set HISTORY_DB to a database file to record readings and predictions'
+    }), 503
+
+
+@app.route('/history', methods=['GET'])
+def history_devices():
+    """Devices with stored history and the store's size, retention and write counters"""
+    if history is None:
+        return history_disabled_response()
+    return jsonify({
+        'devices': history.devices(),
+        'store': history.info()
+    })
+
+
+@app.route('/history/<device_id>', methods=['GET'])
+def history_range(device_id):
+    """
+    Readings and predictions of a device over a time range
+
+    Query parameters:
+        start, end:  ISO 8601 times or unix seconds (default: the last 24 hours)
+        resolution:  raw, minute, hour or auto (default; raw up to 6 hours, minute up to 7 days)
+        limit:       most raw readings / predictions returned (default 1000)
+        source:      only predictions from predict, fleet or stream (raw resolution)
+    """
+    if history is None:
+        return history_disabled_response()
+    args = request.args
+    try:
+        # end is exclusive, so the default includes what was written this second
+        end = parse_time(args.get('end'), time.time() + 1)
+        start = parse_time(args.get('start'), end - 86400)
+        limit = min(int(args.get('limit', 1000)), HISTORY_MAX_ROWS)
+        if start >= end or limit < 1:
+            raise ValueError("Expected start < end and limit >= 1")
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid history query',
+            'details': str(e)
+        }), 400
+
+    resolution = args.get('resolution', 'auto')
+    if resolution == 'auto':
+        span = end - start
+        resolution = ('raw' if span <= HISTORY_AUTO_RAW_SECONDS
+                      else 'minute' if span <= HISTORY_AUTO_MINUTE_SECONDS else 'hour')
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({
+            'error': f'Unknown resolution: {resolution}',
+            'supported_resolutions': ['auto', 'raw', *RESOLUTIONS]
+        }), 400
+
+    result = {
+        'device_id': device_id,
+        'start': f"{np.datetime64(start, 's')}Z",
+        'end': f"{np.datetime64(end, 's')}Z",
+        'resolution': resolution,
+        'sensor_names': mask_sensor_names(['MQ136', 'MQ137', 'TEMP', 'HUMI'])
+    }
+    if resolution == 'raw':
+        result['readings'] = history.readings(device_id, start, end, limit)
+        result['predictions'] = history.predictions(device_id, start, end, limit, args.get('source'))
+        result['truncated'] = len(result['readings']) == limit or len(result['predictions']) == limit
+    else:
+        result['buckets'] = history.rollups(device_id, resolution, start, end)
+    return jsonify(result)
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -127,7 +728,15 @@ def not_found(error):
         'error': 'Endpoint not found',
         'available_endpoints': {
             'GET /health': 'Health check',
-            'POST /predict': 'Predict with ThingSpeak data'
+            'GET /metrics': 'Prometheus latency histograms and counters',
+            'POST /predict': 'Predict with ThingSpeak data',
+            'POST /predict/batch': 'Predict many sensor vectors at once',
+            'POST /predict/fleet': 'Fetch and classify many ThingSpeak channels at once',
+            'POST /stream/<device_id>/readings': 'Push readings for continuous monitoring',
+            'GET /stream/<device_id>/state': 'Smoothed state of a device',
+            'GET /stream/<device_id>': 'Server-Sent Events of scored readings',
+            'GET /history': 'Devices with stored history',
+            'GET /history/<device_id>': 'Readings and predictions of a device over a time range'
         }
     }), 404
 
@@ -144,8 +753,9 @@ if __name__ == '__main__':
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
+    threaded = os.getenv('API_THREADED', 'True').lower() == 'true'
     
     logger.info(f"Starting E-Nose API server on {host}:{port}")
     logger.info(f"Debug mode: {debug}")
     
-    app.run(host=host, port=port, debug=debug) 
\ No newline at end of file
+    app.run(host=host, port=port, debug=debug, threaded=threaded) 
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""
+Micro-batching of concurrent single-row predictions
+
+When many devices call /predict at once, each request would push its own
+(1, n_features) row through all five models, and the per-call overhead
+(input validation, XGBoost's DMatrix) dominates. A MicroBatcher collects
+the rows submitted within max_wait_ms (or until max_batch rows are queued),
+runs one predict_batch over them and hands each caller its own row of the
+result with the model version that scored it. If the batch fails,
+its rows are re-run one by one so a single bad row only fails its own caller.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from predict import predict_batch, row_predictions
+from serving import Overloaded, PredictionTimeout
+
+logger = logging.getLogger(__name__)
+
+# Recent batches kept for the percentile metrics
+METRICS_WINDOW = 1000
+
+
+class BatchMetrics:
+    """Batch size and queueing delay statistics of a MicroBatcher"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.size_histogram = {}
+        self._sizes = deque(maxlen=window)
+        self._delays = deque(maxlen=window)
+
+    def record(self, size, delays):
+        """Count one batch of `size` rows whose rows waited `delays` seconds"""
+        bucket = 1 << (size - 1).bit_length()
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.size_histogram[bucket] = self.size_histogram.get(bucket, 0) + 1
+            self._sizes.append(size)
+            self._delays.extend(delays)
+
+    def snapshot(self):
+        """Counters plus mean/p50/p95/max batch size and queueing delay (ms) of recent batches"""
+        with self._lock:
+            sizes = np.array(self._sizes, dtype=float)
+            delays = np.array(self._delays, dtype=float) * 1000
+            result = {
+                'batches': self.batches,
+                'items': self.items,
+                'batch_size_histogram': {f"<={k}": v for k, v in sorted(self.size_histogram.items())},
+            }
+        for name, values in (('batch_size', sizes), ('queue_delay_ms', delays)):
+            if len(values):
+                result[name] = {
+                    'mean': round(float(values.mean()), 3),
+                    'p50': round(float(np.percentile(values, 50)), 3),
+                    'p95': round(float(np.percentile(values, 95)), 3),
+                    'max': round(float(values.max()), 3),
+                }
+        return result
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions into batched calls
+
+    Args:
+        max_batch (int): Most rows per batch
+        max_wait_ms (float): Longest a row waits for others before its batch runs
+        run_batch (callable, optional): Called with an (N, n_features) matrix, returns
+            predict_batch output; defaults to predict_batch in this process
+        threads (int): Batches that may run at the same time (e.g. one per inference worker)
+    """
+
+    def __init__(self, max_batch=32, max_wait_ms=2.0, run_batch=None, threads=1):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.run_batch = run_batch or predict_batch
+        self.metrics = BatchMetrics()
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f'micro-batcher-{i}', daemon=True)
+            for i in range(max(threads, 1))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, row):
+        """
+        Queue one row
+
+        Returns:
+            Future: Resolves to {'predictions': the row's predictions per (masked) model
+                name, 'model_version': version of the model set that scored it}
+        """
+        row = np.asarray(row, dtype=float).reshape(-1)
+        future = Future()
+        self._queue.put((row, future, time.monotonic()))
+        return future
+
+    def predict(self, row, timeout=None):
+        """
+        Predict one row through the batcher
+
+        Raises:
+            PredictionTimeout: If the batch did not finish within timeout seconds
+        """
+        future = self.submit(row)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # A row still queued is dropped instead of being scored for nobody
+            future.cancel()
+            raise PredictionTimeout("Batched prediction did not finish within the request deadline") from None
+
+    def _collect(self, first):
+        """Gather rows of the same width as `first` until the batch is full or its wait is over"""
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if len(item[0]) != len(first[0]):
+                # Another input width (e.g. across a model swap) starts the next batch
+                return batch, item
+            batch.append(item)
+        return batch, None
+
+    def _loop(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            batch, carry = self._collect(first)
+            started = time.monotonic()
+            # Drop rows whose future was cancelled while queued
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                result = self.run_batch(np.vstack([row for row, _, _ in batch]))
+            except (Overloaded, PredictionTimeout) as e:
+                # The pool itself is saturated, retrying row by row would only add load
+                self._fail(batch, e)
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    self._fail(batch, e)
+                else:
+                    logger.warning(f"Batch of {len(batch)} rows failed ({e}), re-running the rows one by one")
+                    self._run_singly(batch)
+                continue
+            self.metrics.record(len(batch), [started - queued for _, _, queued in batch])
+            for i, (_, future, _) in enumerate(batch):
+                if not future.done():
+                    future.set_result(row_result(result, i))
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run_singly(self, batch):
+        """Score the rows of a failed batch separately so only the offending rows fail"""
+        for row, future, _ in batch:
+            if future.done():
+                continue
+            try:
+                result = self.run_batch(row.reshape(1, -1))
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(row_result(result, 0))
+
+
+def row_result(result, i):
+    """Row i of a predict_batch result, with the model version that scored it"""
+    return {'predictions': row_predictions(result['predictions'], i),
+            'model_version': result.get('model_version')}
+
+
+def batcher_from_env(run_batch=None, threads=1):
+    """
+    Build the MicroBatcher described by the environment, or None when disabled
+
+    BATCH_MAX_WAIT_MS: longest wait for more rows, 0 disables batching (default 2)
+    BATCH_MAX_SIZE: most rows per batch (default 32)
+    """
+    max_wait_ms = float(os.getenv('BATCH_MAX_WAIT_MS', 2))
+    if max_wait_ms <= 0:
+        return None
+    max_batch = int(os.getenv('BATCH_MAX_SIZE', 32))
+    logger.info(f"Micro-batching predictions: up to {max_batch} rows or {max_wait_ms} ms")
+    return MicroBatcher(max_batch=max_batch, max_wait_ms=max_wait_ms, run_batch=run_batch, threads=threads)
@@ -0,0 +1,129 @@
+"""
+Bounded LRU/TTL cache of single-row predictions
+
+Devices that report steady readings send the same (or nearly the same)
+input row again and again. Rows are quantized to a fixed number of
+significant digits and cached per model-set version, so a repeated row is
+answered without touching the ensemble. Entries expire after a TTL, the
+least recently used one is evicted when the cache is full, and everything
+is dropped as soon as the registry serves a new model-set version.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def quantize(row, digits):
+    """Round every value of a row to `digits` significant digits"""
+    row = np.asarray(row, dtype=np.float64).reshape(-1)
+    magnitude = np.floor(np.log10(np.abs(np.where(row == 0, 1.0, row))))
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round(row * scale) / scale
+
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache with per-entry expiry, keyed on quantized rows
+
+    Args:
+        maxsize (int): Most entries kept
+        ttl (float): Seconds an entry stays valid
+        digits (int): Significant digits rows are quantized to
+    """
+
+    def __init__(self, maxsize=100, ttl=300.0, digits=5):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.digits = digits
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidations': 0}
+
+    def key(self, row):
+        return quantize(row, self.digits).tobytes()
+
+    def _check_version(self, version):
+        """Drop every entry when the model set changed (lock held)"""
+        if version != self.version:
+            if self._entries:
+                self.stats['invalidations'] += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, version, row):
+        """
+        Cached value for a row under a model-set version
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        key = self.key(row)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, version, row, value):
+        """Store a value for a row computed with the given model-set version"""
+        key = self.key(row)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Size, limits, hit/miss counters and hit rate"""
+        with self._lock:
+            stats = dict(self.stats)
+            size = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'digits': self.digits,
+            'model_version': self.version,
+            **stats,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None,
+        }
+
+
+def cache_from_env():
+    """
+    Build the PredictionCache described by the environment, or None when disabled
+
+    MODEL_CACHE_SIZE: most cached rows, 0 disables the cache (default 100)
+    PREDICTION_CACHE_TTL: seconds an entry stays valid (default 300)
+    PREDICTION_CACHE_DIGITS: significant digits rows are quantized to (default 5)
+    """
+    maxsize = int(os.getenv('MODEL_CACHE_SIZE', 100))
+    if maxsize <= 0:
+        return None
+    return PredictionCache(
+        maxsize=maxsize,
+        ttl=float(os.getenv('PREDICTION_CACHE_TTL', 300)),
+        digits=int(os.getenv('PREDICTION_CACHE_DIGITS', 5))
+    )
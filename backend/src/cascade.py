@@ -0,0 +1,240 @@
+"""
+Confidence-gated cascade over the stacked ensemble
+
+Most readings are easy (spoiled meat, label 4, sits far from the other
+classes), yet every prediction runs all four base models and the
+meta-model. With a cascade, one cheap base member scores the rows first;
+a row whose top probability clears that class's threshold is answered
+right away, and only the ambiguous rows go through the remaining members
+and the meta-model.
+
+``python cascade.py fit`` picks the member and its thresholds offline. For
+every member, the per-class thresholds are the lowest top-probability at
+which the member's early answers still reach --target-accuracy on the
+tuning half of the test rows train_base_model.py held out, as saved in
+models/stacking (the same halves fast.py uses; the thresholds are
+in the member's own probability scale, so they also calibrate it). The
+member with the lowest expected cost (its own latency plus the escalation
+rate times the rest of the stack) wins. The cascade is then checked on the
+validation half: if its accuracy is more than --tolerance below the full
+stack's, nothing is written. The escalation rate is part of the report.
+
+With INFERENCE_CASCADE=True the API serves predictions through the cascade
+saved for the active model set (models/cascade.json); rows answered early
+report the member and `meta` only, with "escalated": false in `meta`.
+
+Usage:
+    python cascade.py fit [--target-accuracy 0.995] [--tolerance 0.005] [--min-support 20]
+    python cascade.py report    # evaluate the saved cascade on the validation rows
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from registry import MODELS_DIR
+
+CASCADE_FILE = 'cascade.json'
+
+DEFAULT_TARGET_ACCURACY = 0.995
+DEFAULT_TOLERANCE = 0.005
+# Fewest tuning rows a class threshold may be fitted on; classes with fewer early answers always escalate
+DEFAULT_MIN_SUPPORT = 20
+
+
+class Cascade:
+    """
+    Early-exit rule of one base member
+
+    Args:
+        member (str): Base model key (rf, xgb, knn, ann) scored first
+        thresholds (list): Per class index, the top probability at or above which the
+            member's answer is final; None (or inf) means that class always escalates
+        source_version (str): Version of the model set the thresholds were fitted on
+        report (dict, optional): Fit and validation results
+    """
+
+    def __init__(self, member, thresholds, source_version, report=None):
+        self.member = member
+        self.thresholds = np.array([np.inf if t is None else t for t in thresholds], dtype=np.float64)
+        self.source_version = source_version
+        self.report = report or {}
+
+    def early_exit(self, proba):
+        """Rows of the member's probabilities that clear their predicted class's threshold"""
+        index = np.argmax(proba, axis=1)
+        return proba[np.arange(len(index)), index] >= self.thresholds[index]
+
+    def to_dict(self):
+        return {
+            'member': self.member,
+            'thresholds': [None if np.isinf(t) else float(t) for t in self.thresholds],
+            'source_version': self.source_version,
+            'report': self.report,
+        }
+
+    def save(self, path=None):
+        path = path or os.path.join(MODELS_DIR, CASCADE_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.path.join(MODELS_DIR, CASCADE_FILE)
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['member'], data['thresholds'], data['source_version'], data.get('report'))
+
+
+def fit_thresholds(proba, y, classes, target_accuracy, min_support=DEFAULT_MIN_SUPPORT):
+    """
+    Lowest top-probability per predicted class whose early answers reach target_accuracy
+
+    For the rows predicted as each class, sorted by confidence, the threshold
+    is the confidence of the longest prefix (never splitting tied
+    confidences) that is at least target_accuracy correct and has at least
+    min_support rows.
+
+    Returns:
+        list: Threshold per class index, None when no prefix qualifies
+    """
+    index = np.argmax(proba, axis=1)
+    confidence = proba[np.arange(len(index)), index]
+    correct = np.asarray(classes)[index].astype(int) == y
+    thresholds = []
+    for c in range(len(classes)):
+        rows = np.flatnonzero(index == c)
+        order = rows[np.argsort(-confidence[rows], kind='stable')]
+        conf = confidence[order]
+        precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+        # A cut after position k accepts conf >= conf[k], so only cut where the next row is less confident
+        cut = np.append(conf[1:] < conf[:-1], True) if len(conf) else np.zeros(0, dtype=bool)
+        ok = np.flatnonzero(cut & (precision >= target_accuracy) & (np.arange(1, len(order) + 1) >= min_support))
+        thresholds.append(float(conf[ok[-1]]) if len(ok) else None)
+    return thresholds
+
+
+def stack_probabilities(model_set, X):
+    """Every base model's and the meta-model's probabilities of raw model inputs, without the cascade"""
+    X_scaled = model_set.scaler.transform(X)
+    probabilities = {name: model.predict_proba(X_scaled) for name, model in model_set.base_models.items()}
+    probabilities['meta'] = model_set.meta_model.predict_proba(
+        np.hstack([probabilities[name] for name in model_set.base_models]))
+    return probabilities
+
+
+def evaluate(cascade, probabilities, y, classes):
+    """Accuracy and escalation rate of a cascade given the stack's probabilities on labelled rows"""
+    classes = np.asarray(classes)
+    member = probabilities[cascade.member]
+    early = cascade.early_exit(member)
+    final = np.where(early[:, None], member, probabilities['meta'])
+    correct = classes[np.argmax(final, axis=1)].astype(int) == y
+    full_correct = classes[np.argmax(probabilities['meta'], axis=1)].astype(int) == y
+    return {
+        'rows': len(y),
+        'escalation_rate': round(float(1 - early.mean()), 6),
+        'early_exit_accuracy': round(float(correct[early].mean()), 6) if early.any() else None,
+        'accuracy': round(float(correct.mean()), 6),
+        'full_accuracy': round(float(full_correct.mean()), 6),
+    }
+
+
+def fit(model_set, target_accuracy=DEFAULT_TARGET_ACCURACY, tolerance=DEFAULT_TOLERANCE,
+        min_support=DEFAULT_MIN_SUPPORT, split=None):
+    """
+    Choose the cascade member and thresholds and validate them
+
+    Args:
+        split (tuple, optional): fast.held_out_split() of the model set, loaded when omitted
+
+    Returns:
+        Cascade: The fitted cascade; report['passed'] says whether it passed validation
+    """
+    from fast import held_out_split, latency_ms
+
+    classes = model_set.classes
+    X_tune, y_tune, X_valid, y_valid = split or held_out_split(model_set.features)
+    tune = stack_probabilities(model_set, X_tune)
+
+    # Cost of one row through each member and through the whole stack
+    row = model_set.scaler.transform(X_tune[:1])
+    costs = {name: latency_ms(lambda: model.predict_proba(row), repeat=50)
+             for name, model in model_set.base_models.items()}
+    full_cost = latency_ms(lambda: stack_probabilities(model_set, X_tune[:1]), repeat=50)
+
+    candidates = {}
+    for name in model_set.base_models:
+        thresholds = fit_thresholds(tune[name], y_tune, classes, target_accuracy, min_support)
+        stats = evaluate(Cascade(name, thresholds, model_set.version), tune, y_tune, classes)
+        # Escalated rows reuse the member's probabilities and run the rest of the stack
+        expected = costs[name] + stats['escalation_rate'] * (full_cost - costs[name])
+        candidates[name] = {'thresholds': thresholds, 'member_ms': round(costs[name], 4),
+                            'expected_ms': round(expected, 4), 'tune': stats}
+    member = min(candidates, key=lambda name: candidates[name]['expected_ms'])
+
+    cascade = Cascade(member, candidates[member]['thresholds'], model_set.version)
+    validation = evaluate(cascade, stack_probabilities(model_set, X_valid), y_valid, classes)
+    cascade.report = {
+        'target_accuracy': target_accuracy,
+        'tolerance': tolerance,
+        'min_support': min_support,
+        'full_ms': round(full_cost, 4),
+        'candidates': candidates,
+        'validation': validation,
+        'passed': validation['accuracy'] >= validation['full_accuracy'] - tolerance,
+    }
+    return cascade
+
+
+def main(argv):
+    from registry import registry
+
+    parser = argparse.ArgumentParser(description="Fit or evaluate the confidence-gated cascade")
+    parser.add_argument('command', nargs='?', choices=['fit', 'report'], default='fit')
+    parser.add_argument('--target-accuracy', type=float, default=DEFAULT_TARGET_ACCURACY,
+                        help="Accuracy the early answers of each class must reach on the tuning rows")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Largest accuracy drop against the full stack on the validation rows")
+    parser.add_argument('--min-support', type=int, default=DEFAULT_MIN_SUPPORT,
+                        help="Fewest tuning rows a class threshold is fitted on")
+    args = parser.parse_args(argv[1:])
+
+    from fast import held_out_split
+
+    model_set = registry.get()
+    try:
+        split = held_out_split(model_set.features)
+    except ValueError as e:
+        print(e)
+        return 1
+    if args.command == 'report':
+        cascade = Cascade.load()
+        if cascade.source_version != model_set.version:
+            print(f"Cascade was fitted on model set {cascade.source_version}, models are {model_set.version}")
+            return 1
+        _, _, X_valid, y_valid = split
+        report = evaluate(cascade, stack_probabilities(model_set, X_valid), y_valid, model_set.classes)
+        print(json.dumps({'member': cascade.member, **report}, indent=4))
+        return 0
+
+    cascade = fit(model_set, args.target_accuracy, args.tolerance, args.min_support, split)
+    print(json.dumps(cascade.to_dict(), indent=4))
+    validation = cascade.report['validation']
+    if not cascade.report['passed']:
+        print(f"Cascade accuracy {validation['accuracy']:.4f} is more than {args.tolerance} below the full "
+              f"stack's {validation['full_accuracy']:.4f}; nothing written")
+        return 1
+    path = cascade.save()
+    print(f"Cascade on {cascade.member} for model set {model_set.version} written to {path}: "
+          f"{validation['escalation_rate']:.1%} of validation rows escalated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
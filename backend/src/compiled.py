@@ -0,0 +1,682 @@
+"""
+Compiled (fused NumPy) inference kernel for the stacked ensemble
+
+Exports the fitted scaler, RandomForest, XGBoost, KNN, MLP and meta
+LogisticRegression into flat arrays (array-packed trees, MLP weights with the
+scaler folded into the first layer, KNN reference matrix, meta coefficients)
+and evaluates the whole stack with vectorized NumPy only, so a prediction no
+longer pays sklearn/xgboost Python overhead five times.
+
+The registry attaches the saved kernel to the model set it was exported
+from; set INFERENCE_ENGINE=compiled to serve small batches with it.
+
+The same arrays can be written as a binary artifact: one .npy file per
+array plus manifest.json (scalars, names, the source model hashes and a
+content hash of everything). It loads with mmap, so every API worker
+shares the same page-cache pages instead of unpickling a private copy, and
+with MODEL_FORMAT=binary the registry serves the whole set from it without
+importing scikit-learn or xgboost.
+
+Usage:
+    python compiled.py export          # build models/ensemble_compiled.npz and verify it
+    python compiled.py verify          # compare the saved kernel against the pickles
+    python compiled.py export-binary   # build models/ensemble_binary/ and verify it
+    python compiled.py verify-binary   # check the binary artifact's hash and compare it against the pickles
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from registry import MODELS_DIR, replace_directory
+
+COMPILED_FILE = 'ensemble_compiled.npz'
+BINARY_DIR = 'ensemble_binary'
+MANIFEST_FILE = 'manifest.json'
+BINARY_FORMAT = 1
+
+# Rows scored per block when computing KNN distances, bounds memory to block x n_reference
+KNN_BLOCK_ROWS = 256
+
+# Up to this many rows, trees are evaluated as leaf boxes (constant number of
+# NumPy calls); larger batches walk the trees level by level
+BOX_MAX_ROWS = 8
+
+# Agreement required between the kernel and the pickled models at export time
+PROBABILITY_TOLERANCE = 1e-6
+# Verification rows also scored in batches of 1..BOX_MAX_ROWS rows, the leaf-box path of single requests
+SMALL_BATCH_ROWS = 512
+
+
+def _float32_at_most(threshold):
+    """Largest float32 not greater than threshold, so float32 x <= t64 iff x <= result"""
+    threshold = np.asarray(threshold, dtype=np.float64)
+    t32 = threshold.astype(np.float32)
+    too_big = t32.astype(np.float64) > threshold
+    t32[too_big] = np.nextafter(t32[too_big], np.float32(-np.inf))
+    return t32
+
+
+def _pack_trees(trees):
+    """
+    Concatenate trees into flat node arrays with global child indices
+
+    Every split is stored as "go left if x <= threshold" on float32 features.
+    Leaves point to themselves on both sides (feature 0, threshold +inf), so a
+    fixed number of lockstep steps over all trees ends on the leaves.
+
+    Args:
+        trees (list): Dicts with 'feature', 'threshold' (float32, <= semantics),
+                      'left', 'right' (local indices, -1 for leaves) and 'value'
+
+    Returns:
+        dict: Packed 'feature', 'threshold', 'children', 'value', 'roots' arrays;
+              children[2 * node + 1] is the left child, children[2 * node] the right one
+    """
+    offsets = np.cumsum([0] + [len(t['feature']) for t in trees])
+    features, thresholds, children = [], [], []
+    for offset, tree in zip(offsets, trees):
+        left = np.asarray(tree['left'], dtype=np.int64)
+        right = np.asarray(tree['right'], dtype=np.int64)
+        leaf = left < 0
+        nodes = offset + np.arange(len(left))
+        features.append(np.where(leaf, 0, tree['feature']))
+        thresholds.append(np.where(leaf, np.float32(np.inf), tree['threshold']))
+        pair = np.empty((len(left), 2), dtype=np.int64)
+        pair[:, 0] = np.where(leaf, nodes, right + offset)
+        pair[:, 1] = np.where(leaf, nodes, left + offset)
+        children.append(pair.ravel())
+    return {
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float32),
+        'children': np.concatenate(children).astype(np.int32),
+        'value': np.concatenate([t['value'] for t in trees]),
+        'roots': offsets[:-1].astype(np.int32),
+    }
+
+
+def _leaf_boxes(packed, n_features):
+    """
+    Axis-aligned box of every leaf: a row reaches the leaf iff lo < x <= hi on all features
+
+    Returns:
+        tuple: (lo (n_features, n_leaves) float32, hi (n_features, n_leaves) float32,
+                leaves (n_leaves,) node index of each leaf)
+    """
+    feature, threshold, children = packed['feature'], packed['threshold'], packed['children']
+    lows, highs, leaves = [], [], []
+    for root in packed['roots']:
+        stack = [(int(root), np.full(n_features, -np.inf, np.float32), np.full(n_features, np.inf, np.float32))]
+        while stack:
+            node, lo, hi = stack.pop()
+            left, right = int(children[2 * node + 1]), int(children[2 * node])
+            if left == node:
+                lows.append(lo)
+                highs.append(hi)
+                leaves.append(node)
+                continue
+            f = feature[node]
+            left_hi = hi.copy()
+            left_hi[f] = min(left_hi[f], threshold[node])
+            right_lo = lo.copy()
+            right_lo[f] = max(right_lo[f], threshold[node])
+            stack.append((left, lo, left_hi))
+            stack.append((right, right_lo, hi))
+    return (np.ascontiguousarray(np.array(lows).T), np.ascontiguousarray(np.array(highs).T),
+            np.array(leaves, dtype=np.int64))
+
+
+def _export_random_forest(rf):
+    trees = []
+    depth = 0
+    for estimator in rf.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :].astype(np.float64)
+        value = value / value.sum(axis=1, keepdims=True)
+        trees.append({
+            'feature': tree.feature,
+            # sklearn compares float32 features against float64 thresholds with <=
+            'threshold': _float32_at_most(tree.threshold),
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'value': value,
+        })
+        depth = max(depth, tree.max_depth)
+    packed = _pack_trees(trees)
+    lo, hi, leaves = _leaf_boxes(packed, rf.n_features_in_)
+    packed['box_lo'], packed['box_hi'] = lo, hi
+    # Averaging over trees folded into the leaf values
+    packed['box_value'] = packed['value'][leaves] / len(trees)
+    return {f'rf_{key}': array for key, array in packed.items()} | {'rf_depth': np.int32(depth)}
+
+
+def _export_xgboost(xgb_model):
+    booster = xgb_model.get_booster()
+    model = json.loads(booster.save_raw('json'))
+    learner = model['learner']
+    if learner['objective']['name'] != 'multi:softprob':
+        raise ValueError(f"Unsupported XGBoost objective {learner['objective']['name']}")
+    gbtree = learner['gradient_booster']['model']
+
+    trees = []
+    depth = 0
+    for tree in gbtree['trees']:
+        left = np.asarray(tree['left_children'], dtype=np.int64)
+        leaf = left < 0
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        trees.append({
+            'feature': np.asarray(tree['split_indices'], dtype=np.int64),
+            # XGBoost goes left when x < condition, i.e. x <= the next float32 below it
+            'threshold': np.nextafter(conditions, np.float32(-np.inf)),
+            'left': left,
+            'right': np.asarray(tree['right_children'], dtype=np.int64),
+            # Leaf weights live in split_conditions for leaf nodes
+            'value': np.where(leaf, conditions, np.float32(0)),
+            'default_left': np.asarray(tree['default_left'], dtype=bool) & ~leaf,
+        })
+        # Depth of a binary tree stored parent-before-child
+        parents = np.asarray(tree['parents'], dtype=np.int64)
+        node_depth = np.zeros(len(left), dtype=np.int64)
+        for node in range(1, len(left)):
+            node_depth[node] = node_depth[parents[node]] + 1
+        depth = max(depth, int(node_depth.max()))
+
+    packed = _pack_trees(trees)
+    packed['default_left'] = np.concatenate([t['default_left'] for t in trees])
+    tree_info = np.asarray(gbtree['tree_info'], dtype=np.int64)
+    n_classes = int(learner['learner_model_param']['num_class'])
+    # One-hot tree -> class matrix so per-class margins are a single matmul
+    tree_class = np.zeros((len(tree_info), n_classes), dtype=np.float32)
+    tree_class[np.arange(len(tree_info)), tree_info] = 1.0
+    lo, hi, leaves = _leaf_boxes(packed, int(learner['learner_model_param']['num_feature']))
+    packed['box_lo'], packed['box_hi'] = lo, hi
+    # Each leaf contributes its weight to its tree's class margin
+    leaf_tree = np.searchsorted(packed['roots'], leaves, side='right') - 1
+    packed['box_value'] = packed['value'][leaves, None].astype(np.float64) * tree_class[leaf_tree]
+    exported = {f'xgb_{key}': array for key, array in packed.items()}
+    exported['xgb_tree_class'] = tree_class
+    exported['xgb_depth'] = np.int32(depth)
+    return exported
+
+
+def _export_knn(knn):
+    knn = getattr(knn, 'estimator', knn)
+    if knn.weights != 'uniform' or knn.effective_metric_ not in ('manhattan', 'cityblock', 'l1'):
+        raise ValueError(f"Unsupported KNN configuration weights={knn.weights} metric={knn.effective_metric_}")
+    return {
+        'knn_reference': np.asarray(knn._fit_X, dtype=np.float64),
+        'knn_labels': np.asarray(knn._y, dtype=np.int32),
+        'knn_k': np.int32(knn.n_neighbors),
+    }
+
+
+def _export_mlp(mlp, scaler):
+    if mlp.out_activation_ != 'softmax':
+        raise ValueError(f"Unsupported MLP output activation {mlp.out_activation_}")
+    exported = {'ann_activation': np.array(mlp.activation), 'ann_layers': np.int32(len(mlp.coefs_))}
+    for i, (W, b) in enumerate(zip(mlp.coefs_, mlp.intercepts_)):
+        W = np.asarray(W, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        if i == 0:
+            # Fold (x - mean) / scale into the first layer
+            b = b - (scaler.mean_ / scaler.scale_) @ W
+            W = W / scaler.scale_[:, None]
+        exported[f'ann_W{i}'] = W
+        exported[f'ann_b{i}'] = b
+    return exported
+
+
+def _export_meta(meta_model):
+    if hasattr(meta_model, 'estimators_'):
+        # OneVsRestClassifier (training.make_meta_model): one binary regression per class
+        coef = np.vstack([estimator.coef_ for estimator in meta_model.estimators_]).astype(np.float64)
+        intercept = np.concatenate([estimator.intercept_ for estimator in meta_model.estimators_]).astype(np.float64)
+    else:
+        coef = np.asarray(meta_model.coef_, dtype=np.float64)
+        intercept = np.asarray(meta_model.intercept_, dtype=np.float64)
+    # Whether predict_proba normalizes one-vs-rest sigmoids or takes a softmax
+    # depends on the training options and on the installed sklearn; ask it directly
+    probe = np.random.default_rng(0).random((8, coef.shape[1]))
+    scores = probe @ coef.T + intercept
+    sigmoid = 1.0 / (1.0 + np.exp(-scores))
+    ovr = np.allclose(meta_model.predict_proba(probe), sigmoid / sigmoid.sum(axis=1, keepdims=True))
+    return {
+        'meta_coef': coef,
+        'meta_intercept': intercept,
+        'meta_ovr': np.bool_(ovr),
+    }
+
+
+def export_ensemble(model_set):
+    """
+    Turn a loaded ModelSet into the flat arrays of a CompiledEnsemble
+
+    Args:
+        model_set (ModelSet): Loaded ensemble
+
+    Returns:
+        dict: Name -> NumPy array
+    """
+    scaler = model_set.scaler
+    base = model_set.base_models
+    arrays = {
+        'classes': np.asarray(model_set.classes, dtype=np.float64),
+        'scaler_mean': np.asarray(scaler.mean_, dtype=np.float64),
+        'scaler_scale': np.asarray(scaler.scale_, dtype=np.float64),
+        'base_order': np.array(list(base)),
+        'source_version': np.array(model_set.version),
+        'model_hashes': np.array(json.dumps(model_set.model_hashes, sort_keys=True)),
+    }
+    arrays.update(_export_random_forest(base['rf']))
+    arrays.update(_export_xgboost(base['xgb']))
+    arrays.update(_export_knn(base['knn']))
+    arrays.update(_export_mlp(base['ann'], scaler))
+    arrays.update(_export_meta(model_set.meta_model))
+    return arrays
+
+
+def content_hash(arrays, metadata):
+    """sha256 over every array's name, dtype, shape and bytes plus the manifest metadata"""
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape};".encode())
+        digest.update(array.data)
+    digest.update(json.dumps(metadata, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _traverse(X32, feature, threshold, children, roots, depth, default_left=None):
+    """
+    Walk all packed trees for all rows at once, one tree level per step
+
+    Args:
+        X32 (np.ndarray): float32 feature matrix of shape (N, n_features)
+        default_left (np.ndarray, optional): Per-node direction for NaN features
+
+    Returns:
+        np.ndarray: (N, n_trees) leaf node index reached by each row in each tree
+    """
+    n_rows, n_features = X32.shape
+    X_flat = X32.ravel()
+    row_offset = (np.arange(n_rows, dtype=np.int32) * n_features)[:, None]
+    node = np.broadcast_to(roots, (n_rows, len(roots))).copy()
+    has_nan = default_left is not None and np.isnan(X_flat).any()
+    for _ in range(int(depth)):
+        x = X_flat[row_offset + feature[node]]
+        go_left = x <= threshold[node]
+        if has_nan:
+            go_left |= np.isnan(x) & default_left[node]
+        node = children[2 * node + go_left]
+    return node
+
+
+def _box_sum(X32, lo, hi, value):
+    """Sum the values of the leaves whose boxes contain each row: (N, n_leaves) hits @ value"""
+    hit = (X32[:, :1] > lo[0]) & (X32[:, :1] <= hi[0])
+    for f in range(1, X32.shape[1]):
+        hit &= (X32[:, f:f + 1] > lo[f]) & (X32[:, f:f + 1] <= hi[f])
+    return hit @ value
+
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+_ACTIVATIONS = {
+    'relu': lambda z: np.maximum(z, 0.0),
+    'tanh': np.tanh,
+    'logistic': lambda z: 1.0 / (1.0 + np.exp(-z)),
+    'identity': lambda z: z,
+}
+
+
+class CompiledEnsemble:
+    """
+    Pure NumPy evaluation of the exported stack
+
+    Args:
+        arrays (Mapping): Arrays produced by export_ensemble (or loaded from disk)
+    """
+
+    def __init__(self, arrays):
+        self.a = {key: arrays[key] for key in arrays}
+        self.classes = self.a['classes']
+        self.base_order = [str(name) for name in self.a['base_order']]
+        self.source_version = str(self.a['source_version'])
+        # Content hashes of the artifacts the kernel was exported from, keyed like base_order
+        self.model_hashes = json.loads(str(self.a['model_hashes'])) if 'model_hashes' in self.a else {}
+        # Set when loaded from a binary artifact
+        self.content_hash = None
+        # Pruned kernels (see fast.py) may have no MLP
+        self._activation = _ACTIVATIONS[str(self.a['ann_activation'])] if 'ann_activation' in self.a else None
+        # GridKNNIndex over knn_reference, attached by the registry when one was built
+        self.knn_index = None
+
+    @classmethod
+    def load(cls, path=None):
+        """Load a kernel saved with save()"""
+        path = path or os.path.join(MODELS_DIR, COMPILED_FILE)
+        with np.load(path, allow_pickle=False) as data:
+            return cls(dict(data))
+
+    def save(self, path=None):
+        """Write the kernel arrays as an uncompressed .npz"""
+        path = path or os.path.join(MODELS_DIR, COMPILED_FILE)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **self.a)
+        os.replace(tmp, path)
+        return path
+
+    def save_binary(self, path=None):
+        """
+        Write the kernel as a binary artifact directory: <name>.npy per array plus manifest.json
+
+        Scalars and strings go into the manifest. The export is written to a
+        fresh directory and swapped in (see replace_directory), never over the
+        .npy files a running server may have memory-mapped.
+        """
+        path = path or os.path.join(MODELS_DIR, BINARY_DIR)
+        arrays, attributes = {}, {}
+        for name, value in self.a.items():
+            if name in ('source_version', 'model_hashes'):
+                continue
+            value = np.asarray(value)
+            if value.ndim == 0 or value.dtype.kind == 'U':
+                attributes[name] = value.tolist()
+            else:
+                arrays[name] = np.ascontiguousarray(value)
+        metadata = {'source_version': self.source_version, 'model_hashes': self.model_hashes,
+                    'attributes': attributes}
+        manifest = {
+            'format': BINARY_FORMAT,
+            'content_hash': content_hash(arrays, metadata),
+            'arrays': {name: {'dtype': array.dtype.str, 'shape': list(array.shape)} for name, array in arrays.items()},
+            **metadata,
+        }
+
+        def write(directory):
+            for name, array in arrays.items():
+                np.save(os.path.join(directory, f'{name}.npy'), array)
+            with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=4)
+
+        return replace_directory(path, write)
+
+    @classmethod
+    def load_binary(cls, path=None, mmap_mode='r', verify=True):
+        """
+        Load a binary artifact written by save_binary(); arrays are memory-mapped by default
+
+        Raises:
+            ValueError: If the format is unknown, an array does not match the
+                manifest, or (with verify) the content hash differs
+        """
+        path = path or os.path.join(MODELS_DIR, BINARY_DIR)
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != BINARY_FORMAT:
+            raise ValueError(f"Unsupported binary artifact format {manifest.get('format')}")
+        arrays = {}
+        for name, spec in manifest['arrays'].items():
+            array = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+            if array.dtype.str != spec['dtype'] or list(array.shape) != spec['shape']:
+                raise ValueError(f"{name}.npy is {array.dtype.str} {list(array.shape)}, "
+                                 f"manifest says {spec['dtype']} {spec['shape']}")
+            arrays[name] = array
+        metadata = {key: manifest[key] for key in ('source_version', 'model_hashes', 'attributes')}
+        if verify and content_hash(arrays, metadata) != manifest['content_hash']:
+            raise ValueError(f"Content hash of {path} does not match its manifest")
+        arrays.update({name: np.array(value) for name, value in manifest['attributes'].items()})
+        arrays['source_version'] = np.array(manifest['source_version'])
+        arrays['model_hashes'] = np.array(json.dumps(manifest['model_hashes'], sort_keys=True))
+        compiled = cls(arrays)
+        compiled.content_hash = manifest['content_hash']
+        return compiled
+
+    def members(self):
+        """
+        sklearn-style stand-ins for the scaler, the base models and the meta-model
+
+        Returns:
+            tuple: (scaler, base models dict in meta-feature order, meta-model), each
+                   with the attributes and methods predict.run_ensemble and the registry use
+        """
+        mean, scale = self.a['scaler_mean'], self.a['scaler_scale']
+        # The MLP's first layer has the scaler folded in, so it takes unscaled rows
+        members = {
+            'rf': self.rf_proba,
+            'xgb': self.xgb_proba,
+            'knn': self.knn_proba,
+            'ann': lambda X_scaled: self.ann_proba(X_scaled * scale + mean),
+        }
+        base_models = {name: CompiledMember(members[name], self.classes) for name in self.base_order}
+        return CompiledScaler(mean, scale), base_models, CompiledMember(self.meta_proba, self.classes)
+
+    def scale(self, X):
+        return (X - self.a['scaler_mean']) / self.a['scaler_scale']
+
+    def member_proba(self, name, X, X_scaled):
+        """Probabilities of one base member; the MLP takes the unscaled rows"""
+        if name == 'ann':
+            return self.ann_proba(X)
+        return getattr(self, f'{name}_proba')(X_scaled)
+
+    def rf_proba(self, X_scaled):
+        a = self.a
+        X32 = X_scaled.astype(np.float32)
+        if X32.shape[0] <= BOX_MAX_ROWS:
+            return _box_sum(X32, a['rf_box_lo'], a['rf_box_hi'], a['rf_box_value'])
+        leaves = _traverse(X32, a['rf_feature'], a['rf_threshold'], a['rf_children'],
+                           a['rf_roots'], a['rf_depth'])
+        return a['rf_value'][leaves].mean(axis=1)
+
+    def xgb_proba(self, X_scaled):
+        a = self.a
+        X32 = X_scaled.astype(np.float32)
+        # The constant base margin is identical for every class and cancels in the softmax
+        if X32.shape[0] <= BOX_MAX_ROWS and not np.isnan(X32).any():
+            margins = _box_sum(X32, a['xgb_box_lo'], a['xgb_box_hi'], a['xgb_box_value'])
+        else:
+            leaves = _traverse(X32, a['xgb_feature'], a['xgb_threshold'], a['xgb_children'],
+                               a['xgb_roots'], a['xgb_depth'], default_left=a['xgb_default_left'])
+            margins = a['xgb_value'][leaves].astype(np.float64) @ a['xgb_tree_class']
+        return _softmax(margins)
+
+    def knn_proba(self, X_scaled):
+        if self.knn_index is not None:
+            return self.knn_index.predict_proba(X_scaled)
+        if not np.isfinite(X_scaled).all():
+            # Distances to NaN are undefined; reject like sklearn's KNN
+            raise ValueError("Input X contains NaN or infinity.")
+        a = self.a
+        reference, labels, k = a['knn_reference'], a['knn_labels'], int(a['knn_k'])
+        n_classes = len(self.classes)
+        proba = np.empty((X_scaled.shape[0], n_classes), dtype=reference.dtype)
+        reference_columns = np.ascontiguousarray(reference.T)
+        for start in range(0, X_scaled.shape[0], KNN_BLOCK_ROWS):
+            block = X_scaled[start:start + KNN_BLOCK_ROWS]
+            # Manhattan distance accumulated one feature at a time (no 3-D temporary)
+            distances = np.abs(block[:, :1] - reference_columns[0])
+            for f in range(1, block.shape[1]):
+                distances += np.abs(block[:, f:f + 1] - reference_columns[f])
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            votes = labels[nearest]
+            proba[start:start + len(block)] = (votes[:, :, None] == np.arange(n_classes)).sum(axis=1) / k
+        return proba
+
+    def ann_proba(self, X):
+        """MLP probabilities from raw (unscaled) input; the scaler is folded into layer 0"""
+        a = self.a
+        h = X
+        n_layers = int(a['ann_layers'])
+        for i in range(n_layers):
+            h = h @ a[f'ann_W{i}'] + a[f'ann_b{i}']
+            if i < n_layers - 1:
+                h = self._activation(h)
+        return _softmax(h)
+
+    def meta_proba(self, meta_X):
+        a = self.a
+        scores = meta_X @ a['meta_coef'].T + a['meta_intercept']
+        if bool(a['meta_ovr']):
+            prob = 1.0 / (1.0 + np.exp(-scores))
+            return prob / prob.sum(axis=1, keepdims=True)
+        return _softmax(scores)
+
+    def run(self, X):
+        """
+        Evaluate the whole stack; same output layout as predict.run_ensemble
+
+        Args:
+            X (np.ndarray): Raw sensor matrix of shape (N, 4)
+
+        Returns:
+            dict: 'probabilities' per model name and 'classes'
+        """
+        X = np.asarray(X, dtype=np.float64)
+        X_scaled = self.scale(X)
+        probabilities = {
+            'rf': self.rf_proba(X_scaled),
+            'xgb': self.xgb_proba(X_scaled),
+            'knn': self.knn_proba(X_scaled),
+            'ann': self.ann_proba(X),
+        }
+        meta_X = np.hstack([probabilities[name] for name in self.base_order])
+        probabilities['meta'] = self.meta_proba(meta_X)
+        return {
+            'probabilities': probabilities,
+            'classes': self.classes
+        }
+
+
+class CompiledScaler:
+    """StandardScaler stand-in backed by the exported mean and scale"""
+
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+        self.n_features_in_ = len(mean)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class CompiledMember:
+    """Classifier stand-in for one model of a CompiledEnsemble"""
+
+    def __init__(self, proba, classes):
+        self._proba = proba
+        self.classes_ = classes
+
+    def predict_proba(self, X):
+        return self._proba(np.asarray(X, dtype=np.float64))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def small_batch_probabilities(compiled, X):
+    """Probabilities of X scored in consecutive batches of 1, 2, ..., BOX_MAX_ROWS, 1, 2, ... rows"""
+    parts = []
+    start, size = 0, 1
+    while start < len(X):
+        parts.append(compiled.run(X[start:start + size])['probabilities'])
+        start += size
+        size = size % BOX_MAX_ROWS + 1
+    return {name: np.vstack([part[name] for part in parts]) for name in parts[0]}
+
+
+def compare(compiled, model_set, X):
+    """
+    Compare the kernel against the pickled models
+
+    Every row is scored in one batch (level-by-level tree traversal), and an
+    evenly spaced sample of SMALL_BATCH_ROWS rows again in batches of at most
+    BOX_MAX_ROWS rows (leaf boxes), the path single requests take.
+
+    Returns:
+        dict: Per model, the max absolute probability difference, the label agreement
+              rate and the rows over PROBABILITY_TOLERANCE, for both batch sizes
+    """
+    from predict import run_ensemble
+
+    reference = run_ensemble(X, model_set)['probabilities']
+    fused = compiled.run(X)['probabilities']
+    sample = np.unique(np.linspace(0, len(X) - 1, min(len(X), SMALL_BATCH_ROWS)).astype(int))
+    small = small_batch_probabilities(compiled, X[sample])
+    report = {}
+    for name in reference:
+        diff = np.abs(reference[name] - fused[name])
+        agree = np.argmax(reference[name], axis=1) == np.argmax(fused[name], axis=1)
+        small_diff = np.abs(reference[name][sample] - small[name])
+        report[name] = {
+            'max_abs_diff': float(diff.max()),
+            'label_agreement': float(agree.mean()),
+            'rows_over_tolerance': int((diff.max(axis=1) > PROBABILITY_TOLERANCE).sum()),
+            'small_batch_max_abs_diff': float(small_diff.max()),
+            'small_batch_rows_over_tolerance': int((small_diff.max(axis=1) > PROBABILITY_TOLERANCE).sum())
+        }
+    return report
+
+
+def _verification_data(spec=None):
+    """Rows from processed_data.csv used to verify an export, as rolling features when spec is set"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processed_data.csv')
+    X = np.genfromtxt(path, delimiter=',', skip_header=1, usecols=(2, 3, 4, 5))
+    if spec is None:
+        return X
+    import pandas as pd
+    from features import batch_features
+
+    df = pd.read_csv(path, usecols=['DATE', 'TIME', 'Start Time'])
+    timestamps = pd.to_datetime(df['DATE'] + ' ' + df['TIME'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+    return batch_features(X, timestamps.to_numpy().astype('datetime64[s]'), df['Start Time'].to_numpy(), spec=spec)
+
+
+def main(argv):
+    from registry import registry
+
+    command = argv[1] if len(argv) > 1 else 'export'
+    if registry.model_format != 'pickle':
+        print(f"MODEL_FORMAT={registry.model_format}: exports and checks compare against the pickles, "
+              f"run with MODEL_FORMAT=pickle")
+        return 1
+    model_set = registry.get()
+    if command in ('export', 'export-binary'):
+        compiled = CompiledEnsemble(export_ensemble(model_set))
+    elif command == 'verify':
+        compiled = CompiledEnsemble.load()
+    elif command == 'verify-binary':
+        compiled = CompiledEnsemble.load_binary()
+        if compiled.source_version != model_set.version:
+            print(f"Binary artifact was exported from {compiled.source_version}, models are {model_set.version}")
+            return 1
+    else:
+        print("Usage: python compiled.py [export|verify|export-binary|verify-binary]")
+        return 1
+
+    report = compare(compiled, model_set, _verification_data(model_set.features))
+    print(json.dumps(report, indent=4))
+    failed = [name for name, stats in report.items()
+              if stats['rows_over_tolerance'] or stats['small_batch_rows_over_tolerance']]
+    if failed:
+        print(f"Compiled ensemble differs from the pickled models beyond {PROBABILITY_TOLERANCE}: {failed}")
+        return 1
+    if command == 'export':
+        path = compiled.save()
+        print(f"Compiled ensemble for model set {model_set.version} written to {path}")
+    elif command == 'export-binary':
+        path = compiled.save_binary()
+        compiled = CompiledEnsemble.load_binary(path)
+        print(f"Binary artifact for model set {model_set.version} written to {path} "
+              f"(content hash {compiled.content_hash[:12]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
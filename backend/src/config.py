@@ -2,7 +2,6 @@
 Configuration module for E-Nose project
 """
 import os
-import yaml
 from pathlib import Path
 
 class Config:
@@ -21,6 +20,8 @@ class Config:
     
     def _load_config(self):
         """Load configuration from YAML file"""
+        import yaml
+
         config_file = Path(__file__).parent / self.config_path
         
         try:
@@ -117,5 +118,19 @@ class Config:
         """Get class names"""
         return self.config.get('classes', [])
 
-# Global config instance
-config = Config() 
\ No newline at end of file
+_config = None
+
+
+def get_config():
+    """Global config instance, loaded from the YAML file on first use"""
+    global _config
+    if _config is None:
+        _config = Config()
+    return _config
+
+
+def __getattr__(name):
+    # `from config import config` keeps working without parsing the YAML at import time
+    if name == 'config':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,348 @@
+"""
+Columnar dataset store for E-Nose readings
+
+Readings are kept as typed NumPy columns split into fixed-size chunks on
+disk: float32 sensors (MQ136, MQ137, TEMP, HUMI), int8 labels (-1 when
+unlabelled), datetime64[s] timestamps and float32 hours since session start.
+Chunks are memory-mapped when read, and a manifest with per-chunk time range
+and label counts lets range and label filters skip chunks without opening
+them, so selections never load the whole dataset into RAM.
+
+The store ingests processed_data.csv style files and raw ThingSpeak exports
+written by adapter.save_data_to_csv. The manifest records the content hash
+of every ingested file, and a file already ingested is skipped.
+
+Usage:
+    python dataset.py ingest processed_data.csv          # labelled CSV
+    python dataset.py ingest-thingspeak output.csv --label 2
+    python dataset.py info
+"""
+import csv
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Default store location: backend/data/store
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'store')
+
+SENSOR_COLUMNS = ['MQ136', 'MQ137', 'TEMP', 'HUMI']
+CHUNK_ROWS = 65536
+UNLABELLED = -1
+
+# Column name -> (dtype, trailing shape)
+COLUMNS = {
+    'sensors': (np.float32, (len(SENSOR_COLUMNS),)),
+    'labels': (np.int8, ()),
+    'timestamps': (np.dtype('datetime64[s]'), ()),
+    'start_time': (np.float32, ()),
+}
+
+
+class DatasetStore:
+    """
+    Chunked, memory-mapped columnar store
+
+    Args:
+        path (str): Store directory; created on first append
+        chunk_rows (int): Rows per chunk file
+    """
+
+    def __init__(self, path=DATASET_DIR, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.manifest = {'chunks': []}
+        manifest_path = os.path.join(path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+            self.chunk_rows = self.manifest.get('chunk_rows', chunk_rows)
+
+    def __len__(self):
+        return sum(chunk['rows'] for chunk in self.manifest['chunks'])
+
+    def _chunk_dir(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_chunk(self, chunk, mmap_mode='r'):
+        directory = self._chunk_dir(chunk['name'])
+        return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in COLUMNS}
+
+    def _write_chunk(self, name, arrays):
+        directory = self._chunk_dir(name)
+        os.makedirs(directory, exist_ok=True)
+        for column, values in arrays.items():
+            np.save(os.path.join(directory, f'{column}.npy'), values)
+        timestamps = arrays['timestamps'][~np.isnat(arrays['timestamps'])]
+        labels, counts = np.unique(arrays['labels'], return_counts=True)
+        return {
+            'name': name,
+            'rows': int(len(arrays['labels'])),
+            'start': str(timestamps.min()) if len(timestamps) else None,
+            'end': str(timestamps.max()) if len(timestamps) else None,
+            'labels': {str(int(label)): int(count) for label, count in zip(labels, counts)},
+        }
+
+    def ingested(self, path):
+        """Whether a file with the same content was ingested before"""
+        return _file_digest(path) in self.manifest.get('sources', {})
+
+    def _record_source(self, path, digest, rows):
+        self.manifest.setdefault('sources', {})[digest] = {'file': os.path.basename(path), 'rows': int(rows)}
+        self._save_manifest()
+
+    def _save_manifest(self):
+        self.manifest['chunk_rows'] = self.chunk_rows
+        self.manifest['rows'] = len(self)
+        tmp_path = os.path.join(self.path, 'manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=4)
+        os.replace(tmp_path, os.path.join(self.path, 'manifest.json'))
+
+    def append(self, sensors, labels=None, timestamps=None, start_time=None):
+        """
+        Append readings
+
+        Args:
+            sensors (array-like): Sensor values of shape (n, 4)
+            labels (array-like, optional): Class labels; UNLABELLED if omitted
+            timestamps (array-like, optional): Reading times; NaT if omitted
+            start_time (array-like, optional): Hours since session start; NaN if omitted
+
+        Returns:
+            int: Number of rows appended
+        """
+        sensors = np.asarray(sensors, dtype=np.float32).reshape(-1, len(SENSOR_COLUMNS))
+        n = len(sensors)
+        if n == 0:
+            return 0
+        new = {
+            'sensors': sensors,
+            'labels': np.full(n, UNLABELLED, dtype=np.int8) if labels is None else np.asarray(labels).astype(np.int8),
+            'timestamps': (np.full(n, np.datetime64('NaT', 's')) if timestamps is None
+                           else np.asarray(timestamps, dtype='datetime64[s]')),
+            'start_time': (np.full(n, np.nan, dtype=np.float32) if start_time is None
+                           else np.asarray(start_time, dtype=np.float32)),
+        }
+        os.makedirs(self.path, exist_ok=True)
+        chunks = self.manifest['chunks']
+
+        # Top up a partly filled last chunk first
+        if chunks and chunks[-1]['rows'] < self.chunk_rows:
+            last = chunks.pop()
+            existing = self._load_chunk(last, mmap_mode=None)
+            new = {name: np.concatenate([existing[name], new[name]]) for name in COLUMNS}
+            next_index = int(last['name'].rsplit('_', 1)[1])
+        else:
+            next_index = len(chunks)
+
+        total = len(new['labels'])
+        for offset in range(0, total, self.chunk_rows):
+            part = {name: values[offset:offset + self.chunk_rows] for name, values in new.items()}
+            chunks.append(self._write_chunk(f'chunk_{next_index:05d}', part))
+            next_index += 1
+        self._save_manifest()
+        return n
+
+    def ingest_processed_csv(self, path, chunksize=CHUNK_ROWS):
+        """
+        Append a labelled CSV in the processed_data.csv layout
+        (DATE dd/mm/yyyy, TIME, MQ136, MQ137, TEMP, HUMI, Start Time, Label)
+
+        Returns:
+            int: Rows appended, 0 if the file was already ingested
+        """
+        digest = _file_digest(path)
+        if digest in self.manifest.get('sources', {}):
+            return 0
+        appended = 0
+        for df in pd.read_csv(path, chunksize=chunksize):
+            timestamps = pd.to_datetime(df['DATE'] + ' ' + df['TIME'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+            labels = df['Label'].fillna(UNLABELLED) if 'Label' in df else None
+            appended += self.append(
+                df[SENSOR_COLUMNS].to_numpy(),
+                labels=None if labels is None else labels.to_numpy(),
+                timestamps=timestamps.to_numpy().astype('datetime64[s]'),
+                start_time=df['Start Time'].to_numpy() if 'Start Time' in df else None
+            )
+        self._record_source(path, digest, appended)
+        return appended
+
+    def ingest_thingspeak_csv(self, path, label=None):
+        """
+        Append a raw ThingSpeak export written by adapter.save_data_to_csv
+
+        Rows with a missing sensor field are skipped; start_time is counted in
+        hours from the first reading of the export.
+
+        Args:
+            path (str): CSV with created_at, entry_id and field1..field4 columns
+            label (int, optional): Class label of the whole export
+
+        Returns:
+            int: Rows appended, 0 if the file was already ingested
+        """
+        from adapter import parse_thingspeak_feeds
+
+        digest = _file_digest(path)
+        if digest in self.manifest.get('sources', {}):
+            return 0
+        with open(path, newline='') as f:
+            feeds = list(csv.DictReader(f))
+        values, mask, timestamps, _ = parse_thingspeak_feeds(feeds)
+        valid = mask.all(axis=1)
+        values, timestamps = values[valid], timestamps[valid]
+        order = np.argsort(timestamps, kind='stable')
+        values, timestamps = values[order], timestamps[order]
+        start_time = None
+        if len(timestamps) and not np.isnat(timestamps[0]):
+            start_time = np.round((timestamps - timestamps[0]).astype(np.float64) / 3600.0, 2)
+        labels = None if label is None else np.full(len(values), label)
+        appended = self.append(values, labels=labels, timestamps=timestamps, start_time=start_time)
+        self._record_source(path, digest, appended)
+        return appended
+
+    def iter_chunks(self, start=None, end=None, labels=None, columns=None):
+        """
+        Yield the selected rows chunk by chunk
+
+        Args:
+            start, end (datetime-like, optional): Keep timestamps in [start, end)
+            labels (iterable, optional): Keep only these labels
+            columns (list, optional): Columns to return; defaults to all
+
+        Yields:
+            dict: Column arrays of one chunk; memory-mapped views when no row filter applies
+        """
+        columns = list(columns or COLUMNS)
+        start = None if start is None else np.datetime64(start, 's')
+        end = None if end is None else np.datetime64(end, 's')
+        wanted = None if labels is None else {int(label) for label in labels}
+
+        for chunk in self.manifest['chunks']:
+            # Skip chunks whose time range or label counts cannot match
+            if start is not None and (chunk['end'] is None or np.datetime64(chunk['end'], 's') < start):
+                continue
+            if end is not None and (chunk['start'] is None or np.datetime64(chunk['start'], 's') >= end):
+                continue
+            if wanted is not None and not wanted & {int(label) for label in chunk['labels']}:
+                continue
+
+            arrays = self._load_chunk(chunk)
+            keep = None
+            if start is not None:
+                keep = arrays['timestamps'] >= start
+            if end is not None:
+                keep = (arrays['timestamps'] < end) if keep is None else keep & (arrays['timestamps'] < end)
+            if wanted is not None:
+                match = np.isin(arrays['labels'], list(wanted))
+                keep = match if keep is None else keep & match
+            if keep is None:
+                yield {name: arrays[name] for name in columns}
+            elif keep.any():
+                yield {name: arrays[name][keep] for name in columns}
+
+    def read(self, start=None, end=None, labels=None, columns=None):
+        """
+        Selected rows as in-memory arrays (see iter_chunks for the filters)
+
+        Returns:
+            dict: Column name -> array
+        """
+        columns = list(columns or COLUMNS)
+        parts = list(self.iter_chunks(start, end, labels, columns))
+        result = {}
+        for name in columns:
+            dtype, shape = COLUMNS[name]
+            result[name] = (np.concatenate([part[name] for part in parts]) if parts
+                            else np.empty((0,) + shape, dtype=dtype))
+        return result
+
+    def training_frame(self, labels=None, spec=None):
+        """
+        Labelled readings as (X, y) in the layout the training scripts expect
+
+        Args:
+            labels (iterable, optional): Labels to keep; defaults to every labelled row
+            spec (FeatureSpec, optional): Return rolling features (see features.py)
+                computed per session instead of the raw sensor columns
+
+        Returns:
+            tuple: (DataFrame of SENSOR_COLUMNS float32, or of spec.names with a spec,
+                   Series of int labels)
+        """
+        if labels is None:
+            labels = sorted(int(label) for chunk in self.manifest['chunks']
+                            for label in chunk['labels'] if int(label) != UNLABELLED)
+        if spec is None:
+            data = self.read(labels=set(labels), columns=['sensors', 'labels'])
+            X = pd.DataFrame(data['sensors'], columns=SENSOR_COLUMNS)
+        else:
+            from features import batch_features
+
+            data = self.read(labels=set(labels))
+            features = batch_features(data['sensors'], data['timestamps'], data['start_time'], spec=spec)
+            X = pd.DataFrame(features.astype(np.float32), columns=spec.names)
+        y = pd.Series(data['labels'].astype(int), name='Label')
+        return X, y
+
+
+def _file_digest(path):
+    """Content hash of a file, used to recognise files ingested before"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def open_training_store(path=DATASET_DIR, csv_path='processed_data.csv'):
+    """
+    Open the store, ingesting csv_path first if the store is still empty
+
+    Returns:
+        DatasetStore: The populated store
+    """
+    store = DatasetStore(path)
+    if len(store) == 0 and os.path.exists(csv_path):
+        rows = store.ingest_processed_csv(csv_path)
+        print(f"Ingested {rows} rows from {csv_path} into {path}")
+    return store
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the E-Nose dataset store")
+    parser.add_argument('command', choices=['ingest', 'ingest-thingspeak', 'info'])
+    parser.add_argument('paths', nargs='*', help="CSV files to ingest")
+    parser.add_argument('--store', default=DATASET_DIR, help="Store directory")
+    parser.add_argument('--label', type=int, default=None, help="Label of a ThingSpeak export")
+    args = parser.parse_args(argv[1:])
+
+    store = DatasetStore(args.store)
+    for path in args.paths:
+        if args.command != 'info' and store.ingested(path):
+            print(f"{path}: already ingested, skipped")
+            continue
+        if args.command == 'ingest':
+            rows = store.ingest_processed_csv(path)
+        elif args.command == 'ingest-thingspeak':
+            rows = store.ingest_thingspeak_csv(path, label=args.label)
+        else:
+            break
+        print(f"{path}: {rows} rows appended")
+
+    label_counts = {}
+    for chunk in store.manifest['chunks']:
+        for label, count in chunk['labels'].items():
+            label_counts[label] = label_counts.get(label, 0) + count
+    print(f"{args.store}: {len(store)} rows in {len(store.manifest['chunks'])} chunk(s), labels {label_counts}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
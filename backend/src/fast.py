@@ -0,0 +1,336 @@
+"""
+Fast mode: a pruned, float32 variant of the compiled ensemble
+
+Starting from the compiled kernel of the active model set, ``python fast.py
+build`` derives a cheaper approximation and refuses to save it when it is
+not accurate enough:
+
+1. Base members that add no accuracy to the meta-model are dropped. A
+   dropped member's block of meta-features is replaced by its mean
+   probabilities, folded into the meta intercept, so the meta-model keeps
+   its coefficients for the members that stay.
+2. RandomForest trees and XGBoost boosting rounds are halved, the slower of
+   the two first, until one row is scored within the latency budget or
+   fewer trees would cost more accuracy than allowed.
+3. Every array is stored as float32.
+
+The decisions are taken on one half of the test rows train_base_model.py
+held out, as saved (with their hash) in models/stacking, and the result is
+validated on the other half: if its accuracy is more than
+--tolerance below the full stack's, nothing is written. The kept artifact
+goes to models/ensemble_fast/ in the binary format of compiled.py; the
+registry attaches it to the model set it was built from and
+INFERENCE_ENGINE=fast serves every batch with it.
+
+Usage:
+    python fast.py build [--budget-ms 0.5] [--tolerance 0.005] [--member-tolerance 0]
+    python fast.py verify    # re-run the validation against the saved artifact
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from compiled import (BOX_MAX_ROWS, CompiledEnsemble, _export_random_forest, _export_xgboost, _softmax, _traverse,
+                      export_ensemble)
+from registry import MODELS_DIR, N_SENSOR_FEATURES
+
+FAST_DIR = 'ensemble_fast'
+# Stacking features of train_base_model.py, holding the held-out test rows
+STACKING_PATH = os.path.join(MODELS_DIR, 'stacking')
+
+# Single-row latency target and allowed accuracy loss against the full stack
+DEFAULT_BUDGET_MS = 0.5
+DEFAULT_TOLERANCE = 0.005
+
+# Calls timed per latency measurement
+LATENCY_REPEAT = 200
+
+
+class FastEnsemble(CompiledEnsemble):
+    """
+    Compiled ensemble restricted to the members in base_order, evaluated in float32
+
+    The arrays of dropped members are absent; run() returns probabilities for
+    the kept members and the meta-model only.
+    """
+
+    def __init__(self, arrays):
+        super().__init__(arrays)
+        # Build report (accuracies, pruning decisions, latency), empty for hand-made arrays
+        self.report = json.loads(str(self.a['fast_report'])) if 'fast_report' in self.a else {}
+
+    @classmethod
+    def load_binary(cls, path=None, mmap_mode='r', verify=True):
+        return super().load_binary(path or os.path.join(MODELS_DIR, FAST_DIR), mmap_mode, verify)
+
+    def save_binary(self, path=None):
+        return super().save_binary(path or os.path.join(MODELS_DIR, FAST_DIR))
+
+    def xgb_proba(self, X_scaled):
+        a = self.a
+        if X_scaled.shape[0] <= BOX_MAX_ROWS and not np.isnan(X_scaled).any():
+            return super().xgb_proba(X_scaled)
+        # Same as the compiled kernel, without widening the leaf weights to float64
+        leaves = _traverse(X_scaled, a['xgb_feature'], a['xgb_threshold'], a['xgb_children'],
+                           a['xgb_roots'], a['xgb_depth'], default_left=a['xgb_default_left'])
+        return _softmax(a['xgb_value'][leaves] @ a['xgb_tree_class'])
+
+    def knn_proba(self, X_scaled):
+        # The grid index (shared with the compiled kernel) answers in float64
+        return super().knn_proba(X_scaled).astype(np.float32, copy=False)
+
+    def run(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        X_scaled = self.scale(X)
+        probabilities = {name: self.member_proba(name, X, X_scaled) for name in self.base_order}
+        meta_X = np.hstack([probabilities[name] for name in self.base_order])
+        probabilities['meta'] = self.meta_proba(meta_X)
+        return {
+            'probabilities': probabilities,
+            'classes': self.classes
+        }
+
+
+def build_arrays(model_set, full, members, means, rf_trees=None, xgb_rounds=None):
+    """
+    Arrays of a FastEnsemble
+
+    Args:
+        model_set (ModelSet): Pickled set the kernel comes from (needed to re-export pruned trees)
+        full (dict): export_ensemble(model_set)
+        members (list): Base members to keep, in meta-feature order
+        means (dict): Mean probabilities of each member, folded into the meta intercept when dropped
+        rf_trees (int, optional): Leading RandomForest trees kept
+        xgb_rounds (int, optional): Leading XGBoost boosting rounds kept
+
+    Returns:
+        dict: Name -> float32 array (integers, booleans and strings unchanged)
+    """
+    arrays = {key: value for key, value in full.items() if not key.startswith(('rf_', 'xgb_', 'knn_', 'ann_'))}
+    rf, xgb = model_set.base_models['rf'], model_set.base_models['xgb']
+    for name in members:
+        if name == 'rf' and rf_trees is not None and rf_trees < len(rf.estimators_):
+            rf = SimpleNamespace(estimators_=rf.estimators_[:rf_trees], n_features_in_=rf.n_features_in_)
+            arrays.update(_export_random_forest(rf))
+        elif name == 'xgb' and xgb_rounds is not None and xgb_rounds < xgb.get_booster().num_boosted_rounds():
+            booster = xgb.get_booster()[0:xgb_rounds]
+            arrays.update(_export_xgboost(SimpleNamespace(get_booster=lambda: booster)))
+        else:
+            arrays.update({key: value for key, value in full.items() if key.startswith(f'{name}_')})
+
+    # Meta-feature blocks of the dropped members become a constant term
+    order = [str(name) for name in full['base_order']]
+    n_classes = len(full['classes'])
+    coef, intercept = full['meta_coef'], full['meta_intercept'].copy()
+    kept_columns = []
+    for i, name in enumerate(order):
+        block = slice(i * n_classes, (i + 1) * n_classes)
+        if name in members:
+            kept_columns.extend(range(block.start, block.stop))
+        else:
+            intercept += coef[:, block] @ means[name]
+    arrays['meta_coef'] = coef[:, kept_columns]
+    arrays['meta_intercept'] = intercept
+    arrays['base_order'] = np.array([name for name in order if name in members])
+
+    for key, value in arrays.items():
+        value = np.asarray(value)
+        if value.dtype.kind == 'f' and key != 'classes':
+            arrays[key] = value.astype(np.float32)
+    return arrays
+
+
+def held_out_split(spec=None):
+    """
+    Tuning and validation halves of the rows train_base_model.py holds out
+
+    The rows come from the stacking artifact, where training saved them, rather
+    than from re-splitting the dataset store, which may have grown since.
+
+    Raises:
+        ValueError: If the artifact has no held-out rows, they fail their hash check
+            or they are not inputs of the given feature spec
+
+    Returns:
+        tuple: (X_tune, y_tune, X_valid, y_valid), raw model inputs and int labels
+    """
+    from sklearn.model_selection import train_test_split
+
+    from training import load_held_out
+
+    X_test, y_test = load_held_out(STACKING_PATH)
+    width = N_SENSOR_FEATURES if spec is None else len(spec.names)
+    if X_test.shape[1] != width:
+        raise ValueError(f"Held-out rows in {STACKING_PATH} have {X_test.shape[1]} inputs, the models take {width}")
+    X_tune, X_valid, y_tune, y_valid = train_test_split(X_test, y_test, test_size=0.5,
+                                                        random_state=42, stratify=y_test)
+    return X_tune, y_tune, X_valid, y_valid
+
+
+def accuracy(ensemble, X, y):
+    """Meta-model accuracy of a CompiledEnsemble (or FastEnsemble) on labelled rows"""
+    result = ensemble.run(X)
+    labels = np.asarray(result['classes'])[np.argmax(result['probabilities']['meta'], axis=1)]
+    return float((labels.astype(int) == y).mean())
+
+
+def latency_ms(fn, repeat=LATENCY_REPEAT):
+    """Median milliseconds of fn()"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def build(model_set, budget_ms=DEFAULT_BUDGET_MS, tolerance=DEFAULT_TOLERANCE, member_tolerance=0.0, split=None):
+    """
+    Prune the model set's stack to the latency budget and validate it
+
+    Args:
+        split (tuple, optional): held_out_split() of the model set, loaded when omitted
+
+    Returns:
+        FastEnsemble: The pruned ensemble; its report says whether it passed validation
+    """
+    full = export_ensemble(model_set)
+    reference = CompiledEnsemble(full)
+    X_tune, y_tune, X_valid, y_valid = split or held_out_split(model_set.features)
+    row = X_tune[:1].astype(np.float32)
+
+    tune_X_scaled = reference.scale(X_tune)
+    means = {name: reference.member_proba(name, X_tune, tune_X_scaled).mean(axis=0)
+             for name in reference.base_order}
+    baseline = accuracy(reference, X_tune, y_tune)
+    state = {'members': list(reference.base_order), 'rf_trees': len(model_set.base_models['rf'].estimators_),
+             'xgb_rounds': model_set.base_models['xgb'].get_booster().num_boosted_rounds()}
+
+    def make(**changes):
+        settings = {**state, **changes}
+        return FastEnsemble(build_arrays(model_set, full, settings['members'], means,
+                                         settings['rf_trees'], settings['xgb_rounds']))
+
+    # 1. Drop members without marginal accuracy, the slowest one first
+    dropped = []
+    while len(state['members']) > 1:
+        current = make()
+        # No loss against the current members, nor (added up over several drops) against the full stack
+        floor = max(accuracy(current, X_tune, y_tune), baseline) - member_tolerance
+        scaled = current.scale(row)
+        cost = {name: latency_ms(lambda: current.member_proba(name, row, scaled))
+                for name in state['members']}
+        for name in sorted(state['members'], key=cost.get, reverse=True):
+            members = [m for m in state['members'] if m != name]
+            if accuracy(make(members=members), X_tune, y_tune) >= floor:
+                state['members'] = members
+                dropped.append(name)
+                break
+        else:
+            break
+
+    # 2. Halve trees / boosting rounds of the slower tree member until the budget is met
+    frozen = set()
+    current = make()
+    latency = latency_ms(lambda: current.run(row))
+    while latency > budget_ms:
+        prunable = [name for name, key in (('rf', 'rf_trees'), ('xgb', 'xgb_rounds'))
+                    if name in state['members'] and name not in frozen and state[key] > 1]
+        if not prunable:
+            break
+        scaled = current.scale(row)
+        name = max(prunable, key=lambda m: latency_ms(lambda: current.member_proba(m, row, scaled)))
+        key = 'rf_trees' if name == 'rf' else 'xgb_rounds'
+        candidate = make(**{key: state[key] // 2})
+        if accuracy(candidate, X_tune, y_tune) < baseline - tolerance:
+            frozen.add(name)
+            continue
+        state[key] //= 2
+        current = candidate
+        latency = latency_ms(lambda: current.run(row))
+
+    # 3. Validate on rows none of the decisions above looked at
+    full_accuracy = accuracy(reference, X_valid, y_valid)
+    fast_accuracy = accuracy(current, X_valid, y_valid)
+    agreement = float((np.argmax(reference.run(X_valid)['probabilities']['meta'], axis=1)
+                       == np.argmax(current.run(X_valid)['probabilities']['meta'], axis=1)).mean())
+    report = {
+        'members': state['members'],
+        'dropped_members': dropped,
+        'rf_trees': state['rf_trees'] if 'rf' in state['members'] else None,
+        'xgb_rounds': state['xgb_rounds'] if 'xgb' in state['members'] else None,
+        'budget_ms': budget_ms,
+        'latency_ms': round(latency, 4),
+        'full_latency_ms': round(latency_ms(lambda: reference.run(row)), 4),
+        'budget_met': latency <= budget_ms,
+        'tolerance': tolerance,
+        'tune_rows': len(y_tune),
+        'validation_rows': len(y_valid),
+        'full_accuracy': round(full_accuracy, 6),
+        'fast_accuracy': round(fast_accuracy, 6),
+        'label_agreement': round(agreement, 6),
+        'passed': fast_accuracy >= full_accuracy - tolerance,
+    }
+    current.a['fast_report'] = np.array(json.dumps(report, sort_keys=True))
+    current.report = report
+    return current
+
+
+def main(argv):
+    from registry import registry
+
+    parser = argparse.ArgumentParser(description="Build or verify the pruned float32 fast ensemble")
+    parser.add_argument('command', nargs='?', choices=['build', 'verify'], default='build')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="Single-row latency target")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Largest accuracy drop against the full stack on the validation rows")
+    parser.add_argument('--member-tolerance', type=float, default=0.0,
+                        help="Tuning accuracy a member may cost and still be dropped")
+    args = parser.parse_args(argv[1:])
+
+    if registry.model_format != 'pickle':
+        print(f"MODEL_FORMAT={registry.model_format}: fast mode is built from the pickles, run with MODEL_FORMAT=pickle")
+        return 1
+    model_set = registry.get()
+    try:
+        split = held_out_split(model_set.features)
+    except ValueError as e:
+        print(e)
+        return 1
+    if args.command == 'verify':
+        fast = FastEnsemble.load_binary()
+        if fast.source_version != model_set.version:
+            print(f"Fast ensemble was built from {fast.source_version}, models are {model_set.version}")
+            return 1
+        _, _, X_valid, y_valid = split
+        reference = CompiledEnsemble(export_ensemble(model_set))
+        report = {'full_accuracy': accuracy(reference, X_valid, y_valid),
+                  'fast_accuracy': accuracy(fast, X_valid, y_valid), 'tolerance': fast.report.get('tolerance')}
+        report['passed'] = report['fast_accuracy'] >= report['full_accuracy'] - (report['tolerance'] or 0)
+        print(json.dumps(report, indent=4))
+        return 0 if report['passed'] else 1
+
+    fast = build(model_set, args.budget_ms, args.tolerance, args.member_tolerance, split)
+    print(json.dumps(fast.report, indent=4))
+    if not fast.report['passed']:
+        print(f"Fast ensemble accuracy {fast.report['fast_accuracy']:.4f} is more than {args.tolerance} below "
+              f"the full stack's {fast.report['full_accuracy']:.4f}; nothing written")
+        return 1
+    if not fast.report['budget_met']:
+        print(f"Warning: {fast.report['latency_ms']:.3f} ms per row is over the {args.budget_ms} ms budget; "
+              f"pruning further would cost more than {args.tolerance} accuracy")
+    path = fast.save_binary()
+    fast = FastEnsemble.load_binary(path)
+    print(f"Fast ensemble for model set {model_set.version} written to {path} (content hash {fast.content_hash[:12]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
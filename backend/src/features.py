@@ -0,0 +1,302 @@
+"""
+Rolling time-window features per measurement session
+
+Besides the instantaneous [MQ136, MQ137, TEMP, HUMI] reading, every row gets
+the MQ136/MQ137 ratio, the mean, standard deviation and slope (per hour) of
+each sensor over the last `window` readings of its session.
+
+There is deliberately no "time since session start" feature: at serve time
+the session start is not known (a fetched window starts at its own first
+reading), and over the labelled sessions the elapsed time tracks the label
+itself, so it would be both skewed and leaking. 'Start Time' is only used to
+tell sessions apart.
+
+The same window statistics feed two implementations: batch_features computes
+them vectorized for training and for fetched windows, and RollingFeatures
+updates them in O(1) per reading for streaming devices. Both take the window
+sums relative to the current reading and finish them with the same code, so
+training and serving features match.
+
+Models trained on these features carry a features.json next to the pickles;
+without it the ensemble keeps using the four raw sensor values.
+"""
+import json
+import os
+from collections import deque
+
+import numpy as np
+
+SENSOR_NAMES = ['MQ136', 'MQ137', 'TEMP', 'HUMI']
+FEATURES_FILE = 'features.json'
+
+DEFAULT_WINDOW = 10
+# A longer pause between two readings starts a new session
+SESSION_GAP_HOURS = 0.5
+# Online window sums are recomputed from scratch this often to stop rounding drift
+RESUM_INTERVAL = 1000
+
+FEATURE_NAMES = (
+    SENSOR_NAMES
+    + ['MQ136_MQ137_ratio']
+    + [f'{name}_mean' for name in SENSOR_NAMES]
+    + [f'{name}_std' for name in SENSOR_NAMES]
+    + [f'{name}_slope' for name in SENSOR_NAMES]
+)
+
+
+class FeatureSpec:
+    """
+    Parameters of the rolling feature pipeline a model set was trained with
+
+    Args:
+        window (int): Readings per rolling window, including the current one
+        session_gap_hours (float): Gap between readings that starts a new session
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, session_gap_hours=SESSION_GAP_HOURS):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = int(window)
+        self.session_gap_hours = float(session_gap_hours)
+        self.names = list(FEATURE_NAMES)
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSpec) and self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        return {'window': self.window, 'session_gap_hours': self.session_gap_hours, 'names': self.names}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        spec = cls(data['window'], data.get('session_gap_hours', SESSION_GAP_HOURS))
+        if data.get('names', spec.names) != spec.names:
+            raise ValueError(f"Feature names in {path} do not match this version of features.py")
+        return spec
+
+
+def load_spec(models_dir):
+    """FeatureSpec saved with the models, or None for raw-sensor models"""
+    path = os.path.join(models_dir, FEATURES_FILE)
+    return FeatureSpec.load(path) if os.path.exists(path) else None
+
+
+def _ratio(X):
+    return np.divide(X[..., 0], X[..., 1], out=np.zeros(X.shape[:-1]), where=X[..., 1] != 0)
+
+
+def _assemble(X, n, sx, sxx, st, stt, stx):
+    """
+    Feature rows from window sums; shared by the batch and online paths
+
+    All sums are taken relative to the current reading: x is a reading minus
+    the current one, t its time minus the current time in hours.
+
+    Args:
+        X: Current raw readings (..., 4)
+        n: Readings in each window (...)
+        sx, sxx, stx: Window sums of x, x^2 and t*x per sensor (..., 4)
+        st, stt: Window sums of t and t^2 (...)
+    """
+    n = np.asarray(n, dtype=np.float64)[..., None]
+    st = np.asarray(st, dtype=np.float64)[..., None]
+    stt = np.asarray(stt, dtype=np.float64)[..., None]
+    offset = sx / n
+    std = np.sqrt(np.maximum(sxx / n - offset ** 2, 0.0))
+    denominator = n * stt - st ** 2
+    valid = denominator > 1e-12
+    slope = np.where(valid, (n * stx - st * sx) / np.where(valid, denominator, 1.0), 0.0)
+    return np.concatenate([X, _ratio(X)[..., None], X + offset, std, slope], axis=-1)
+
+
+def batch_features(sensors, timestamps=None, start_time=None, spec=None, session_ids=None):
+    """
+    Rolling features for a table of readings
+
+    Rows may come in any order; they are grouped into sessions and ordered by
+    time internally, and the features are returned in the input order.
+
+    Args:
+        sensors (array-like): Readings of shape (n, 4)
+        timestamps (array-like, optional): datetime64 reading times; rows without
+            one form a session of their own
+        start_time (array-like, optional): Hours since session start where known
+            (processed_data.csv 'Start Time'); a decrease starts a new session
+        spec (FeatureSpec, optional): Window and session gap; defaults to FeatureSpec()
+        session_ids (array-like, optional): Explicit session of each row instead of
+            detecting sessions from gaps
+
+    Returns:
+        np.ndarray: (n, len(FEATURE_NAMES)) feature matrix
+    """
+    spec = spec or FeatureSpec()
+    X = np.asarray(sensors, dtype=np.float64).reshape(-1, len(SENSOR_NAMES))
+    n_rows = len(X)
+    if n_rows == 0:
+        return np.empty((0, len(FEATURE_NAMES)))
+    timestamps = (np.full(n_rows, np.datetime64('NaT', 's')) if timestamps is None
+                  else np.asarray(timestamps, dtype='datetime64[s]'))
+    start_time = (np.full(n_rows, np.nan) if start_time is None
+                  else np.asarray(start_time, dtype=np.float64))
+    missing_time = np.isnat(timestamps)
+    seconds = np.where(missing_time, 0, timestamps.astype(np.int64))
+
+    if session_ids is None:
+        order = np.argsort(timestamps, kind='stable')
+        ts, st_in, no_time = seconds[order], start_time[order], missing_time[order]
+        new = np.ones(n_rows, dtype=bool)
+        new[1:] = ((ts[1:] - ts[:-1]) / 3600.0 > spec.session_gap_hours) | no_time[1:] | no_time[:-1]
+        new[1:] |= st_in[1:] < st_in[:-1]
+    else:
+        session_ids = np.asarray(session_ids)
+        order = np.lexsort((seconds, session_ids))
+        new = np.ones(n_rows, dtype=bool)
+        new[1:] = session_ids[order][1:] != session_ids[order][:-1]
+
+    X, seconds = X[order], seconds[order]
+    first = np.flatnonzero(new)[np.cumsum(new) - 1]
+    position = np.arange(n_rows)
+
+    # Window sums relative to the current reading, one window offset at a time
+    n = np.zeros(n_rows)
+    sx, sxx, stx = np.zeros_like(X), np.zeros_like(X), np.zeros_like(X)
+    st, stt = np.zeros(n_rows), np.zeros(n_rows)
+    for k in range(spec.window):
+        j = position - k
+        valid = j >= first
+        j = np.where(valid, j, position)
+        x = np.where(valid[:, None], X[j] - X, 0.0)
+        t = np.where(valid, (seconds[j] - seconds) / 3600.0, 0.0)
+        n += valid
+        sx += x
+        sxx += x ** 2
+        stx += t[:, None] * x
+        st += t
+        stt += t ** 2
+
+    features = _assemble(X, n, sx, sxx, st, stt, stx)
+    result = np.empty_like(features)
+    result[order] = features
+    return result
+
+
+def independent_features(sensors, spec=None):
+    """Features of readings that each stand alone (a one-reading session)"""
+    X = np.asarray(sensors, dtype=np.float64).reshape(-1, len(SENSOR_NAMES))
+    return batch_features(X, spec=spec, session_ids=np.arange(len(X)))
+
+
+class RollingFeatures:
+    """
+    O(1) per reading feature updates for one device
+
+    The window sums are kept relative to the newest reading and shifted to
+    each new reading in constant time, matching batch_features.
+
+    Args:
+        spec (FeatureSpec, optional): Window and session gap; defaults to FeatureSpec()
+    """
+
+    def __init__(self, spec=None):
+        self.spec = spec or FeatureSpec()
+        self.reset()
+
+    def reset(self):
+        """Forget the current session"""
+        self._window = deque()
+        self._updates = 0
+        self._clear_sums()
+        self.last_reading = None
+        self.last_time = None
+        self.last_start_time = None
+        self.latest = None
+
+    def _clear_sums(self):
+        self.n = 0
+        self.sx = np.zeros(len(SENSOR_NAMES))
+        self.sxx = np.zeros(len(SENSOR_NAMES))
+        self.stx = np.zeros(len(SENSOR_NAMES))
+        self.st = 0.0
+        self.stt = 0.0
+
+    def _resum(self):
+        """Recompute the window sums from the buffered readings"""
+        self._clear_sums()
+        for reading, seconds in self._window:
+            x = reading - self.last_reading
+            t = (seconds - self.last_time) / 3600.0
+            self.n += 1
+            self.sx += x
+            self.sxx += x ** 2
+            self.stx += t * x
+            self.st += t
+            self.stt += t ** 2
+
+    def update(self, reading, timestamp=None, start_time=None):
+        """
+        Add one reading and return its feature row
+
+        Args:
+            reading (array-like): [MQ136, MQ137, TEMP, HUMI]
+            timestamp (datetime64, optional): Reading time; a reading without one
+                forms a session of its own and leaves the current one untouched,
+                as in batch_features
+            start_time (float, optional): Hours since session start, if known; a
+                decrease starts a new session
+
+        Returns:
+            np.ndarray: Feature row of length len(FEATURE_NAMES)
+        """
+        reading = np.asarray(reading, dtype=np.float64).reshape(len(SENSOR_NAMES))
+        if timestamp is None or np.isnat(np.datetime64(timestamp, 's')):
+            zeros = np.zeros(len(SENSOR_NAMES))
+            self.latest = _assemble(reading, 1, zeros, zeros, 0.0, 0.0, zeros)
+            return self.latest
+        seconds = int(np.datetime64(timestamp, 's').astype(np.int64))
+        start_time = None if start_time is None or not np.isfinite(start_time) else float(start_time)
+
+        if (self.last_time is None
+                or (seconds - self.last_time) / 3600.0 > self.spec.session_gap_hours
+                or (start_time is not None and self.last_start_time is not None
+                    and start_time < self.last_start_time)):
+            self.reset()
+        else:
+            # Move the sums' reference point from the previous reading to this one
+            dx = reading - self.last_reading
+            dt = (seconds - self.last_time) / 3600.0
+            n = self.n
+            self.sxx = self.sxx - 2 * dx * self.sx + n * dx ** 2
+            self.stx = self.stx - dx * self.st - dt * self.sx + n * dt * dx
+            self.stt = self.stt - 2 * dt * self.st + n * dt ** 2
+            self.sx = self.sx - n * dx
+            self.st = self.st - n * dt
+
+        # The new reading contributes zeros relative to itself
+        self._window.append((reading, seconds))
+        self.n += 1
+        self.last_reading = reading
+        self.last_time = seconds
+        if len(self._window) > self.spec.window:
+            old_reading, old_seconds = self._window.popleft()
+            x = old_reading - reading
+            t = (old_seconds - seconds) / 3600.0
+            self.n -= 1
+            self.sx -= x
+            self.sxx -= x ** 2
+            self.stx -= t * x
+            self.st -= t
+            self.stt -= t ** 2
+        self._updates += 1
+        if self._updates % RESUM_INTERVAL == 0:
+            self._resum()
+
+        if start_time is not None:
+            self.last_start_time = start_time
+        self.latest = _assemble(reading, self.n, self.sx, self.sxx, self.st, self.stt, self.stx)
+        return self.latest
@@ -0,0 +1,189 @@
+"""
+Concurrent ThingSpeak fetches for a fleet of devices
+
+Every e-nose reports to its own ThingSpeak channel. A FleetFetcher fetches
+the feeds of many (channel_id, api_key) pairs at once on a shared, bounded
+thread pool, so one dashboard refresh costs about one round trip instead of
+one per device, and a burst of refreshes cannot open more than
+max_concurrency connections. Each device gets its own timeout, counted from
+when its fetch starts; devices that fail or time out are reported as such
+and do not hold back the others. Fetches run without retries and with the
+device timeout as their connect/read timeout, so a dead device gives its
+pool thread back about when it is reported, instead of after the
+ThingSpeak client's own timeout and retries.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from adapter import default_channel_id
+
+logger = logging.getLogger(__name__)
+
+
+def parse_devices(items, max_devices=None):
+    """
+    Normalize a request's device list to (channel_id, api_key) pairs
+
+    Args:
+        items (list): {"channel_id": ..., "api_key": ...} objects or [channel_id, api_key]
+            pairs; a missing channel_id falls back to default_channel_id()
+        max_devices (int, optional): Most devices accepted
+
+    Raises:
+        ValueError: If the list is empty, too long or an entry has no api_key
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError("devices must be a non-empty list")
+    if max_devices is not None and len(items) > max_devices:
+        raise ValueError(f"At most {max_devices} devices per request, got {len(items)}")
+    devices = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            channel_id, api_key = item.get('channel_id'), item.get('api_key')
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            channel_id, api_key = item
+        else:
+            raise ValueError(f"Device {i}: expected {{'channel_id', 'api_key'}} or [channel_id, api_key]")
+        if not api_key:
+            raise ValueError(f"Device {i}: missing api_key")
+        devices.append((str(channel_id or default_channel_id()), str(api_key)))
+    return devices
+
+
+class FleetFetcher:
+    """
+    Fetches many channels concurrently with per-device timeouts
+
+    A fetch that times out is no longer waited for; it keeps its thread until
+    its connect/read timeout (the device timeout, or what is left of the
+    request deadline when that is sooner) ends it.
+
+    Args:
+        max_concurrency (int): Fetches running at once, shared by all requests
+        device_timeout (float): Seconds one device's fetch may take once started
+    """
+
+    def __init__(self, max_concurrency=8, device_timeout=5.0):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.device_timeout = device_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='fleet-fetch')
+        self._lock = threading.Lock()
+        self.stats = {'fetched': 0, 'failed': 0, 'timed_out': 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def fetch(self, devices, fetch, results=10, deadline=None):
+        """
+        Fetch the feeds of every device
+
+        Args:
+            devices (list): (channel_id, api_key) pairs
+            fetch (callable): fetch(api_key, results, channel_id, timeout=seconds, retry=False)
+                -> feeds list or None
+            results (int): Entries requested per channel
+            deadline (float, optional): time.monotonic() by which every fetch must be
+                done; devices still queued or running then are reported as timed out
+
+        Returns:
+            list: One dict per device, in order: channel_id, api_key, status ('ok',
+                  'error' or 'timeout'), and feeds or error, plus fetch_ms when it ran
+        """
+        started = {}
+
+        def run(i, channel_id, api_key):
+            now = time.monotonic()
+            timeout = self.device_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - now)
+            if timeout <= 0:
+                return None
+            started[i] = now
+            return fetch(api_key, results, channel_id, timeout=timeout, retry=False)
+
+        def expired(i, now):
+            """Why device i has run out of time, or None"""
+            if i in started and now - started[i] >= self.device_timeout:
+                return f"No response within the device timeout of {self.device_timeout}s"
+            if deadline is not None and now >= deadline:
+                return ("Request deadline passed while fetching" if i in started
+                        else "Request deadline passed before the fetch started")
+            return None
+
+        futures = {
+            self._executor.submit(run, i, channel_id, api_key): i
+            for i, (channel_id, api_key) in enumerate(devices)
+        }
+        outcomes = [None] * len(devices)
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            # A device times out device_timeout after its fetch started, or at the request deadline
+            for future in list(pending):
+                i = futures[future]
+                error = expired(i, now)
+                if error is not None and not future.done():
+                    future.cancel()
+                    pending.discard(future)
+                    outcomes[i] = {'status': 'timeout', 'error': error}
+                    self._count('timed_out')
+            if not pending:
+                break
+            limits = [started[futures[f]] + self.device_timeout - now for f in pending if futures[f] in started]
+            if deadline is not None:
+                limits.append(deadline - now)
+            done, pending = wait(pending, timeout=max(min(limits, default=self.device_timeout), 0.001),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                elapsed = round((time.monotonic() - started.get(i, time.monotonic())) * 1000, 1)
+                try:
+                    feeds = future.result()
+                except Exception as e:
+                    logger.warning(f"Fetching channel {devices[i][0]} failed: {e}")
+                    feeds, error = None, str(e)
+                else:
+                    error = 'Failed to fetch data from ThingSpeak' if not feeds else None
+                # A fetch that gave up at its own timeout is reported as timed out
+                timed_out = expired(i, time.monotonic()) if error is not None else None
+                if error is None:
+                    outcomes[i] = {'status': 'ok', 'feeds': feeds, 'fetch_ms': elapsed}
+                    self._count('fetched')
+                elif timed_out is not None:
+                    outcomes[i] = {'status': 'timeout', 'error': timed_out, 'fetch_ms': elapsed}
+                    self._count('timed_out')
+                else:
+                    outcomes[i] = {'status': 'error', 'error': error, 'fetch_ms': elapsed}
+                    self._count('failed')
+        return [
+            {'channel_id': channel_id, 'api_key': api_key, **outcome}
+            for (channel_id, api_key), outcome in zip(devices, outcomes)
+        ]
+
+    def info(self):
+        """Concurrency limit, device timeout and fetch counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        return {'max_concurrency': self.max_concurrency, 'device_timeout': self.device_timeout, **stats}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fleet_from_env():
+    """
+    Build the FleetFetcher described by the environment
+
+    FLEET_MAX_CONCURRENCY: ThingSpeak fetches running at once (default 8)
+    FLEET_DEVICE_TIMEOUT: seconds one device's fetch may take (default 5)
+    """
+    return FleetFetcher(
+        max_concurrency=int(os.getenv('FLEET_MAX_CONCURRENCY', 8)),
+        device_timeout=float(os.getenv('FLEET_DEVICE_TIMEOUT', 5))
+    )
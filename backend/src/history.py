@@ -0,0 +1,534 @@
+"""
+Persistent history of readings and predictions per device
+
+When HISTORY_DB names a database file, every reading the API sees (polled channels, pushed streams, windows
+fetched for /predict and /predict/fleet) and every prediction it serves is
+appended to a local SQLite database, indexed by (device, time). Minute and
+hour rollups (reading count, sensor sum/min/max, predicted label counts and
+probability sums) are updated with each insert, so long ranges are
+answered from a few hundred pre-aggregated rows instead of a scan.
+
+Writes go through a queue to one background thread that commits them in
+batches, so the request path never waits on the disk. Raw rows, minute
+rollups and hour rollups each have their own retention; a periodic
+compaction deletes what is older and returns the free pages to the file
+system. Rows are never updated in place, and readings are deduplicated by
+their ThingSpeak entry_id (readings without one by their time and values),
+so re-fetching the same window does not count it twice. An item that fails
+to write is dropped on its own; the rest of its batch is still committed.
+
+Usage:
+    python history.py info
+    python history.py compact
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Database the CLI opens when HISTORY_DB is not set; the API records history only when it is
+HISTORY_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'history.db')
+
+SENSOR_COLUMNS = ['mq136', 'mq137', 'temp', 'humi']
+
+# Rollup resolutions and their bucket width in seconds
+RESOLUTIONS = {'minute': 60, 'hour': 3600}
+
+# Default retention (days) of raw rows and of each rollup resolution
+DEFAULT_RETENTION_DAYS = {'raw': 7, 'minute': 30, 'hour': 365}
+
+# Items committed per write transaction at most
+WRITE_BATCH = 500
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS readings (
+    device TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    entry_id INTEGER,
+    {', '.join(f'{name} REAL' for name in SENSOR_COLUMNS)},
+    UNIQUE (device, entry_id)
+);
+CREATE INDEX IF NOT EXISTS readings_device_ts ON readings (device, ts);
+CREATE TABLE IF NOT EXISTS predictions (
+    device TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    entry_id INTEGER,
+    class_label TEXT NOT NULL,
+    probability REAL,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS predictions_device_ts ON predictions (device, ts);
+CREATE TABLE IF NOT EXISTS reading_rollups (
+    device TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    {', '.join(f'{name}_sum REAL, {name}_min REAL, {name}_max REAL' for name in SENSOR_COLUMNS)},
+    PRIMARY KEY (device, resolution, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS prediction_rollups (
+    device TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    class_label TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    probability_sum REAL NOT NULL,
+    PRIMARY KEY (device, resolution, bucket, class_label)
+) WITHOUT ROWID;
+"""
+
+_READING_UPSERT = f"""
+INSERT INTO reading_rollups VALUES (?, ?, ?, ?, {', '.join('?, ?, ?' for _ in SENSOR_COLUMNS)})
+ON CONFLICT (device, resolution, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    {', '.join(f'{name}_sum = {name}_sum + excluded.{name}_sum, '
+               f'{name}_min = min({name}_min, excluded.{name}_min), '
+               f'{name}_max = max({name}_max, excluded.{name}_max)' for name in SENSOR_COLUMNS)}
+"""
+
+# Readings without an entry_id are the same reading when device, time and values match
+_DUPLICATE_WITHOUT_ID = f"""
+SELECT 1 FROM readings WHERE device = ? AND ts = ? AND entry_id IS NULL
+    AND {' AND '.join(f'{name} = ?' for name in SENSOR_COLUMNS)}
+LIMIT 1
+"""
+
+_PREDICTION_UPSERT = """
+INSERT INTO prediction_rollups VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (device, resolution, bucket, class_label) DO UPDATE SET
+    count = count + excluded.count,
+    probability_sum = probability_sum + excluded.probability_sum
+"""
+
+
+def to_epoch(timestamps, default=None):
+    """
+    Unix seconds of datetime64 timestamps; NaT (or no timestamps) becomes default
+
+    Returns:
+        np.ndarray: int64 seconds
+    """
+    default = int(time.time()) if default is None else int(default)
+    if timestamps is None:
+        return None
+    seconds = np.asarray(timestamps, dtype='datetime64[s]')
+    return np.where(np.isnat(seconds), default, seconds.astype(np.int64))
+
+
+def _add_reading(rollups, key, count, total, low, high):
+    """Fold count readings with sensor sums total and extremes low/high into rollups[key]"""
+    rollup = rollups.get(key)
+    if rollup is None:
+        rollups[key] = [count, total.copy(), low.copy(), high.copy()]
+    else:
+        rollup[0] += count
+        rollup[1] += total
+        np.minimum(rollup[2], low, out=rollup[2])
+        np.maximum(rollup[3], high, out=rollup[3])
+
+
+def iso(ts):
+    """ISO 8601 UTC string of unix seconds"""
+    return f"{np.datetime64(int(ts), 's')}Z"
+
+
+class HistoryStore:
+    """
+    Append-only SQLite history with minute/hour rollups
+
+    Args:
+        path (str): Database file; created with its directory on first use
+        retention_days (dict): Days kept for 'raw', 'minute' and 'hour' rows
+        compact_interval (float): Seconds between automatic compactions, 0 to disable
+    """
+
+    def __init__(self, path=HISTORY_DB, retention_days=None, compact_interval=3600.0):
+        self.path = path
+        self.retention_days = {**DEFAULT_RETENTION_DAYS, **(retention_days or {})}
+        self.compact_interval = compact_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as db:
+            # auto_vacuum only takes effect before the first table exists; WAL lets readers run during writes
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('PRAGMA journal_mode = WAL')
+            db.executescript(SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._last_compaction = time.monotonic()
+        self.stats = {'readings': 0, 'duplicates': 0, 'expired': 0, 'predictions': 0, 'compactions': 0,
+                      'write_errors': 0}
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('PRAGMA synchronous = NORMAL')
+        return db
+
+    def _cutoff(self, key, now):
+        return int(now - self.retention_days[key] * 86400)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    # Writes
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self._writer.start()
+        return self
+
+    def record_readings(self, device, values, timestamps=None, entry_ids=None):
+        """
+        Queue readings of a device for appending
+
+        Args:
+            device (str): Device (channel) identifier
+            values (array-like): Sensor values of shape (n, 4), [MQ136, MQ137, TEMP, HUMI]
+            timestamps (array, optional): datetime64 reading times; missing ones are stored as now
+            entry_ids (array, optional): ThingSpeak entry ids, used to skip readings already stored;
+                0 (what the feed parser gives entries without one) is stored as NULL
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(SENSOR_COLUMNS))
+        if len(values):
+            self._put(('readings', str(device), values, to_epoch(timestamps),
+                       None if entry_ids is None else np.asarray(entry_ids, dtype=np.int64)))
+
+    def record_prediction(self, device, class_label, probability=None, model_version=None, timestamp=None,
+                          source='predict', entry_id=None):
+        """Queue one served prediction (the meta-model's label and probability) of a device"""
+        ts = int(to_epoch([timestamp])[0]) if timestamp is not None else int(time.time())
+        self._put(('predictions', [(str(device), ts, source, entry_id, class_label, probability, model_version)]))
+
+    def record_events(self, events):
+        """Queue the readings and predictions of StreamHub events (see stream.py)"""
+        by_device = {}
+        for event in events:
+            by_device.setdefault(event['device_id'], []).append(event)
+        for device, device_events in by_device.items():
+            timestamps = np.array([np.datetime64(e['created_at'].rstrip('Z'), 's') if 'created_at' in e
+                                   else np.datetime64('NaT', 's') for e in device_events])
+            entry_ids = None
+            if all('entry_id' in e for e in device_events):
+                entry_ids = [e['entry_id'] for e in device_events]
+            self.record_readings(device, [e['reading'] for e in device_events], timestamps, entry_ids)
+            ts = to_epoch(timestamps)
+            self._put(('predictions', [
+                (device, int(t), 'stream', e.get('entry_id') or None, e['class_label'], e['probability'],
+                 e['model_version'])
+                for t, e in zip(ts, device_events)
+            ]))
+
+    def _put(self, item):
+        if self._writer is None:
+            # Without a writer thread, write synchronously (CLI, tests)
+            with closing(self._connect()) as db:
+                self._write(db, [item])
+        else:
+            self._queue.put(item)
+
+    def flush(self, timeout=None):
+        """Wait until every queued write is committed"""
+        if self._writer is not None:
+            done = threading.Event()
+            self._queue.put(('flush', done))
+            done.wait(timeout)
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            items = [self._queue.get()]
+            while len(items) < WRITE_BATCH:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiters = [item[1] for item in items if item[0] == 'flush']
+            try:
+                self._write(db, [item for item in items if item[0] != 'flush'])
+            except sqlite3.Error as e:
+                self._count('write_errors')
+                logger.warning(f"Committing {len(items)} history items failed: {e}")
+            if self.compact_interval and time.monotonic() - self._last_compaction >= self.compact_interval:
+                try:
+                    self.compact(db)
+                except sqlite3.Error as e:
+                    logger.warning(f"History compaction failed: {e}")
+            for done in waiters:
+                done.set()
+
+    def _write(self, db, items):
+        """
+        Append items in one transaction and fold the new rows into the rollups
+
+        Each item is written under its own savepoint: one that fails (e.g. a
+        prediction without a label) is rolled back and counted in
+        write_errors, without losing the other items of the batch.
+        """
+        if not items:
+            return
+        cutoff = self._cutoff('raw', time.time())
+        reading_rollups, prediction_rollups = {}, {}
+        counts = {'readings': 0, 'duplicates': 0, 'expired': 0, 'predictions': 0, 'write_errors': 0}
+        db.execute('BEGIN')
+        try:
+            for item in items:
+                item_readings, item_predictions = {}, {}
+                db.execute('SAVEPOINT item')
+                try:
+                    item_counts = self._write_item(db, item, cutoff, item_readings, item_predictions)
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    db.execute('ROLLBACK TO item')
+                    db.execute('RELEASE item')
+                    counts['write_errors'] += 1
+                    logger.warning(f"Dropping a history item of {item[0]}: {e}")
+                    continue
+                db.execute('RELEASE item')
+                for key, value in item_counts.items():
+                    counts[key] += value
+                for key, rollup in item_readings.items():
+                    _add_reading(reading_rollups, key, *rollup)
+                for key, (count, total) in item_predictions.items():
+                    rollup = prediction_rollups.setdefault(key, [0, 0.0])
+                    rollup[0] += count
+                    rollup[1] += total
+            db.executemany(_READING_UPSERT, [
+                (*key, count, *[float(v) for name in range(len(SENSOR_COLUMNS))
+                                for v in (total[name], low[name], high[name])])
+                for key, (count, total, low, high) in reading_rollups.items()
+            ])
+            db.executemany(_PREDICTION_UPSERT, [(*key, count, total)
+                                                for key, (count, total) in prediction_rollups.items()])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    @staticmethod
+    def _write_item(db, item, cutoff, reading_rollups, prediction_rollups):
+        """Insert one queued item, collecting its rollup contributions; returns its counts"""
+        if item[0] == 'predictions':
+            rows = item[1]
+            db.executemany('INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            for device, ts, _, _, class_label, probability, _ in rows:
+                for resolution, width in RESOLUTIONS.items():
+                    key = (device, resolution, ts // width * width, class_label)
+                    rollup = prediction_rollups.setdefault(key, [0, 0.0])
+                    rollup[0] += 1
+                    rollup[1] += probability or 0.0
+            return {'predictions': len(rows)}
+
+        _, device, values, ts, entry_ids = item
+        if ts is None:
+            ts = np.full(len(values), int(time.time()), dtype=np.int64)
+        counts = {'readings': 0, 'duplicates': 0, 'expired': 0}
+        for i, row in enumerate(values):
+            # Older than the raw retention: its rollups may already be final, skip it
+            if ts[i] < cutoff:
+                counts['expired'] += 1
+                continue
+            entry_id = None if entry_ids is None or entry_ids[i] <= 0 else int(entry_ids[i])
+            reading = (device, int(ts[i]), *map(float, row))
+            if entry_id is None and db.execute(_DUPLICATE_WITHOUT_ID, reading).fetchone():
+                counts['duplicates'] += 1
+                continue
+            cursor = db.execute('INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (device, int(ts[i]), entry_id, *map(float, row)))
+            if cursor.rowcount == 0:
+                counts['duplicates'] += 1
+                continue
+            counts['readings'] += 1
+            for resolution, width in RESOLUTIONS.items():
+                _add_reading(reading_rollups, (device, resolution, int(ts[i]) // width * width), 1, row, row, row)
+        return counts
+
+    def compact(self, db=None):
+        """
+        Delete rows past their retention and release the freed pages
+
+        Returns:
+            dict: Rows deleted per table
+        """
+        own = db is None
+        db = db or self._connect()
+        now = time.time()
+        deleted = {}
+        try:
+            for table in ('readings', 'predictions'):
+                deleted[table] = db.execute(f'DELETE FROM {table} WHERE ts < ?',
+                                            (self._cutoff('raw', now),)).rowcount
+            for resolution in RESOLUTIONS:
+                cutoff = self._cutoff(resolution, now)
+                deleted[f'{resolution}_rollups'] = sum(
+                    db.execute(f'DELETE FROM {table} WHERE resolution = ? AND bucket < ?',
+                               (resolution, cutoff)).rowcount
+                    for table in ('reading_rollups', 'prediction_rollups'))
+            db.execute('PRAGMA incremental_vacuum')
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            if own:
+                db.close()
+        self._last_compaction = time.monotonic()
+        self._count('compactions')
+        if any(deleted.values()):
+            logger.info(f"History compaction deleted {deleted}")
+        return deleted
+
+    # Queries
+
+    def devices(self):
+        """Device ids with any stored history and the time range of their raw readings"""
+        with closing(self._connect()) as db:
+            rows = db.execute("""
+                SELECT device, MIN(first), MAX(last), SUM(n) FROM (
+                    SELECT device, MIN(ts) AS first, MAX(ts) AS last, COUNT(*) AS n FROM readings GROUP BY device
+                    UNION ALL
+                    SELECT device, MIN(bucket), MAX(bucket), 0 FROM reading_rollups
+                    WHERE resolution = 'hour' GROUP BY device
+                ) GROUP BY device ORDER BY device
+            """).fetchall()
+        return [{'device_id': device, 'first': iso(first), 'last': iso(last), 'raw_readings': int(n)}
+                for device, first, last, n in rows]
+
+    def readings(self, device, start, end, limit=1000):
+        """
+        Raw readings of a device with start <= ts < end (unix seconds), oldest first
+
+        Returns:
+            list: Dicts with created_at, entry_id and the four sensor values
+        """
+        with closing(self._connect()) as db:
+            rows = db.execute(f"""
+                SELECT ts, entry_id, {', '.join(SENSOR_COLUMNS)} FROM readings
+                WHERE device = ? AND ts >= ? AND ts < ? ORDER BY ts, rowid LIMIT ?
+            """, (str(device), int(start), int(end), int(limit))).fetchall()
+        return [{'created_at': iso(ts), 'entry_id': entry_id, 'values': list(values)}
+                for ts, entry_id, *values in rows]
+
+    def predictions(self, device, start, end, limit=1000, source=None):
+        """Stored predictions of a device with start <= ts < end, oldest first"""
+        query = """
+            SELECT ts, source, entry_id, class_label, probability, model_version FROM predictions
+            WHERE device = ? AND ts >= ? AND ts < ?
+        """
+        params = [str(device), int(start), int(end)]
+        if source is not None:
+            query += ' AND source = ?'
+            params.append(source)
+        with closing(self._connect()) as db:
+            rows = db.execute(query + ' ORDER BY ts, rowid LIMIT ?', (*params, int(limit))).fetchall()
+        return [{'created_at': iso(ts), 'source': src, 'entry_id': entry_id, 'class_label': label,
+                 'probability': probability, 'model_version': version}
+                for ts, src, entry_id, label, probability, version in rows]
+
+    def rollups(self, device, resolution, start, end):
+        """
+        Minute or hour buckets of a device overlapping [start, end), oldest first
+
+        Returns:
+            list: Per bucket its start time, reading count, mean/min/max of each
+                  sensor, and predicted label counts with their mean probability
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r}, expected one of {list(RESOLUTIONS)}")
+        first = int(start) // RESOLUTIONS[resolution] * RESOLUTIONS[resolution]
+        params = (str(device), resolution, first, int(end))
+        with closing(self._connect()) as db:
+            readings = db.execute("""
+                SELECT * FROM reading_rollups WHERE device = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+            """, params).fetchall()
+            labels = db.execute("""
+                SELECT bucket, class_label, count, probability_sum FROM prediction_rollups
+                WHERE device = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+            """, params).fetchall()
+        buckets = {}
+        for _, _, bucket, count, *stats in readings:
+            stats = np.array(stats, dtype=float).reshape(len(SENSOR_COLUMNS), 3)
+            buckets[bucket] = {
+                'start': iso(bucket),
+                'count': count,
+                'mean': (stats[:, 0] / count).round(4).tolist(),
+                'min': stats[:, 1].tolist(),
+                'max': stats[:, 2].tolist(),
+                'labels': {},
+            }
+        for bucket, label, count, probability_sum in labels:
+            entry = buckets.setdefault(bucket, {'start': iso(bucket), 'count': 0, 'mean': None, 'min': None,
+                                                'max': None, 'labels': {}})
+            entry['labels'][label] = {'count': count, 'mean_probability': round(probability_sum / count, 4)}
+        return [buckets[bucket] for bucket in sorted(buckets)]
+
+    def info(self):
+        """Database path, size, retention and write counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        size = sum(os.path.getsize(path) for path in (self.path, self.path + '-wal') if os.path.exists(path))
+        return {
+            'path': self.path,
+            'size_bytes': size,
+            'retention_days': dict(self.retention_days),
+            'queued': self._queue.qsize(),
+            **stats,
+        }
+
+
+def retention_from_env():
+    """Retention days per table kind from HISTORY_RAW_DAYS, HISTORY_MINUTE_DAYS and HISTORY_HOUR_DAYS"""
+    return {key: float(os.getenv(f'HISTORY_{key.upper()}_DAYS', days)) for key, days in DEFAULT_RETENTION_DAYS.items()}
+
+
+def history_from_env():
+    """
+    Build and start the HistoryStore described by the environment, or None when disabled
+
+    HISTORY_DB: database file, e.g. backend/data/history.db; history is off when unset or empty
+    HISTORY_RAW_DAYS / HISTORY_MINUTE_DAYS / HISTORY_HOUR_DAYS: retention (default 7 / 30 / 365)
+    HISTORY_COMPACT_INTERVAL: seconds between compactions (default 3600)
+    """
+    path = os.getenv('HISTORY_DB')
+    if not path:
+        return None
+    if multiprocessing.parent_process() is not None:
+        # Inference worker processes re-import the API module; only the API process writes history
+        return None
+    retention = retention_from_env()
+    store = HistoryStore(path, retention, float(os.getenv('HISTORY_COMPACT_INTERVAL', 3600)))
+    logger.info(f"Recording history to {path} (retention {retention} days)")
+    return store.start()
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else 'info'
+    path = os.getenv('HISTORY_DB', HISTORY_DB)
+    if not path or not os.path.exists(path):
+        print(f"No history database at {path!r}")
+        return 1
+    store = HistoryStore(path, retention_from_env())
+    if command == 'compact':
+        print(json.dumps(store.compact(), indent=4))
+    elif command == 'info':
+        print(json.dumps({**store.info(), 'devices': store.devices()}, indent=4))
+    else:
+        print("Usage: python history.py [info|compact]")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,234 @@
+"""
+Background ThingSpeak ingestion for the E-Nose API
+
+A FeedPoller thread polls the configured channels on a fixed interval and
+appends newly seen readings to a fixed-size NumPy ring buffer per channel,
+so /predict can serve the latest window without a ThingSpeak round-trip.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from adapter import default_channel_id, feeds_to_sensor_matrix, get_client
+
+logger = logging.getLogger(__name__)
+
+N_SENSORS = 4
+
+
+class ReadingBuffer:
+    """
+    Fixed-capacity ring buffer of sensor readings backed by NumPy arrays
+
+    Args:
+        capacity (int): Maximum number of readings kept; older ones are overwritten
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._values = np.zeros((capacity, N_SENSORS), dtype=np.float64)
+        self._timestamps = np.full(capacity, np.datetime64('NaT', 's'), dtype='datetime64[s]')
+        self._entry_ids = np.zeros(capacity, dtype=np.int64)
+        self._start = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self.last_entry_id = 0
+        self.updated_at = None
+
+    def __len__(self):
+        return self._size
+
+    def append(self, values, timestamps, entry_ids):
+        """
+        Append readings, oldest first
+
+        Args:
+            values (array-like): Sensor values of shape (n, 4)
+            timestamps (array-like): datetime64 timestamps of length n
+            entry_ids (array-like): ThingSpeak entry ids of length n
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, N_SENSORS)
+        timestamps = np.asarray(timestamps, dtype='datetime64[s]')
+        entry_ids = np.asarray(entry_ids, dtype=np.int64)
+        n = len(values)
+        if n == 0:
+            return
+        if n > self.capacity:
+            values, timestamps, entry_ids = values[-self.capacity:], timestamps[-self.capacity:], entry_ids[-self.capacity:]
+            n = self.capacity
+
+        with self._lock:
+            end = (self._start + self._size) % self.capacity
+            positions = (end + np.arange(n)) % self.capacity
+            self._values[positions] = values
+            self._timestamps[positions] = timestamps
+            self._entry_ids[positions] = entry_ids
+
+            overflow = max(0, self._size + n - self.capacity)
+            self._start = (self._start + overflow) % self.capacity
+            self._size = min(self.capacity, self._size + n)
+            self.last_entry_id = max(self.last_entry_id, int(entry_ids.max()))
+            self.updated_at = time.time()
+
+    def snapshot(self, n=None):
+        """
+        Copy the most recent readings, oldest first
+
+        Args:
+            n (int, optional): Number of readings; defaults to everything buffered
+
+        Returns:
+            tuple: (values (n, 4) float64, timestamps datetime64[s], entry_ids int64)
+        """
+        with self._lock:
+            size = self._size if n is None else min(n, self._size)
+            positions = (self._start + self._size - size + np.arange(size)) % self.capacity
+            return self._values[positions], self._timestamps[positions], self._entry_ids[positions]
+
+
+class FeedPoller(threading.Thread):
+    """
+    Daemon thread that keeps a ReadingBuffer per ThingSpeak channel up to date
+
+    Args:
+        channels (list): (channel_id, api_key) pairs to poll
+        interval (float): Seconds between polling rounds
+        window (int): Readings kept per channel (ring buffer capacity)
+        client (ThingSpeakClient, optional): Client to use; defaults to the shared one
+        on_readings (callable, optional): Called as on_readings(channel_id, values,
+            timestamps, entry_ids) with the readings appended in each poll
+    """
+
+    def __init__(self, channels, interval=15.0, window=10, client=None, on_readings=None):
+        super().__init__(name='thingspeak-poller', daemon=True)
+        self.channels = [(str(channel_id), api_key) for channel_id, api_key in channels]
+        self.interval = interval
+        self.window = window
+        self.client = client or get_client()
+        self.on_readings = on_readings
+        self.buffers = {key: ReadingBuffer(window) for key in self.channels}
+        self.last_poll = {}
+        self.last_error = {}
+        self._stop_event = threading.Event()
+
+    def poll_once(self):
+        """Poll every channel once and append readings not seen before"""
+        for key in self.channels:
+            channel_id, api_key = key
+            try:
+                feeds = self.client.fetch_feeds(api_key, self.window, channel_id)
+                if feeds is None:
+                    self.last_error[key] = 'fetch failed'
+                    continue
+                appended = self._ingest(self.buffers[key], feeds)
+                if self.on_readings is not None and len(appended[0]):
+                    self.on_readings(channel_id, *appended)
+                self.last_poll[key] = time.time()
+                self.last_error.pop(key, None)
+            except Exception as e:
+                self.last_error[key] = str(e)
+                logger.warning(f"Polling channel {channel_id} failed: {e}")
+
+    @staticmethod
+    def _ingest(buffer, feeds):
+        """
+        Parse feed entries and append those newer than the buffer's last entry
+
+        Returns:
+            tuple: (values, timestamps, entry_ids) that were appended
+        """
+        values, timestamps, entry_ids = feeds_to_sensor_matrix(feeds)
+        new = entry_ids > buffer.last_entry_id
+        appended = values[new], timestamps[new], entry_ids[new]
+        buffer.append(*appended)
+        return appended
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.poll_once()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        """Ask the thread to exit after the current round"""
+        self._stop_event.set()
+
+    def get_buffer(self, api_key, channel_id=None):
+        """
+        Return the buffer polled for api_key (and channel_id if given)
+
+        Returns:
+            tuple: ((channel_id, api_key), ReadingBuffer) or (None, None) if not polled
+        """
+        for key, buffer in self.buffers.items():
+            if key[1] == api_key and (channel_id is None or key[0] == str(channel_id)):
+                return key, buffer
+        return None, None
+
+    def freshness(self, key):
+        """
+        Describe how fresh a channel's buffered data is
+
+        Returns:
+            dict: Buffered reading count, age of the newest reading and of the last successful poll
+        """
+        buffer = self.buffers[key]
+        now = time.time()
+        _, timestamps, _ = buffer.snapshot(1)
+        newest = timestamps[-1] if len(timestamps) else np.datetime64('NaT', 's')
+        last_poll = self.last_poll.get(key)
+        return {
+            'buffered_readings': len(buffer),
+            'latest_entry_time': None if np.isnat(newest) else f"{newest}Z",
+            'data_age_seconds': None if np.isnat(newest) else round(now - newest.astype('int64'), 1),
+            'last_poll_age_seconds': None if last_poll is None else round(now - last_poll, 1),
+            'last_error': self.last_error.get(key)
+        }
+
+
+def channels_from_env():
+    """
+    Read the channels to poll from the environment
+
+    FEED_POLL_CHANNELS is a comma separated list of channel_id:api_key pairs;
+    without it the THINGSPEAK_CHANNEL_ID / THINGSPEAK_API_KEY pair is used.
+    """
+    spec = os.getenv('FEED_POLL_CHANNELS', '')
+    channels = []
+    for item in spec.split(','):
+        item = item.strip()
+        if ':' in item:
+            channel_id, api_key = item.split(':', 1)
+            channels.append((channel_id.strip(), api_key.strip()))
+    if not channels and os.getenv('THINGSPEAK_API_KEY'):
+        channels.append((default_channel_id(), os.getenv('THINGSPEAK_API_KEY')))
+    return channels
+
+
+def start_poller_from_env(on_readings=None):
+    """
+    Start a FeedPoller if FEED_POLL_INTERVAL is set to a positive number
+
+    Args:
+        on_readings (callable, optional): Passed through to FeedPoller
+
+    Returns:
+        FeedPoller: The running poller, or None if polling is disabled
+    """
+    interval = float(os.getenv('FEED_POLL_INTERVAL', 0))
+    channels = channels_from_env()
+    if interval <= 0 or not channels:
+        return None
+    if multiprocessing.parent_process() is not None:
+        # Inference worker processes re-import the API module; only the API process polls
+        return None
+    window = int(os.getenv('FEED_WINDOW', 10))
+    poller = FeedPoller(channels, interval=interval, window=window, on_readings=on_readings)
+    poller.start()
+    logger.info(f"Polling {len(channels)} ThingSpeak channel(s) every {interval}s, window {window}")
+    return poller
@@ -0,0 +1,351 @@
+"""
+Grid index for the KNN base model
+
+The KNN member (manhattan, uniform weights) keeps the whole scaled training
+set. This module buckets that reference set into a uniform grid over the
+scaled features, stores it as plain .npy arrays (points sorted by cell plus
+CSR cell offsets) that load with mmap, and answers k-nearest-neighbour
+queries by looking only at the 3^d block of cells around each query. A
+query is answered from the block only when its k-th distance is provably
+smaller than the distance to the block boundary; the few remaining queries
+(far from the training data) fall back to an exact scan, so results always
+equal a brute-force search. The scan costs what the brute-force KNN costs:
+one pass over the reference set per query, with at most EXACT_BLOCK_ROWS x
+n_points distances in memory at once.
+
+The blocks hold 3^d and 5^d cells, so the index is only built for up to
+MAX_DIMENSIONS features (the raw sensors); models on rolling features keep
+the sklearn KNN.
+
+Usage:
+    python knn_index.py build     # build models/knn_index/ from knn_model.pkl and verify it
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from registry import BASE_MODEL_FILES, MODELS_DIR, replace_directory
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = 'knn_index'
+INDEX_ARRAYS = ('points', 'labels', 'order', 'cell_keys', 'cell_start')
+
+# Quantile of the training points' k-th neighbour distance used as the cell width
+CELL_QUANTILE = 0.9
+# Block radii (in cells) tried before falling back to a full scan
+SEARCH_RADII = (1, 2)
+EXACT_BLOCK_ROWS = 256
+
+# Larger batches go to the estimator's own kd-tree, which is faster in bulk
+INDEX_MAX_ROWS = 16
+
+# Most features a grid index is built for: the radius-2 block alone has 5^d cells
+MAX_DIMENSIONS = 4
+
+
+def check_finite(X):
+    """Reject NaN and infinite values, as sklearn's check_array does"""
+    if not np.isfinite(X).all():
+        raise ValueError("Input X contains NaN or infinity.")
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+class GridKNNIndex:
+    """
+    Exact manhattan k-nearest-neighbour search over a uniform grid
+
+    Args:
+        arrays (Mapping): 'points' (n, d) sorted by cell, 'labels' (n,) class indices,
+            'order' (n,) original row of each point, 'cell_keys' (n_cells,) sorted
+            linear cell ids, 'cell_start' (n_cells + 1,) CSR offsets into points
+        meta (dict): 'origin', 'cell_size', 'shape', 'k', 'n_classes' and provenance
+
+    Raises:
+        ValueError: If the points have more than MAX_DIMENSIONS features
+    """
+
+    def __init__(self, arrays, meta):
+        if len(meta['shape']) > MAX_DIMENSIONS:
+            raise ValueError(f"A grid index supports at most {MAX_DIMENSIONS} features, "
+                             f"got {len(meta['shape'])}")
+        for name in INDEX_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.origin = np.asarray(meta['origin'], dtype=np.float64)
+        self.cell_size = float(meta['cell_size'])
+        self.shape = np.asarray(meta['shape'], dtype=np.int64)
+        self.k = int(meta['k'])
+        self.n_classes = int(meta['n_classes'])
+        self.strides = np.cumprod(np.concatenate([[1], self.shape[:0:-1]]))[::-1].astype(np.int64)
+        # Cell offsets of the block searched at each radius
+        self.blocks = {
+            radius: np.array(list(itertools.product(range(-radius, radius + 1), repeat=len(self.shape))), dtype=np.int64)
+            for radius in SEARCH_RADII
+        }
+
+    @classmethod
+    def build(cls, points, labels, k, n_classes, cell_size, source=None):
+        """
+        Bucket a reference set into the grid
+
+        Args:
+            points (np.ndarray): Reference matrix (n, d) in the space queries come in
+            labels (np.ndarray): Class index of each reference point
+            k (int): Neighbours per query
+            n_classes (int): Number of classes
+            cell_size (float): Grid cell width
+            source (str, optional): Hash of the model the reference set came from
+        """
+        points = np.asarray(points, dtype=np.float64)
+        origin = points.min(axis=0) - cell_size
+        shape = np.floor((points.max(axis=0) - origin) / cell_size).astype(np.int64) + 2
+        meta = {
+            'origin': origin.tolist(),
+            'cell_size': float(cell_size),
+            'shape': shape.tolist(),
+            'k': int(k),
+            'n_classes': int(n_classes),
+            'n_points': int(len(points)),
+            'source': source,
+        }
+        strides = np.cumprod(np.concatenate([[1], shape[:0:-1]]))[::-1].astype(np.int64)
+        keys = (np.floor((points - origin) / cell_size).astype(np.int64) * strides).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_first = np.unique(keys[order], return_index=True)
+        arrays = {
+            'points': points[order],
+            'labels': np.asarray(labels, dtype=np.int32)[order],
+            'order': order.astype(np.int64),
+            'cell_keys': cell_keys,
+            'cell_start': np.append(cell_first, len(points)).astype(np.int64),
+        }
+        return cls(arrays, meta)
+
+    @classmethod
+    def from_estimator(cls, knn, source=None, quantile=CELL_QUANTILE):
+        """Build an index over a fitted KNeighborsClassifier's reference set"""
+        if knn.weights != 'uniform' or knn.effective_metric_ not in ('manhattan', 'cityblock', 'l1'):
+            raise ValueError(f"Unsupported KNN configuration weights={knn.weights} metric={knn.effective_metric_}")
+        points = np.asarray(knn._fit_X, dtype=np.float64)
+        # Cell width: the k-th neighbour distance of most points (k + 1 counts the point itself)
+        distances, _ = knn.kneighbors(points, n_neighbors=min(knn.n_neighbors + 1, len(points)))
+        cell_size = max(float(np.quantile(distances[:, -1], quantile)), 1e-6)
+        return cls.build(points, knn._y, knn.n_neighbors, len(knn.classes_), cell_size, source)
+
+    def save(self, path):
+        """Write the index as .npy arrays plus index.json into a fresh directory swapped in for `path`"""
+        def write(directory):
+            for name in INDEX_ARRAYS:
+                np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+            with open(os.path.join(directory, 'index.json'), 'w') as f:
+                json.dump(self.meta, f, indent=4)
+
+        return replace_directory(path, write)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an index written by save(); arrays are memory-mapped by default"""
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in INDEX_ARRAYS}
+        return cls(arrays, meta)
+
+    def _exact(self, X):
+        """k nearest of each row by scanning every point, EXACT_BLOCK_ROWS rows at a time"""
+        k = self.k
+        result = np.empty((X.shape[0], k), dtype=np.int64)
+        for start in range(0, X.shape[0], EXACT_BLOCK_ROWS):
+            block = X[start:start + EXACT_BLOCK_ROWS]
+            distances = np.zeros((len(block), len(self.points)))
+            for j in range(X.shape[1]):
+                distances += np.abs(block[:, j, None] - self.points[:, j])
+            # Keep everything tied with the k-th distance, then order by (distance, original row)
+            kth = np.partition(distances, k - 1, axis=1)[:, k - 1]
+            rows, cols = np.nonzero(distances <= kth[:, None])
+            ranked = np.lexsort((self.order[cols], distances[rows, cols], rows))
+            counts = np.bincount(rows, minlength=len(block))
+            positions = (np.cumsum(counts) - counts)[:, None] + np.arange(k)
+            result[start:start + len(block)] = cols[ranked[positions]]
+        return result
+
+    def _block_search(self, X, radius):
+        """
+        k nearest neighbours of each row among the (2 * radius + 1)^d cells around it
+
+        Returns:
+            tuple: (neighbours (n, k), accepted mask) -- a row is accepted when its
+                k-th distance is below the distance to the block boundary, so no
+                point outside the block can be closer
+        """
+        n_rows, k = X.shape[0], self.k
+        coords = np.floor((X - self.origin) / self.cell_size).astype(np.int64)
+        cells = coords[:, None, :] + self.blocks[radius][None, :, :]
+        inside = ((cells >= 0) & (cells < self.shape)).all(axis=2)
+        keys = (cells * self.strides).sum(axis=2)
+
+        # Look up every block cell; missing or out-of-grid cells are empty ranges
+        slot = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = inside & (self.cell_keys[slot] == keys)
+        starts = np.where(found, self.cell_start[slot], 0).ravel()
+        counts = np.where(found, self.cell_start[slot + 1] - self.cell_start[slot], 0).ravel()
+
+        # Flatten all candidate ranges into (row, point) pairs, ranked per row
+        total = counts.reshape(n_rows, -1).sum(axis=1)
+        candidate_row = np.repeat(np.arange(n_rows), total)
+        candidate = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        distances = np.abs(self.points[candidate] - X[candidate_row]).sum(axis=1)
+        ranked = np.lexsort((self.order[candidate], distances, candidate_row))
+
+        # Anything outside the block is at least `bound` away (manhattan >= chebyshev)
+        bound = np.minimum(X - (self.origin + (coords - radius) * self.cell_size),
+                           self.origin + (coords + radius + 1) * self.cell_size - X).min(axis=1)
+        accepted = total >= k
+        positions = (np.cumsum(total) - total)[:, None] + np.arange(k)
+        positions = np.where(accepted[:, None], positions, 0)
+        neighbors = candidate[ranked[positions]] if len(candidate) else np.zeros((n_rows, k), dtype=np.int64)
+        if len(candidate):
+            accepted &= distances[ranked[positions[:, -1]]] < bound
+        return neighbors, accepted
+
+    def kneighbors(self, X):
+        """
+        Indices (into the sorted points) of the k nearest neighbours of each row
+
+        Rows not settled by the immediate block of cells are retried with a
+        wider block and finally with a full scan. Ties in distance are broken
+        by the original training row, like a stable brute-force search.
+
+        Raises:
+            ValueError: If X contains NaN or infinite values
+        """
+        X = np.asarray(X, dtype=np.float64)
+        check_finite(X)
+        result = np.empty((X.shape[0], self.k), dtype=np.int64)
+        pending = np.arange(X.shape[0])
+        for radius in SEARCH_RADII:
+            if len(pending) == 0:
+                return result
+            neighbors, accepted = self._block_search(X[pending], radius)
+            result[pending[accepted]] = neighbors[accepted]
+            pending = pending[~accepted]
+        if len(pending):
+            result[pending] = self._exact(X[pending])
+        return result
+
+    def predict_proba(self, X):
+        """Uniform-weight class probabilities, like KNeighborsClassifier.predict_proba"""
+        neighbors = self.kneighbors(X)
+        votes = self.labels[neighbors]
+        return (votes[:, :, None] == np.arange(self.n_classes)).sum(axis=1) / self.k
+
+
+class IndexedKNN:
+    """
+    Drop-in replacement for the KNN base model backed by a GridKNNIndex
+
+    Batches of up to INDEX_MAX_ROWS rows are answered by the index, larger
+    ones by the wrapped estimator.
+
+    Args:
+        estimator: The fitted KNeighborsClassifier the index was built from
+        index (GridKNNIndex): Index over its reference set
+    """
+
+    def __init__(self, estimator, index):
+        self.estimator = estimator
+        self.index = index
+        self.classes_ = estimator.classes_
+        self.n_neighbors = estimator.n_neighbors
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        check_finite(X)
+        if X.shape[0] > INDEX_MAX_ROWS:
+            return self.estimator.predict_proba(X)
+        return self.index.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def load_index(models_dir=MODELS_DIR, source=None):
+    """
+    Load the saved index if it was built from the current knn_model.pkl
+
+    Args:
+        source (str, optional): Expected knn_model.pkl hash, e.g. from a binary
+            artifact when the pickle itself is not deployed
+
+    Returns:
+        GridKNNIndex: The memory-mapped index, or None if missing, stale or over MAX_DIMENSIONS
+    """
+    path = os.path.join(models_dir, INDEX_DIR)
+    if not os.path.exists(os.path.join(path, 'index.json')):
+        return None
+    try:
+        index = GridKNNIndex.load(path)
+    except ValueError as e:
+        logger.warning(f"Ignoring KNN index {path}: {e}")
+        return None
+    if source is None:
+        source = _file_hash(os.path.join(models_dir, BASE_MODEL_FILES['knn']))
+    if index.meta.get('source') != source:
+        return None
+    return index
+
+
+def main(argv):
+    import time
+
+    import joblib
+
+    command = argv[1] if len(argv) > 1 else 'build'
+    if command != 'build':
+        print("Usage: python knn_index.py build")
+        return 1
+
+    knn_path = os.path.join(MODELS_DIR, BASE_MODEL_FILES['knn'])
+    knn = joblib.load(knn_path)
+    if knn.n_features_in_ > MAX_DIMENSIONS:
+        print(f"KNN model takes {knn.n_features_in_} features; a grid index is only built for up to "
+              f"{MAX_DIMENSIONS}, the API keeps the sklearn KNN")
+        return 1
+    index = GridKNNIndex.from_estimator(knn, source=_file_hash(knn_path))
+    print(f"Index: {index.meta['n_points']} points, {len(index.cell_keys)} cells, cell size {index.cell_size:.4f}")
+
+    # Verify on the reference set itself and on jittered copies of it, before anything is written
+    reference = np.asarray(knn._fit_X, dtype=np.float64)
+    rng = np.random.default_rng(0)
+    queries = np.vstack([reference, reference + rng.normal(scale=index.cell_size, size=reference.shape)])
+    mismatches = int((np.abs(knn.predict_proba(queries) - index.predict_proba(queries)).max(axis=1) > 0).sum())
+    print(f"{len(queries)} queries: {mismatches} mismatches")
+    if mismatches:
+        print("Index does not match the sklearn KNN; nothing written")
+        return 1
+    path = index.save(os.path.join(MODELS_DIR, INDEX_DIR))
+    index = GridKNNIndex.load(path)
+    print(f"Index written to {path}")
+
+    for rows in (1, 8, 64):
+        timings = {}
+        for name, predict_proba in (('sklearn', knn.predict_proba), ('index', index.predict_proba)):
+            start = time.perf_counter()
+            for offset in range(0, 1024, rows):
+                predict_proba(reference[offset:offset + rows])
+            timings[name] = (time.perf_counter() - start) / (1024 // rows) * 1e6
+        print(f"{rows:>3} rows/query: sklearn {timings['sklearn']:.0f} us, index {timings['index']:.0f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,184 @@
+"""
+Latency histograms of the request hot path in Prometheus text format
+
+Each /predict is split into stages (ThingSpeak fetch, parsing, input
+features, inference, per-reading scoring) and every ensemble pass reports
+its own stages (feature building, scaling, each base model, the
+meta-model) under their masked names. The durations are aggregated into
+cumulative histograms labelled with the stage and the model-set version,
+next to per-endpoint request counters and the cascade's early-exit and
+escalation counts, and rendered for GET /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets, +Inf is implied
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels):
+    """Prometheus label set of a sorted (name, value) tuple"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def sample_lines(name, kind, help_text, samples):
+    """
+    Exposition lines of one metric family
+
+    Args:
+        name (str): Metric name
+        kind (str): 'counter' or 'gauge'
+        help_text (str): HELP line
+        samples (list): (labels dict, value) pairs; None values are skipped
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {float(value):g}')
+    return lines
+
+
+class Histogram:
+    """Thread-safe family of cumulative histograms, one series per label set"""
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """{label tuple: (bucket counts, sum, count)}"""
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            for bound, cumulative in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(key + (("le", f"{bound:g}"),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(key + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_labels(key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    """Thread-safe family of counters, one series per label set"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        """{label tuple: value}"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return sample_lines(self.name, 'counter', self.help_text,
+                            [(dict(key), value) for key, value in sorted(self.snapshot().items())])
+
+
+class LatencyMetrics:
+    """Stage and request latency histograms plus request counters"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.stages = Histogram('enose_stage_duration_seconds',
+                                'Time spent per stage of a prediction request or ensemble pass',
+                                ('stage', 'model_version'), buckets)
+        self.requests = Histogram('enose_request_duration_seconds', 'End-to-end request latency',
+                                  ('endpoint', 'method', 'status', 'model_version'), buckets)
+        self.cascade = Counter('enose_cascade_rows_total',
+                               'Rows answered early by the cascade member or escalated to the full stack',
+                               ('outcome', 'model_version'))
+
+    def record(self, timings, model_version):
+        """Observe a {stage: seconds} mapping"""
+        for stage, seconds in timings.items():
+            self.stages.observe(seconds, stage=stage, model_version=model_version or '')
+
+    def observe_request(self, endpoint, method, status, seconds, model_version):
+        self.requests.observe(seconds, endpoint=endpoint, method=method, status=str(status),
+                              model_version=model_version or '')
+
+    def record_cascade(self, escalated, model_version):
+        """Count the rows of a cascade pass (a bool or a list of them, see predict.run_cascade)"""
+        escalated = escalated if isinstance(escalated, list) else [escalated]
+        n_escalated = sum(bool(e) for e in escalated)
+        model_version = model_version or ''
+        if n_escalated:
+            self.cascade.inc(n_escalated, outcome='escalated', model_version=model_version)
+        if n_escalated < len(escalated):
+            self.cascade.inc(len(escalated) - n_escalated, outcome='early_exit', model_version=model_version)
+
+    def render(self, extra_lines=()):
+        """Prometheus text exposition of every histogram and counter plus extra_lines"""
+        lines = self.stages.render() + self.requests.render() + self.cascade.render() + list(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Wall time of the stages of one request, in the order they ran
+
+    `timings` holds the request's own stages; `ensemble` the stages of the
+    ensemble pass that served it, reported by predict_with_models (possibly
+    from an inference worker) and recorded where that pass returns.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.ensemble = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, timings):
+        """Merge the stages of an ensemble pass measured elsewhere"""
+        for name, seconds in (timings or {}).items():
+            self.ensemble[name] = self.ensemble.get(name, 0.0) + seconds
+
+    def breakdown_ms(self):
+        """Milliseconds per stage, the ensemble stages and the total since the timer started"""
+        result = {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()}
+        if self.ensemble:
+            result['ensemble'] = {name: round(seconds * 1000, 3) for name, seconds in self.ensemble.items()}
+        result['total'] = round((time.perf_counter() - self.started) * 1000, 3)
+        return result
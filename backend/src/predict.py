@@ -1,16 +1,24 @@
-import numpy as np
-import pickle
-import joblib
-import xgboost as xgb
-import sys
 import os
-from config import config
+import time
+
+import numpy as np
+
+from features import batch_features, independent_features
+from registry import registry
 
-# Get absolute path to models directory
-MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
-print(f"MODELS_DIR: {MODELS_DIR}")
-print(f"Scaler path: {os.path.join(MODELS_DIR, 'scaler.pkl')}")
-print(f"Scaler exists: {os.path.exists(os.path.join(MODELS_DIR, 'scaler.pkl'))}")
+# Only numpy and the light local modules are imported here; scikit-learn,
+# xgboost and joblib load with the models (registry), so importing predict
+# stays cheap for the API, its workers and the CLI.
+
+# "compiled" serves batches of up to COMPILED_MAX_ROWS rows with the fused NumPy
+# kernel (see compiled.py) when one was exported for the active model set;
+# "fast" serves every batch with the pruned float32 kernel built by fast.py
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'sklearn')
+COMPILED_MAX_ROWS = int(os.getenv('COMPILED_MAX_ROWS', 64))
+
+# Answer confident rows with one cheap base model (see cascade.py) when a
+# cascade was fitted for the active model set; takes precedence over INFERENCE_ENGINE
+INFERENCE_CASCADE = os.getenv('INFERENCE_CASCADE', 'False').lower() == 'true'
 
 
 def create_security_mapping():
@@ -98,83 +106,369 @@ def get_meta_features(models: dict, X: np.ndarray) -> np.ndarray:
     return np.hstack(preds)
 
 
-def predict_with_models(input_data):
+# Short registry names -> names used in API responses (before masking)
+MODEL_DISPLAY_NAMES = {
+    'rf': 'random_forest',
+    'xgb': 'xgboost',
+    'knn': 'knn',
+    'ann': 'ann',
+}
+
+# Response order of the per-model predictions and which of them report a probability
+RESPONSE_ORDER = ['ann', 'rf', 'xgb', 'knn', 'meta']
+PROBABILITY_MODELS = {'ann', 'meta'}
+
+
+def to_sensor_matrix(input_data, widths=(4,)):
     """
-    Make predictions using all base models and a meta-model
+    Convert input to a float (N, 4) matrix of [MQ136, MQ137, TEMP, HUMI] rows
+
+    Args:
+        input_data: Rows of sensor values
+        widths (tuple): Accepted row widths; add len(FEATURE_NAMES) to also take
+            precomputed rolling feature rows
+
+    Raises:
+        ValueError: If the rows do not have an accepted number of values
+    """
+    X = np.asarray(input_data, dtype=float)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if X.ndim != 2 or X.shape[1] not in widths or X.shape[0] == 0:
+        expected = ' or '.join(f"(N, {width})" for width in widths)
+        raise ValueError(f"Expected sensor data of shape {expected}, got {X.shape}")
+    return X
+
+
+def input_widths(model_set=None):
+    """Row widths accepted for the model set: raw sensors, plus feature rows when it uses them"""
+    if model_set is None:
+        model_set = registry.get()
+    if model_set.features is None:
+        return (4,)
+    return (4, len(model_set.features.names))
+
+
+def model_inputs(X, model_set=None, timestamps=None):
+    """
+    Turn sensor rows into the model set's input features
+
+    Raw-sensor model sets take X as is. For rolling-feature model sets, rows that
+    already hold len(FEATURE_NAMES) values pass through; raw rows are treated as
+    one time-ordered window when timestamps are given, otherwise each row as a
+    reading of its own.
+
+    Args:
+        X (np.ndarray): Matrix from to_sensor_matrix
+        model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+        timestamps (array, optional): datetime64 reading times of the rows
+
+    Returns:
+        np.ndarray: Model input matrix
+    """
+    if model_set is None:
+        model_set = registry.get()
+    spec = model_set.features
+    if spec is None:
+        if X.shape[1] != 4:
+            raise ValueError(f"Model set {model_set.version} takes raw sensor rows of 4 values, got {X.shape[1]}")
+        return X
+    if X.shape[1] == len(spec.names):
+        return X
+    if timestamps is not None:
+        return batch_features(X, timestamps, spec=spec)
+    return independent_features(X, spec)
+
+
+def masked_model_name(name):
+    """Security name of a base/meta model key (rf -> base_2, ...)"""
+    _, model_mapping = create_security_mapping()
+    return model_mapping.get(MODEL_DISPLAY_NAMES.get(name, name), name)
+
+
+def run_ensemble(X, model_set=None, timestamps=None, timings=None):
+    """
+    Run every model of the stack exactly once over all rows of X
+
+    Each base model's predict_proba output is computed once and reused both
+    for its own label (argmax over classes_, which is what predict() does)
+    and as its block of the meta-features.
+
+    Args:
+        X (np.ndarray): Raw sensor matrix of shape (N, 4), or rolling feature rows
+        model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+        timestamps (array, optional): Reading times, used to build rolling features (see model_inputs)
+        timings (dict, optional): Filled with the seconds spent per stage: 'features',
+            'scale', each model under its masked name, or 'compiled' / 'fast' for the fused kernels
+
+    Returns:
+        dict: 'probabilities' per model name (rf, xgb, knn, ann, meta), each an
+              (N, n_classes) array, and 'classes', the shared class labels; the
+              fast kernel only reports the base models it kept, and a cascade
+              pass adds 'escalated' (see run_cascade)
+    """
+    if model_set is None:
+        model_set = registry.get()
+    if timings is None:
+        timings = {}
+    clock = time.perf_counter()
+
+    def lap(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[stage] = now - clock
+        clock = now
+
+    X = model_inputs(X, model_set, timestamps)
+    lap('features')
+
+    if INFERENCE_CASCADE and model_set.cascade is not None:
+        return run_cascade(X, model_set, lap)
+
+    if INFERENCE_ENGINE == 'fast' and model_set.fast is not None:
+        result = model_set.fast.run(X)
+        lap('fast')
+        return result
+
+    if INFERENCE_ENGINE == 'compiled' and model_set.compiled is not None and len(X) <= COMPILED_MAX_ROWS:
+        result = model_set.compiled.run(X)
+        lap('compiled')
+        return result
+
+    X_scaled = model_set.scaler.transform(X)
+    lap('scale')
+
+    probabilities = {}
+    for name, model in model_set.base_models.items():
+        probabilities[name] = model.predict_proba(X_scaled)
+        lap(masked_model_name(name))
+
+    # Same layout as get_meta_features, built from the probabilities above
+    meta_X = np.hstack([probabilities[name] for name in model_set.base_models])
+    probabilities['meta'] = model_set.meta_model.predict_proba(meta_X)
+    lap('meta')
+
+    return {
+        'probabilities': probabilities,
+        'classes': model_set.meta_model.classes_
+    }
+
+
+def run_cascade(X, model_set, lap):
+    """
+    Cascade pass of run_ensemble: the cascade member scores every row, the rest
+    of the stack only the rows whose top probability misses its class threshold
+
+    Returns:
+        dict: As run_ensemble; 'meta' holds the member's probabilities for rows
+              answered early, the other base models are NaN on those rows (and
+              absent when no row escalated), and 'escalated' flags the rows
+              that went through the full stack
+    """
+    cascade = model_set.cascade
+    X_scaled = model_set.scaler.transform(X)
+    lap('scale')
+
+    first = model_set.base_models[cascade.member].predict_proba(X_scaled)
+    lap(masked_model_name(cascade.member))
+    escalated = ~cascade.early_exit(first)
+
+    probabilities = {cascade.member: first}
+    meta = first.copy()
+    if escalated.any():
+        rows = X_scaled[escalated]
+        for name, model in model_set.base_models.items():
+            if name != cascade.member:
+                probabilities[name] = np.full(first.shape, np.nan)
+                probabilities[name][escalated] = model.predict_proba(rows)
+                lap(masked_model_name(name))
+        meta_X = np.hstack([probabilities[name][escalated] for name in model_set.base_models])
+        meta[escalated] = model_set.meta_model.predict_proba(meta_X)
+        lap('meta')
+    probabilities['meta'] = meta
+
+    return {
+        'probabilities': probabilities,
+        'classes': model_set.meta_model.classes_,
+        'escalated': escalated
+    }
+
+
+def label_names(classes):
+    """Meat type names indexed like classes"""
+    return np.array([map_label_to_meat_type(c) for c in classes], dtype=object)
+
+
+def predict_batch(input_data, model_set=None, timings=False):
+    """
+    Make predictions for many sensor vectors in one pass through the ensemble
 
     Parameters:
-    input_data (list or array): List of sensor readings [MQ136, MQ137, TEMP, HUMI]
+    input_data (list or array): Sensor readings of shape (N, 4), rows [MQ136, MQ137, TEMP, HUMI],
+        each scored on its own; rolling feature rows are accepted too when the models use them
+    model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+    timings (bool): Also return the seconds spent per stage (see run_ensemble) under 'timings'
 
     Returns:
-    dict: Predictions from all models including meta-model with class labels and probabilities
+    dict: Row count, the version of the model set that scored the rows and columnar
+          predictions per (masked) model name: a list of N class labels, plus N
+          probabilities for the models that report one. With the cascade, models
+          that did not score a row have None in its place and 'meta' gets an
+          'escalated' column
     """
-    input_array = np.array(input_data).reshape(1, -1)
+    if model_set is None:
+        model_set = registry.get()
+    stages = {}
+    X = to_sensor_matrix(input_data, input_widths(model_set))
+    ensemble = run_ensemble(X, model_set, timings=stages)
+    names = label_names(ensemble['classes'])
 
-    # Load scaler only
-    try:
-        scaler_path = os.path.join(MODELS_DIR, 'scaler.pkl')
-        print(f"Loading scaler from: {scaler_path}")
-        scaler = joblib.load(scaler_path)
-        print("Scaler loaded successfully")
-    except Exception as e:
-        print(f"Error loading scaler: {e}")
-        raise
-
-    # Scale input
-    input_scaled = scaler.transform(input_array)
-
-    # Load base models
-    rf_model  = joblib.load(os.path.join(MODELS_DIR, 'random_forest_model.pkl'))
-    xgb_model = joblib.load(os.path.join(MODELS_DIR, 'xgboost_model.pkl'))
-    knn_model = joblib.load(os.path.join(MODELS_DIR, 'knn_model.pkl'))
-    ann_model = joblib.load(os.path.join(MODELS_DIR, 'ann_model.pkl'))  # MLPClassifier
-
-    base_models = {'rf': rf_model, 'xgb': xgb_model, 'knn': knn_model, 'ann': ann_model}
-
-    # ANN prediction
-    ann_prob  = ann_model.predict_proba(input_scaled)
-    ann_index = np.argmax(ann_prob, axis=1)[0]
-    ann_label = ann_model.classes_[ann_index]
-    ann_conf  = float(ann_prob[0, ann_index])
-
-    # Random Forest prediction
-    rf_pred  = rf_model.predict(input_scaled)[0]
-    rf_label = str(rf_pred) if hasattr(rf_pred, 'dtype') else rf_pred
-
-    # XGBoost prediction
-    xgb_pred  = xgb_model.predict(input_scaled)[0]
-    xgb_label = str(xgb_pred) if hasattr(xgb_pred, 'dtype') else xgb_pred
-
-    # KNN prediction
-    knn_pred  = knn_model.predict(input_scaled)[0]
-    knn_label = str(knn_pred) if hasattr(knn_pred, 'dtype') else knn_pred
-
-    # Meta-model prediction
-    meta_X      = get_meta_features(base_models, input_scaled)
-    meta_model  = joblib.load(os.path.join(MODELS_DIR, 'meta_model.pkl'))
-    meta_prob   = meta_model.predict_proba(meta_X)
-    meta_index  = np.argmax(meta_prob, axis=1)[0]
-    meta_label  = str(meta_model.classes_[meta_index])
-    meta_conf   = float(meta_prob[0, meta_index])
-
-    # Create original predictions
-    original_predictions = {
-        'ann':   {'class_label': map_label_to_meat_type(ann_label),  'probability': round(ann_conf, 4)},
-        'random_forest': {'class_label': map_label_to_meat_type(rf_label)},
-        'xgboost':      {'class_label': map_label_to_meat_type(xgb_label)},
-        'knn':          {'class_label': map_label_to_meat_type(knn_label)},
-        'meta':         {'class_label': map_label_to_meat_type(meta_label), 'probability': round(meta_conf, 4)}
+    original_predictions = {}
+    for name in RESPONSE_ORDER:
+        prob = ensemble['probabilities'].get(name)
+        if prob is None:
+            continue
+        index = np.argmax(prob, axis=1)
+        columns = {'class_label': names[index].tolist()}
+        if name in PROBABILITY_MODELS:
+            conf = prob[np.arange(len(index)), index]
+            columns['probability'] = np.round(conf.astype(np.float64), 4).tolist()
+        skipped = np.flatnonzero(np.isnan(prob[:, 0]))
+        for values in columns.values():
+            for i in skipped:
+                values[i] = None
+        if name == 'meta' and 'escalated' in ensemble:
+            columns['escalated'] = ensemble['escalated'].tolist()
+        original_predictions[MODEL_DISPLAY_NAMES.get(name, name)] = columns
+
+    result = {
+        'count': int(X.shape[0]),
+        'model_version': model_set.version,
+        'predictions': mask_model_predictions(original_predictions)
     }
-    
-    # Mask model names for security
-    masked_predictions = mask_model_predictions(original_predictions)
-    
+    if timings:
+        result['timings'] = stages
+    return result
+
+
+def classify_readings(sensor_arrays, timestamps=None, model_set=None):
+    """
+    Classify every reading of a window in one vectorized pass and summarize it
+
+    Parameters:
+    sensor_arrays (list or array): Readings of shape (N, 4), oldest first
+    timestamps (array, optional): datetime64 reading times, reported with each transition
+        and used to build rolling features when the models use them
+    model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+
+    Returns:
+    dict: Per-reading meta labels and probabilities plus a summary with the
+          majority vote, the mean meta probability per class and the label
+          transitions over time
+    """
+    X = to_sensor_matrix(sensor_arrays)
+    ensemble = run_ensemble(X, model_set, timestamps)
+    names = label_names(ensemble['classes'])
+
+    meta_prob = ensemble['probabilities']['meta']
+    index = np.argmax(meta_prob, axis=1)
+    conf = meta_prob[np.arange(len(index)), index]
+
+    # Majority vote over the per-reading meta labels (ties go to the lower class)
+    votes = np.bincount(index, minlength=len(names))
+    majority = int(np.argmax(votes))
+
+    # Positions where the label differs from the previous reading
+    changes = np.flatnonzero(index[1:] != index[:-1]) + 1
+    transitions = [
+        {'index': int(i), 'from': names[index[i - 1]], 'to': names[index[i]]}
+        for i in changes
+    ]
+    if timestamps is not None:
+        for transition in transitions:
+            created_at = timestamps[transition['index']]
+            transition['created_at'] = None if np.isnat(created_at) else f"{created_at}Z"
+
+    mean_prob = meta_prob.mean(axis=0)
+
     return {
+        'class_label': names[index].tolist(),
+        'probability': np.round(conf.astype(np.float64), 4).tolist(),
+        'summary': {
+            'count': int(len(index)),
+            'majority_label': names[majority],
+            'majority_share': round(float(votes[majority]) / len(index), 4),
+            'label_counts': {names[i]: int(votes[i]) for i in np.flatnonzero(votes)},
+            'mean_probability': {names[i]: round(float(p), 4) for i, p in enumerate(mean_prob)},
+            'transitions': transitions
+        }
+    }
+
+
+def row_predictions(predictions, i):
+    """Row i of predict_batch's columnar predictions, leaving out the models that did not score it"""
+    return {
+        name: {key: values[i] for key, values in columns.items()}
+        for name, columns in predictions.items()
+        if columns['class_label'][i] is not None
+    }
+
+
+def predict_with_models(input_data, model_set=None, timings=False):
+    """
+    Make predictions using all base models and a meta-model
+
+    Parameters:
+    input_data (list or array): List of sensor readings [MQ136, MQ137, TEMP, HUMI], or a
+        rolling feature row when the models use them
+    model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+    timings (bool): Also return the seconds spent per stage (see run_ensemble) under 'timings'
+
+    Returns:
+    dict: Predictions from all models including meta-model with class labels and probabilities,
+          and the version of the model set that made them
+    """
+    batch = predict_batch(np.array(input_data).reshape(1, -1), model_set, timings)
+
+    result = {
         'input_data': input_data,
-        'predictions': masked_predictions
+        'model_version': batch['model_version'],
+        'predictions': row_predictions(batch['predictions'], 0)
     }
+    if timings:
+        result['timings'] = batch['timings']
+    return result
+
+
+def window_input(sensor_matrix, reading_times=None, feature_row=None, model_set=None):
+    """
+    The row /predict scores for a fetched window of readings
+
+    Raw-sensor models classify the window average; rolling-feature models
+    classify the newest reading in the context of the window (or the given
+    feature_row, e.g. kept incrementally by the stream hub).
+
+    Parameters:
+    sensor_matrix (np.ndarray): Readings of shape (N, 4), oldest first
+    reading_times (array, optional): datetime64 reading times
+    feature_row (array, optional): Precomputed rolling features of the newest reading
+    model_set (ModelSet, optional): Loaded ensemble; defaults to the registry's active set
+
+    Returns:
+    tuple: (input row, "average" or "rolling_features")
+    """
+    if model_set is None:
+        model_set = registry.get()
+    if model_set.features is None:
+        return np.round(sensor_matrix.mean(axis=0), 2), 'average'
+    if feature_row is None or len(feature_row) != len(model_set.features.names):
+        feature_row = batch_features(sensor_matrix, reading_times, spec=model_set.features)[-1]
+    return np.asarray(feature_row, dtype=float), 'rolling_features'
+
 
 if __name__ == "__main__":
+    import sys
+
     if len(sys.argv) == 5:
         try:
             sensor_readings = [float(arg) for arg in sys.argv[1:5]]
@@ -0,0 +1,491 @@
+"""
+Process-wide model registry for the E-Nose ensemble
+
+Loads the scaler, the four base models and the meta-model once, validates
+that they fit together and hands out immutable ``ModelSet`` snapshots.
+When the files in ``backend/models`` change on disk the next lookup loads
+the new set and swaps it in atomically; other threads keep being served the
+previous snapshot meanwhile, and requests that already hold it finish on it.
+
+With MODEL_FORMAT=binary the set is served from the memory-mapped flat
+arrays exported by ``python compiled.py export-binary`` instead of the
+pickles, so worker processes share its pages and start without importing
+scikit-learn or xgboost.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Get absolute path to models directory
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+
+# Artifact file names; base model order must match the meta-model training order
+SCALER_FILE = 'scaler.pkl'
+BASE_MODEL_FILES = {
+    'rf': 'random_forest_model.pkl',
+    'xgb': 'xgboost_model.pkl',
+    'knn': 'knn_model.pkl',
+    'ann': 'ann_model.pkl',
+}
+META_MODEL_FILE = 'meta_model.pkl'
+N_SENSOR_FEATURES = 4
+
+# Optional fused NumPy kernel exported by compiled.py
+COMPILED_FILE = 'ensemble_compiled.npz'
+
+# Optional grid index over the KNN reference set built by knn_index.py
+KNN_INDEX_FILE = os.path.join('knn_index', 'index.json')
+
+# Rolling feature spec written by train_base_model.py --features rolling
+FEATURES_FILE = 'features.json'
+
+# Binary artifact directory exported by compiled.py (manifest.json plus one .npy per array)
+BINARY_DIR = 'ensemble_binary'
+BINARY_MANIFEST = os.path.join(BINARY_DIR, 'manifest.json')
+
+# Optional pruned float32 variant built by fast.py (served with INFERENCE_ENGINE=fast)
+FAST_DIR = 'ensemble_fast'
+FAST_MANIFEST = os.path.join(FAST_DIR, 'manifest.json')
+
+# Optional early-exit thresholds fitted by cascade.py (served with INFERENCE_CASCADE=True)
+CASCADE_FILE = 'cascade.json'
+
+# 'pickle' loads the joblib artifacts, 'binary' the memory-mapped export
+MODEL_FORMAT = os.getenv('MODEL_FORMAT', 'pickle')
+
+# Short names the per-model content hashes are keyed by
+MODEL_HASH_NAMES = {SCALER_FILE: 'scaler', **{f: name for name, f in BASE_MODEL_FILES.items()},
+                    META_MODEL_FILE: 'meta', FEATURES_FILE: 'features'}
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when the model artifacts cannot be loaded or do not fit together"""
+
+
+class ModelSet:
+    """
+    Immutable snapshot of a loaded ensemble
+
+    Attributes:
+        scaler: Fitted StandardScaler
+        base_models (dict): Base models keyed by short name, in meta-feature order
+        meta_model: Fitted meta-model
+        version (str): Short content hash of all artifacts
+        loaded_at (float): Unix time the set was loaded
+        compiled (CompiledEnsemble): Fused NumPy kernel exported from this set, or None
+        fast (FastEnsemble): Pruned float32 kernel built from this set by fast.py, or None
+        cascade (Cascade): Early-exit member and thresholds fitted on this set by cascade.py, or None
+        features (FeatureSpec): Rolling feature pipeline the models take, or None for raw sensors
+        model_hashes (dict): Short content hash of each artifact (scaler, rf, xgb, knn, ann,
+            meta and features when present), the same whichever format the set was loaded from
+    """
+
+    __slots__ = ('scaler', 'base_models', 'meta_model', 'version', 'loaded_at', 'compiled', 'features',
+                 'model_hashes', 'fast', 'cascade')
+
+    def __init__(self, scaler, base_models, meta_model, version, compiled=None, features=None,
+                 model_hashes=None, fast=None, cascade=None):
+        self.scaler = scaler
+        self.base_models = base_models
+        self.meta_model = meta_model
+        self.version = version
+        self.loaded_at = time.time()
+        self.compiled = compiled
+        self.features = features
+        self.model_hashes = model_hashes or {}
+        self.fast = fast
+        self.cascade = cascade
+
+    @property
+    def classes(self):
+        """Class labels shared by every model in the set"""
+        return self.meta_model.classes_
+
+
+def replace_directory(path, write):
+    """
+    Write an artifact directory beside `path` and swap it in with os.replace
+
+    write(directory) fills a fresh sibling directory. The previous directory
+    is then renamed aside and the new one into place, so files are never
+    rewritten in place: readers that memory-mapped the old arrays keep them
+    (they are unlinked, not overwritten) and a reader sees one complete
+    export or the other. Between the two renames `path` is briefly missing,
+    which the registry treats like an artifact still being written.
+
+    Returns:
+        str: path
+    """
+    path = os.path.abspath(path)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    old = f"{path}.old-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        write(tmp)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+def _artifact_files():
+    """Return all artifact file names in load order"""
+    return [SCALER_FILE] + list(BASE_MODEL_FILES.values()) + [META_MODEL_FILE]
+
+
+def _validate(model_set):
+    """
+    Check that the loaded artifacts form a usable ensemble
+
+    Args:
+        model_set (ModelSet): Freshly loaded set
+
+    Raises:
+        ModelLoadError: If shapes or classes are inconsistent
+    """
+    n_features = getattr(model_set.scaler, 'n_features_in_', N_SENSOR_FEATURES)
+    if n_features < N_SENSOR_FEATURES:
+        raise ModelLoadError(f"Scaler expects {n_features} features, need at least {N_SENSOR_FEATURES}")
+    if model_set.features is not None and n_features != len(model_set.features.names):
+        raise ModelLoadError(f"Scaler expects {n_features} features, {FEATURES_FILE} "
+                             f"describes {len(model_set.features.names)}")
+
+    meta_classes = np.asarray(model_set.meta_model.classes_).astype(float)
+    for name, model in model_set.base_models.items():
+        if not hasattr(model, 'predict_proba'):
+            raise ModelLoadError(f"Base model '{name}' has no predict_proba")
+        classes = np.asarray(model.classes_).astype(float)
+        if not np.array_equal(classes, meta_classes):
+            raise ModelLoadError(f"Base model '{name}' classes {classes} differ from meta classes {meta_classes}")
+
+    # Run one probe row through the whole stack so shape mismatches fail at load time
+    probe = np.asarray(model_set.scaler.mean_, dtype=float).reshape(1, -1)
+    probe_scaled = model_set.scaler.transform(probe)
+    meta_X = np.hstack([m.predict_proba(probe_scaled) for m in model_set.base_models.values()])
+    model_set.meta_model.predict_proba(meta_X)
+
+
+class ModelRegistry:
+    """
+    Loads the ensemble once and hot-swaps it when the artifacts change
+
+    Args:
+        models_dir (str): Directory holding the pickled artifacts
+        check_interval (float): Minimum seconds between on-disk change checks
+        model_format (str): 'pickle' or 'binary' (see MODEL_FORMAT)
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, check_interval=5.0, model_format=MODEL_FORMAT):
+        if model_format not in ('pickle', 'binary'):
+            raise ValueError(f"Unknown model format {model_format!r}, expected 'pickle' or 'binary'")
+        self.models_dir = models_dir
+        self.check_interval = check_interval
+        self.model_format = model_format
+        self._current = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, filename):
+        return os.path.join(self.models_dir, filename)
+
+    def _stat_fingerprint(self):
+        """Cheap change detector built from file mtimes and sizes"""
+        fingerprint = []
+        required, optional = _artifact_files(), [COMPILED_FILE, KNN_INDEX_FILE, FEATURES_FILE, FAST_MANIFEST,
+                                                CASCADE_FILE]
+        if self.model_format == 'binary':
+            # Pickles are optional next to the binary artifact; when present they are checked against it
+            required, optional = [BINARY_MANIFEST], required + optional[1:]
+        for filename in required:
+            st = os.stat(self._path(filename))
+            fingerprint.append((filename, st.st_mtime_ns, st.st_size))
+        for filename in optional:
+            path = self._path(filename)
+            if os.path.exists(path):
+                st = os.stat(path)
+                fingerprint.append((filename, st.st_mtime_ns, st.st_size))
+        return tuple(fingerprint)
+
+    def _load_compiled(self, version):
+        """Load the exported kernel if there is one and it was built from this version"""
+        path = self._path(COMPILED_FILE)
+        if not os.path.exists(path):
+            return None
+        from compiled import CompiledEnsemble
+
+        try:
+            compiled = CompiledEnsemble.load(path)
+        except Exception as e:
+            logger.warning(f"Ignoring compiled ensemble {path}: {e}")
+            return None
+        if compiled.source_version != version:
+            logger.warning(f"Ignoring compiled ensemble built from {compiled.source_version}, models are {version}")
+            return None
+        return compiled
+
+    def _load_fast(self, version, knn_index=None):
+        """Load the fast-mode kernel if there is one and it was built from this version"""
+        path = self._path(FAST_DIR)
+        if not os.path.exists(os.path.join(path, 'manifest.json')):
+            return None
+        from fast import FastEnsemble
+
+        try:
+            fast = FastEnsemble.load_binary(path)
+        except Exception as e:
+            logger.warning(f"Ignoring fast ensemble {path}: {e}")
+            return None
+        if fast.source_version != version:
+            logger.warning(f"Ignoring fast ensemble built from {fast.source_version}, models are {version}")
+            return None
+        if 'knn' in fast.base_order:
+            fast.knn_index = knn_index
+        return fast
+
+    def _load_cascade(self, model_set):
+        """Load the cascade thresholds if there are some and they were fitted on this version"""
+        path = self._path(CASCADE_FILE)
+        if not os.path.exists(path):
+            return None
+        from cascade import Cascade
+
+        try:
+            cascade = Cascade.load(path)
+        except Exception as e:
+            logger.warning(f"Ignoring cascade {path}: {e}")
+            return None
+        if cascade.source_version != model_set.version:
+            logger.warning(f"Ignoring cascade fitted on {cascade.source_version}, models are {model_set.version}")
+            return None
+        if cascade.member not in model_set.base_models or len(cascade.thresholds) != len(model_set.classes):
+            logger.warning(f"Ignoring cascade {path}: it does not fit model set {model_set.version}")
+            return None
+        return cascade
+
+    def _load_knn_index(self, source=None):
+        """Load the KNN grid index if there is one and it was built from the current pickle (or source hash)"""
+        from knn_index import load_index
+
+        try:
+            return load_index(self.models_dir, source)
+        except Exception as e:
+            logger.warning(f"Ignoring KNN index in {self.models_dir}: {e}")
+            return None
+
+    def _load_features(self, digest=None, hashes=None):
+        """Load features.json if present, adding its bytes to digest and its hash to hashes"""
+        path = self._path(FEATURES_FILE)
+        if not os.path.exists(path):
+            return None
+        from features import FeatureSpec
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            features = FeatureSpec.load(path)
+        except Exception as e:
+            raise ModelLoadError(f"Error loading {path}: {e}") from e
+        if digest is not None:
+            digest.update(data)
+        if hashes is not None:
+            hashes['features'] = hashlib.sha256(data).hexdigest()[:12]
+        return features
+
+    def _pickle_hashes(self):
+        """Content hashes of the pickles and features.json, or None if a pickle is missing"""
+        hashes = {}
+        for filename in _artifact_files() + [FEATURES_FILE]:
+            path = self._path(filename)
+            if not os.path.exists(path):
+                if filename == FEATURES_FILE:
+                    continue
+                return None
+            with open(path, 'rb') as f:
+                hashes[MODEL_HASH_NAMES[filename]] = hashlib.sha256(f.read()).hexdigest()[:12]
+        return hashes
+
+    def _load_binary_set(self):
+        """Build a ModelSet from the memory-mapped binary artifact"""
+        from compiled import CompiledEnsemble
+
+        path = self._path(BINARY_DIR)
+        try:
+            compiled = CompiledEnsemble.load_binary(path)
+        except Exception as e:
+            raise ModelLoadError(f"Error loading {path}: {e}") from e
+        hashes = {}
+        features = self._load_features(hashes=hashes)
+        if hashes.get('features') != compiled.model_hashes.get('features'):
+            raise ModelLoadError(f"{FEATURES_FILE} differs from the one {path} was exported with")
+        pickles = self._pickle_hashes()
+        if pickles is not None and pickles != compiled.model_hashes:
+            raise ModelLoadError(f"{path} was exported from other pickles than the ones in {self.models_dir}; "
+                                 f"re-run python compiled.py export-binary")
+
+        scaler, base_models, meta_model = compiled.members()
+        compiled.knn_index = self._load_knn_index(compiled.model_hashes.get('knn'))
+        model_set = ModelSet(
+            scaler=scaler,
+            base_models=base_models,
+            meta_model=meta_model,
+            version=compiled.source_version,
+            compiled=compiled,
+            features=features,
+            model_hashes=dict(compiled.model_hashes),
+        )
+        try:
+            _validate(model_set)
+        except Exception as e:
+            raise ModelLoadError(f"Model set failed validation: {e}") from e
+        model_set.fast = self._load_fast(model_set.version, compiled.knn_index)
+        model_set.cascade = self._load_cascade(model_set)
+        return model_set
+
+    def _load_set(self):
+        """Load, hash and validate every artifact into a new ModelSet"""
+        if self.model_format == 'binary':
+            return self._load_binary_set()
+        import joblib
+
+        digest = hashlib.sha256()
+        hashes = {}
+        loaded = {}
+        for filename in _artifact_files():
+            path = self._path(filename)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest.update(data)
+                hashes[MODEL_HASH_NAMES[filename]] = hashlib.sha256(data).hexdigest()[:12]
+                loaded[filename] = joblib.load(path)
+            except Exception as e:
+                raise ModelLoadError(f"Error loading {path}: {e}") from e
+
+        features = self._load_features(digest, hashes)
+
+        model_set = ModelSet(
+            scaler=loaded[SCALER_FILE],
+            base_models={name: loaded[filename] for name, filename in BASE_MODEL_FILES.items()},
+            meta_model=loaded[META_MODEL_FILE],
+            version=digest.hexdigest()[:12],
+            features=features,
+            model_hashes=hashes,
+        )
+        knn_index = self._load_knn_index()
+        if knn_index is not None:
+            from knn_index import IndexedKNN
+
+            model_set.base_models['knn'] = IndexedKNN(model_set.base_models['knn'], knn_index)
+        model_set.compiled = self._load_compiled(model_set.version)
+        if model_set.compiled is not None:
+            model_set.compiled.knn_index = knn_index
+        model_set.fast = self._load_fast(model_set.version, knn_index)
+        model_set.cascade = self._load_cascade(model_set)
+        try:
+            _validate(model_set)
+        except ModelLoadError:
+            raise
+        except Exception as e:
+            raise ModelLoadError(f"Model set failed validation: {e}") from e
+        return model_set
+
+    def load(self):
+        """
+        Load the ensemble now, replacing any current set
+
+        Returns:
+            ModelSet: The newly active set
+        """
+        with self._lock:
+            fingerprint = self._stat_fingerprint()
+            model_set = self._load_set()
+            self._current = model_set
+            self._fingerprint = fingerprint
+            self._last_check = time.monotonic()
+        logger.info(f"Loaded model set {model_set.version} from {self.models_dir}")
+        return model_set
+
+    def reload_if_changed(self, blocking=True):
+        """
+        Reload the ensemble if the artifacts on disk changed since the last load
+
+        A set that fails to load or validate (e.g. while files are still being
+        written), or whose files changed while it was loading, is ignored and
+        the current set stays active.
+
+        Args:
+            blocking (bool): Wait for a reload already running in another thread
+
+        Returns:
+            bool: True if a new set was swapped in
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._last_check = time.monotonic()
+            try:
+                fingerprint = self._stat_fingerprint()
+            except OSError as e:
+                logger.warning(f"Cannot stat model artifacts: {e}")
+                return False
+            if fingerprint == self._fingerprint:
+                return False
+            try:
+                model_set = self._load_set()
+            except ModelLoadError as e:
+                logger.warning(f"Keeping model set {self._current and self._current.version}: {e}")
+                return False
+            try:
+                changed = self._stat_fingerprint() != fingerprint
+            except OSError:
+                changed = True
+            if changed:
+                # Artifacts were replaced while loading (e.g. by train_incremental.py): the set may
+                # mix old and new files, so keep the current one and load again on the next check
+                logger.warning(f"Model artifacts changed while loading; keeping model set "
+                               f"{self._current and self._current.version}")
+                return False
+            previous = self._current
+            self._current = model_set
+            self._fingerprint = fingerprint
+        finally:
+            self._lock.release()
+        logger.info(f"Swapped model set {previous and previous.version} -> {model_set.version}")
+        return True
+
+    def get(self):
+        """
+        Return the active ModelSet, loading it on first use
+
+        Callers should keep the returned snapshot for the whole request so a
+        concurrent hot-swap never mixes artifacts from two versions.
+        """
+        current = self._current
+        if current is None:
+            return self.load()
+        if self.check_interval is not None and time.monotonic() - self._last_check >= self.check_interval:
+            self.reload_if_changed(blocking=False)
+            current = self._current
+        return current
+
+    @property
+    def version(self):
+        """Version of the active set, or None if nothing is loaded yet"""
+        return self._current.version if self._current is not None else None
+
+
+# Global registry instance
+registry = ModelRegistry(check_interval=float(os.getenv('MODEL_RELOAD_INTERVAL', 5.0)))
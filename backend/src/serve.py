@@ -0,0 +1,75 @@
+"""
+Production launcher for the E-Nose API
+
+Sizes the inference pool from the CPUs available to the process (one
+worker process each, models preloaded per worker) and serves the Flask app
+from a multi-threaded WSGI server, so ThingSpeak fetches of concurrent
+requests overlap while inference runs on the pool. waitress is used when it
+is installed; otherwise Werkzeug's threaded server. Every open event stream
+(GET /stream/<device_id>) holds a server thread for as long as it is open,
+so the server gets STREAM_MAX_SUBSCRIBERS threads on top of the request
+threads.
+
+Usage:
+    python serve.py [--workers N] [--threads N] [--max-pending N]
+
+Environment: API_HOST / API_PORT (or HOST / PORT), API_THREADED, PREDICTION_TIMEOUT,
+INFERENCE_WORKERS, INFERENCE_MAX_PENDING, API_THREADS, STREAM_MAX_SUBSCRIBERS.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from serving import default_workers
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the E-Nose API with an inference worker pool")
+    parser.add_argument('--host', default=os.getenv('API_HOST', os.getenv('HOST', '0.0.0.0')))
+    parser.add_argument('--port', type=int, default=int(os.getenv('API_PORT', os.getenv('PORT', 5000))))
+    parser.add_argument('--workers', default=os.getenv('INFERENCE_WORKERS', 'auto'),
+                        help="Inference worker processes, 'auto' for one per CPU")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Request threads (default API_THREADS or 4 per worker)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Inference calls admitted at once before answering 503")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+
+    workers = default_workers() if str(args.workers).lower() == 'auto' else int(args.workers)
+    threaded = os.getenv('API_THREADED', 'True').lower() == 'true'
+    threads = args.threads or int(os.getenv('API_THREADS', 0)) or 4 * max(workers, 1)
+    if not threaded:
+        threads = 1
+
+    # api reads the pool settings at import time
+    os.environ['INFERENCE_WORKERS'] = str(workers)
+    if args.max_pending:
+        os.environ['INFERENCE_MAX_PENDING'] = str(args.max_pending)
+    from api import app, inference_pool, stream_hub
+
+    inference_pool.warm_up()
+    if threaded:
+        threads += stream_hub.max_subscribers
+    logger.info(f"Serving on {args.host}:{args.port} with {threads} server thread(s) "
+                f"({stream_hub.max_subscribers} for event streams), {inference_pool.workers} inference worker(s)")
+    try:
+        try:
+            from waitress import serve
+        except ImportError:
+            from werkzeug.serving import run_simple
+
+            logger.warning("waitress is not installed; using Werkzeug's threaded server")
+            run_simple(args.host, args.port, app, threaded=threads > 1)
+        else:
+            serve(app, host=args.host, port=args.port, threads=threads)
+    finally:
+        inference_pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
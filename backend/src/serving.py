@@ -0,0 +1,187 @@
+"""
+Process pool for CPU-bound ensemble inference
+
+Request threads keep doing the network-bound work (ThingSpeak fetches,
+JSON) and hand the CPU-bound scoring to an InferencePool: a fixed number
+of worker processes that each load the model set once at start-up and then
+serve many requests, so inference is not serialized on the API process'
+GIL. The pool admits a bounded number of pending calls; beyond that callers
+get Overloaded straight away instead of queueing without limit, and every
+call waits at most until its request deadline (PREDICTION_TIMEOUT).
+
+With INFERENCE_WORKERS=0 (the default for `python api.py`) calls run on a
+thread pool of the API process instead: still behind the admission limit and
+the request deadline, but sharing the GIL. serve.py starts the API with one
+worker per CPU.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREDICTION_TIMEOUT = 30.0
+# Admission limit (and thread count) when inference runs in the API process
+IN_THREAD_MAX_PENDING = 64
+
+
+class Overloaded(RuntimeError):
+    """Raised when every inference slot is taken; the client should retry later"""
+
+
+class PredictionTimeout(RuntimeError):
+    """Raised when inference does not finish before the request deadline"""
+
+
+def _init_worker():
+    """Preload the model set once per worker process"""
+    from registry import registry
+
+    registry.load()
+
+
+def _call(fn, args, kwargs):
+    return fn(*args, **kwargs)
+
+
+class InferencePool:
+    """
+    Bounded pool of inference worker processes
+
+    A call that misses its deadline raises PredictionTimeout right away; the
+    work itself cannot be interrupted, so it keeps its slot until it finishes.
+
+    Args:
+        workers (int): Worker processes; 0 runs calls on threads of this process
+        max_pending (int, optional): Calls admitted at once (running plus queued);
+            defaults to twice the number of workers, IN_THREAD_MAX_PENDING without workers
+        timeout (float): Default seconds a call may take
+    """
+
+    def __init__(self, workers, max_pending=None, timeout=DEFAULT_PREDICTION_TIMEOUT):
+        self.workers = max(int(workers), 0)
+        self.max_pending = max_pending or (2 * self.workers if self.workers else IN_THREAD_MAX_PENDING)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.stats = {'completed': 0, 'rejected': 0, 'timed_out': 0, 'failed': 0}
+        if self.workers:
+            self._executor = self._new_executor()
+        else:
+            # One thread per admitted call, so an admitted call never waits for a thread
+            self._executor = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix='inference')
+
+    def _new_executor(self):
+        # spawn: workers must not inherit the API process' threads and locks
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+
+    def warm_up(self):
+        """Start every worker now (and load its models) instead of on the first requests"""
+        if self.workers:
+            list(self._executor.map(time.sleep, [0.0] * self.workers))
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _restart(self, executor):
+        """Replace a broken executor (a worker died) unless another thread already did"""
+        with self._lock:
+            if self._executor is executor:
+                logger.warning("Inference worker died; restarting the pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+
+    def call(self, fn, *args, deadline=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a worker and return its result
+
+        With worker processes, fn and its arguments must be picklable
+        (module-level functions, NumPy arrays).
+
+        Args:
+            deadline (float, optional): time.monotonic() by which the result is needed;
+                defaults to now + timeout
+
+        Raises:
+            Overloaded: If max_pending calls are already in flight
+            PredictionTimeout: If the result is not ready by the deadline
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise Overloaded(f"All {self.max_pending} inference slots are busy")
+
+        executor = self._executor
+        try:
+            future = executor.submit(_call, fn, args, kwargs)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart(executor)
+            self._count('failed')
+            raise Overloaded("Inference workers are restarting")
+        # The slot stays taken until the worker is really done, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            result = future.result(timeout=max(deadline - time.monotonic(), 0.0))
+        except FutureTimeoutError:
+            future.cancel()
+            self._count('timed_out')
+            raise PredictionTimeout("Inference did not finish within the request deadline") from None
+        except BrokenProcessPool:
+            self._restart(executor)
+            self._count('failed')
+            raise
+        except Exception:
+            self._count('failed')
+            raise
+        self._count('completed')
+        return result
+
+    def info(self):
+        """Pool size, admission limit and call counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        return {'workers': self.workers, 'max_pending': self.max_pending, 'timeout': self.timeout, **stats}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def default_workers():
+    """Inference workers for this machine: one per CPU the process may use"""
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_from_env():
+    """
+    Build the InferencePool described by the environment
+
+    INFERENCE_WORKERS: worker processes, 0 for inference on threads of the API process, 'auto' for one per CPU
+    INFERENCE_MAX_PENDING: admitted calls (default twice the workers)
+    PREDICTION_TIMEOUT: seconds per request
+    """
+    workers = os.getenv('INFERENCE_WORKERS', '0').strip().lower()
+    workers = default_workers() if workers == 'auto' else int(workers)
+    if multiprocessing.parent_process() is not None:
+        # Inside a worker (spawn re-imports the main module): no nested pool
+        workers = 0
+    max_pending = int(os.getenv('INFERENCE_MAX_PENDING', 0)) or None
+    timeout = float(os.getenv('PREDICTION_TIMEOUT', DEFAULT_PREDICTION_TIMEOUT))
+    pool = InferencePool(workers, max_pending=max_pending, timeout=timeout)
+    if pool.workers:
+        logger.info(f"Inference pool: {pool.workers} worker process(es), {pool.max_pending} pending calls, "
+                    f"{pool.timeout}s timeout")
+    return pool
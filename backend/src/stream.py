@@ -0,0 +1,347 @@
+"""
+Streaming inference for continuous monitoring
+
+Readings pushed for a device are scored once through the ensemble and fold
+into a per-device exponentially smoothed meta-probability state in O(1) per
+reading. When the models take rolling features, each device also keeps a
+RollingFeatures window that is updated in O(1) per reading. Every scored reading is published to the device's subscribers
+(the API streams them as Server-Sent Events).
+
+Pushes for one device are applied one at a time under that device's lock;
+device states are kept in an LRU of at most max_devices devices, and a
+device idle for longer than state_ttl starts over. The API scores pushes
+on its inference pool, so they share its admission limit and deadline.
+"""
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from adapter import feeds_to_sensor_matrix
+from features import RollingFeatures
+from predict import label_names, to_sensor_matrix, run_ensemble
+from registry import registry
+
+logger = logging.getLogger(__name__)
+
+
+class TooManySubscribers(RuntimeError):
+    """Raised when max_subscribers event streams are already open"""
+
+
+class DeviceState:
+    """
+    Exponentially smoothed meta-model probabilities of one device
+
+    Args:
+        alpha (float): Weight of the newest reading, in (0, 1]
+    """
+
+    __slots__ = ('alpha', 'probability', 'count', 'last_entry_id', 'updated_at', 'features', 'lock')
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.probability = None
+        self.count = 0
+        self.last_entry_id = 0
+        self.updated_at = None
+        self.features = None
+        # Held for the whole read-modify-write of a push
+        self.lock = threading.Lock()
+
+    def feature_rows(self, spec, X, timestamps=None):
+        """
+        Rolling feature rows of new readings, oldest first
+
+        The window restarts when the model set's FeatureSpec changes.
+        """
+        if self.features is None or self.features.spec != spec:
+            self.features = RollingFeatures(spec)
+        return np.array([
+            self.features.update(X[i], None if timestamps is None else timestamps[i])
+            for i in range(len(X))
+        ])
+
+    def update(self, probability):
+        """Fold one reading's meta probability vector into the state"""
+        if self.probability is None:
+            self.probability = np.array(probability, dtype=float)
+        else:
+            self.probability += self.alpha * (probability - self.probability)
+        self.count += 1
+        self.updated_at = time.time()
+        return self.probability
+
+
+def score_rows(inputs):
+    """
+    Meta-model probabilities of model input rows under the active model set
+
+    Module-level so the API can run it on its inference pool.
+
+    Returns:
+        dict: 'meta' (N, n_classes) probabilities, 'classes' and 'model_version'
+    """
+    model_set = registry.get()
+    ensemble = run_ensemble(inputs, model_set)
+    return {'meta': ensemble['probabilities']['meta'], 'classes': ensemble['classes'],
+            'model_version': model_set.version}
+
+
+class StreamHub:
+    """
+    Scores pushed readings, keeps per-device smoothed state and fans events out
+
+    Args:
+        alpha (float): Smoothing weight of the newest reading
+        max_queue (int): Events buffered per subscriber before the oldest are dropped
+        on_events (callable, optional): Called with the list of events of every push
+            (e.g. HistoryStore.record_events)
+        score (callable, optional): score(inputs) -> score_rows() result; defaults to
+            score_rows in the calling thread
+        max_devices (int): Device states kept; the least recently pushed is dropped first
+        state_ttl (float): Seconds after which an idle device's state is dropped, 0 = never
+        max_subscribers (int): Subscribers (open event streams) over all devices
+    """
+
+    def __init__(self, alpha=0.3, max_queue=100, on_events=None, score=None, max_devices=1000,
+                 state_ttl=86400.0, max_subscribers=16):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.max_queue = max_queue
+        self.on_events = on_events
+        self.score = score or score_rows
+        self.max_devices = max_devices
+        self.state_ttl = state_ttl
+        self.max_subscribers = max_subscribers
+        self._states = OrderedDict()
+        self._last_push = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _state(self, device_id):
+        """State of a device for a push, created if needed; evicts expired and least recently used states"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state_ttl:
+                while self._states:
+                    oldest = next(iter(self._states))
+                    if now - self._last_push[oldest] <= self.state_ttl:
+                        break
+                    del self._states[oldest], self._last_push[oldest]
+            state = self._states.get(device_id)
+            if state is None:
+                state = self._states[device_id] = DeviceState(self.alpha)
+            self._states.move_to_end(device_id)
+            self._last_push[device_id] = now
+            while len(self._states) > self.max_devices:
+                oldest, _ = self._states.popitem(last=False)
+                del self._last_push[oldest]
+            return state
+
+    def _existing_state(self, device_id):
+        with self._lock:
+            return self._states.get(str(device_id))
+
+    def push_feeds(self, device_id, feeds):
+        """
+        Score ThingSpeak feed entries (field1..field4 mapping) for a device
+
+        Entries whose entry_id is not newer than the last one seen are skipped;
+        entries without an entry_id are always scored.
+
+        Returns:
+            list: Published events
+        """
+        values, timestamps, entry_ids = feeds_to_sensor_matrix(feeds)
+        return self.push_readings(device_id, values, timestamps, entry_ids)
+
+    def push_readings(self, device_id, sensor_arrays, timestamps=None, entry_ids=None):
+        """
+        Score new readings for a device, update its state and publish one event per reading
+
+        Args:
+            device_id (str): Device (channel) identifier
+            sensor_arrays (array-like): Readings of shape (N, 4), oldest first
+            timestamps (array, optional): datetime64 reading times
+            entry_ids (array, optional): ThingSpeak entry ids, used to skip duplicates
+
+        Returns:
+            list: Published events
+
+        Raises:
+            Whatever score raises (e.g. the inference pool's Overloaded or
+            PredictionTimeout); the device's state is then left unchanged
+        """
+        device_id = str(device_id)
+        if len(sensor_arrays) == 0:
+            return []
+        X = to_sensor_matrix(sensor_arrays)
+        model_set = registry.get()
+        inputs = X
+
+        state = self._state(device_id)
+        with state.lock:
+            if entry_ids is not None:
+                entry_ids = np.asarray(entry_ids, dtype=np.int64)
+                # entry_id 0 means the entry had none: it cannot be a duplicate
+                new = (entry_ids > state.last_entry_id) | (entry_ids == 0)
+                X, entry_ids = X[new], entry_ids[new]
+                timestamps = None if timestamps is None else np.asarray(timestamps)[new]
+                if len(X) == 0:
+                    return []
+            features = state.features
+            if model_set.features is not None:
+                # The rolling window is updated in place; keep the old one in case scoring fails
+                state.features = copy.deepcopy(features)
+                inputs = state.feature_rows(model_set.features, X, timestamps)
+
+            # One ensemble pass for the whole push
+            try:
+                scored = self.score(inputs)
+            except Exception:
+                state.features = features
+                raise
+            if entry_ids is not None and len(entry_ids):
+                state.last_entry_id = max(state.last_entry_id, int(entry_ids.max()))
+            names = label_names(scored['classes'])
+            meta_prob = scored['meta']
+
+            events = []
+            for i in range(len(X)):
+                smoothed = state.update(meta_prob[i])
+                index = int(np.argmax(meta_prob[i]))
+                smoothed_index = int(np.argmax(smoothed))
+                event = {
+                    'device_id': device_id,
+                    'reading': X[i].tolist(),
+                    'class_label': names[index],
+                    'probability': round(float(meta_prob[i, index]), 4),
+                    'smoothed_label': names[smoothed_index],
+                    'smoothed_probability': round(float(smoothed[smoothed_index]), 4),
+                    'readings_seen': state.count,
+                    'model_version': scored['model_version']
+                }
+                if entry_ids is not None and entry_ids[i]:
+                    event['entry_id'] = int(entry_ids[i])
+                if timestamps is not None and not np.isnat(timestamps[i]):
+                    event['created_at'] = f"{timestamps[i]}Z"
+                events.append(event)
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(device_id, ()))
+
+        for subscriber in subscribers:
+            for event in events:
+                self._offer(subscriber, event)
+        if self.on_events is not None:
+            self.on_events(events)
+        return events
+
+    @staticmethod
+    def _offer(subscriber, event):
+        """Queue an event, dropping the subscriber's oldest one if it is full"""
+        while True:
+            try:
+                subscriber.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def subscribe(self, device_id):
+        """
+        Register a subscriber; returns the queue events are delivered to
+
+        Raises:
+            TooManySubscribers: If max_subscribers subscribers are registered
+        """
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            if sum(len(subscribers) for subscribers in self._subscribers.values()) >= self.max_subscribers:
+                raise TooManySubscribers(f"All {self.max_subscribers} event streams are in use")
+            self._subscribers.setdefault(str(device_id), []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, device_id, subscriber):
+        """Remove a subscriber registered with subscribe(); removing it twice is a no-op"""
+        with self._lock:
+            subscribers = self._subscribers.get(str(device_id), [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(str(device_id), None)
+
+    def latest_features(self, device_id, spec):
+        """
+        Rolling feature row of a device's newest reading
+
+        Args:
+            device_id (str): Device (channel) identifier
+            spec (FeatureSpec): Feature pipeline of the active model set
+
+        Returns:
+            np.ndarray: Feature row, or None if the device has no window for this spec
+        """
+        state = self._existing_state(device_id)
+        if state is None:
+            return None
+        with state.lock:
+            if state.features is None or state.features.spec != spec:
+                return None
+            latest = state.features.latest
+            return None if latest is None else latest.copy()
+
+    def get_state(self, device_id):
+        """
+        Current smoothed state of a device
+
+        Returns:
+            dict: Smoothed label/probabilities and reading count, or None if the device is unknown
+        """
+        state = self._existing_state(device_id)
+        if state is None:
+            return None
+        with state.lock:
+            if state.probability is None:
+                return None
+            probability = state.probability.copy()
+            count, updated_at = state.count, state.updated_at
+
+        names = label_names(registry.get().classes)
+        index = int(np.argmax(probability))
+        return {
+            'device_id': str(device_id),
+            'smoothed_label': names[index],
+            'smoothed_probability': round(float(probability[index]), 4),
+            'probabilities': {names[i]: round(float(p), 4) for i, p in enumerate(probability)},
+            'readings_seen': count,
+            'updated_at': updated_at
+        }
+
+
+def stream_hub_from_env(on_events=None, score=None):
+    """
+    Build the StreamHub described by the environment
+
+    STREAM_SMOOTHING: weight of the newest reading (default 0.3)
+    STREAM_MAX_DEVICES: device states kept (default 1000)
+    STREAM_STATE_TTL: seconds an idle device's state is kept, 0 = forever (default 86400)
+    STREAM_MAX_SUBSCRIBERS: open event streams over all devices (default 16)
+    """
+    return StreamHub(
+        alpha=float(os.getenv('STREAM_SMOOTHING', 0.3)),
+        on_events=on_events,
+        score=score,
+        max_devices=int(os.getenv('STREAM_MAX_DEVICES', 1000)),
+        state_ttl=float(os.getenv('STREAM_STATE_TTL', 86400)),
+        max_subscribers=int(os.getenv('STREAM_MAX_SUBSCRIBERS', 16))
+    )
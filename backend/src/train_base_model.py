@@ -1,123 +1,99 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split, KFold, GridSearchCV
-from sklearn.preprocessing import StandardScaler
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
-from sklearn.neighbors import KNeighborsClassifier           # thêm KNN
-from sklearn.neural_network import MLPClassifier
-import joblib
+import argparse
 import json
+import logging
+import os
 
-# 1. Load dữ liệu
-df = pd.read_csv('processed_data.csv')
-df = df.drop(columns=['DATE', 'TIME', 'Start Time'])
-X = df.drop(columns=['Label'])
-y = df['Label']
+import joblib
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
 
-# 2. Chuẩn hóa dữ liệu
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X)
+from dataset import open_training_store
+from features import DEFAULT_WINDOW, FEATURES_FILE, FeatureSpec
+from training import (CV_CACHE_FILE, STACKING_DIR, out_of_fold_probabilities, run_searches,
+                      save_stacking_features)
 
-# 3. Chia train/test
-X_train, X_test, y_train, y_test = train_test_split(
-    X_scaled, y, test_size=0.2, random_state=42
-)
 
-# --- RandomForest --- 
-print("Training RandomForest…")
-rf_param_grid = {
-    'n_estimators': [100, 200, 300],
-    'max_features': ['sqrt', 'log2'],
-    'random_state': [42]
-}
-rf_grid_search = GridSearchCV(
-    RandomForestClassifier(),
-    rf_param_grid,
-    cv=5, n_jobs=-1, verbose=1
-)
-rf_grid_search.fit(X_train, y_train)
-print("Best RandomForest parameters:", rf_grid_search.best_params_)
-print("Best RandomForest accuracy:", rf_grid_search.best_score_)
+def main():
+    parser = argparse.ArgumentParser(description="Train the base models")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size (default: number of cores)")
+    parser.add_argument('--full-grid', action='store_true', help="Score every configuration on every fold (no successive halving)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore and do not update the fold score cache")
+    parser.add_argument('--features', choices=['raw', 'rolling'], default='raw',
+                        help="Train on the raw sensor values or on rolling session features")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="Readings per rolling window")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- XGBoost --- 
-print("Training XGBoost…")
-xgb_param_grid = {
-    'n_estimators': [100, 200, 300],
-    'learning_rate': [0.01, 0.1, 0.2],
-    'random_state': [42]
-}
-xgb_grid_search = GridSearchCV(
-    XGBClassifier(use_label_encoder=False, eval_metric='mlogloss'),
-    xgb_param_grid,
-    cv=5, n_jobs=-1, verbose=1
-)
-xgb_grid_search.fit(X_train, y_train)
-print("Best XGBoost parameters:", xgb_grid_search.best_params_)
-print("Best XGBoost accuracy:", xgb_grid_search.best_score_)
+    # 1. Load dữ liệu từ dataset store (processed_data.csv được ingest ở lần chạy đầu)
+    store = open_training_store()
+    spec = FeatureSpec(window=args.window) if args.features == 'rolling' else None
+    X, y = store.training_frame(spec=spec)
+    print(f"{len(X)} rows, features: {list(X.columns)}")
 
-# --- KNN (thay cho SVM) --- 
-print("Training KNN…")
-knn_param_grid = {
-    'n_neighbors': [3, 5, 7, 9],      # số láng giềng
-    'weights': ['uniform', 'distance'],  # cách cho trọng số
-    'metric': ['euclidean', 'manhattan']
-}
-knn_grid_search = GridSearchCV(
-    KNeighborsClassifier(),
-    knn_param_grid,
-    cv=5, n_jobs=-1, verbose=1
-)
-knn_grid_search.fit(X_train, y_train)
-print("Best KNN parameters:", knn_grid_search.best_params_)
-print("Best KNN accuracy:", knn_grid_search.best_score_)
+    # 2. Chuẩn hóa dữ liệu
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
 
-# --- ANN (MLPClassifier) --- 
-print("Training ANN…")
-kf = KFold(n_splits=5, shuffle=True, random_state=42)
-ann_param_grid = {
-    'hidden_layer_sizes': [(50,), (100,), (50, 50)],
-    'activation': ['relu', 'tanh'],
-    'solver': ['adam', 'sgd'],
-    'max_iter': [200, 300, 1000]
-}
-ann_grid_search = GridSearchCV(
-    MLPClassifier(random_state=42),
-    ann_param_grid,
-    cv=kf, n_jobs=-1, verbose=1
-)
-ann_grid_search.fit(X_train, y_train)
-print("Best ANN parameters:", ann_grid_search.best_params_)
-print("Best ANN accuracy:", ann_grid_search.best_score_)
+    # 3. Chia train/test (giữ lại số thứ tự các dòng test để lưu cùng stacking features)
+    train_rows, test_rows = train_test_split(np.arange(len(X)), test_size=0.2, random_state=42)
+    X_train, X_test = X_scaled[train_rows], X_scaled[test_rows]
+    y_train, y_test = y.iloc[train_rows], y.iloc[test_rows]
 
-# 4. Lưu model và scaler
-joblib.dump(rf_grid_search.best_estimator_, '../models/random_forest_model.pkl')
-joblib.dump(xgb_grid_search.best_estimator_, '../models/xgboost_model.pkl')
-joblib.dump(knn_grid_search.best_estimator_, '../models/knn_model.pkl')   
-joblib.dump(ann_grid_search.best_estimator_, '../models/ann_model.pkl')
-joblib.dump(scaler, '../models/scaler.pkl')
+    # RandomForest, XGBoost, KNN, ANN: tất cả grid search chạy chung một process pool
+    print("Training RandomForest, XGBoost, KNN, ANN…")
+    results = run_searches(
+        X_train, y_train.to_numpy(),
+        max_workers=args.workers,
+        halving=not args.full_grid,
+        cache_path=None if args.no_cache else CV_CACHE_FILE
+    )
+    for result in results.values():
+        fits = result['fits']
+        print(f"Best {result['title']} parameters:", result['best_params'])
+        print(f"Best {result['title']} accuracy:", result['best_accuracy'])
+        print(f"  fits run: {fits['run']}, cached: {fits['cached']}, "
+              f"configs pruned: {fits['pruned']}/{fits['candidates']}")
 
-# 5. Lưu kết quả training ra file JSON
-training_results = {
-    "RandomForest": {
-        "best_params": rf_grid_search.best_params_,
-        "best_accuracy": float(rf_grid_search.best_score_)
-    },
-    "XGBoost": {
-        "best_params": xgb_grid_search.best_params_,
-        "best_accuracy": float(xgb_grid_search.best_score_)
-    },
-    "KNN": {
-        "best_params": knn_grid_search.best_params_,
-        "best_accuracy": float(knn_grid_search.best_score_)
-    },
-    "ANN": {
-        "best_params": ann_grid_search.best_params_,
-        "best_accuracy": float(ann_grid_search.best_score_)
+    # 4. Lưu model và scaler
+    joblib.dump(results['rf']['best_estimator'], '../models/random_forest_model.pkl')
+    joblib.dump(results['xgb']['best_estimator'], '../models/xgboost_model.pkl')
+    joblib.dump(results['knn']['best_estimator'], '../models/knn_model.pkl')
+    joblib.dump(results['ann']['best_estimator'], '../models/ann_model.pkl')
+    joblib.dump(scaler, '../models/scaler.pkl')
+    # features.json tells the API to build the same rolling features; raw models have none
+    features_path = os.path.join('../models', FEATURES_FILE)
+    if spec is not None:
+        spec.save(features_path)
+    elif os.path.exists(features_path):
+        os.remove(features_path)
+
+    # 5. Out-of-fold probabilities cho meta-model (train) và xác suất trên tập test
+    print("Computing out-of-fold base probabilities…")
+    best_params = {name: result['best_params'] for name, result in results.items()}
+    oof_train = out_of_fold_probabilities(X_train, y_train.to_numpy(), best_params, max_workers=args.workers)
+    meta_test = np.hstack([result['best_estimator'].predict_proba(X_test) for result in results.values()])
+    save_stacking_features(
+        STACKING_DIR, oof_train, y_train, meta_test, y_test,
+        base_order=list(results), classes=results['rf']['best_estimator'].classes_,
+        test_inputs=X.to_numpy()[test_rows], test_rows=test_rows
+    )
+    print(f"Stacking features saved to '{STACKING_DIR}'.")
+
+    # 6. Lưu kết quả training ra file JSON
+    training_results = {
+        result['title']: {
+            "best_params": result['best_params'],
+            "best_accuracy": float(result['best_accuracy'])
+        }
+        for result in results.values()
     }
-}
-with open('training_results.json', 'w') as f:
-    json.dump(training_results, f, indent=4)
+    with open('training_results.json', 'w') as f:
+        json.dump(training_results, f, indent=4)
+
+    print("Tất cả mô hình đã được huấn luyện và lưu.")
+    print("Kết quả training đã được lưu vào 'training_results.json'.")
 
 
-print("Tất cả mô hình đã được huấn luyện và lưu.")
-print("Kết quả training đã được lưu vào 'training_results.json'.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Incremental update of the trained ensemble with newly labelled sessions
+
+Instead of rerunning train_base_model.py and train_meta_model.py over the
+whole dataset, the new rows are folded into the existing models:
+
+- the scaler's mean/variance are updated with running moments and every base
+  model is re-expressed in the new scaled space (the MLP input layer and the
+  KNN reference points are mapped through the change of scale, tree
+  thresholds are re-placed between the same training values), so the
+  models keep their decisions on the previous training rows;
+- KNN appends the new rows to its reference set;
+- the MLP runs a few partial_fit epochs, XGBoost adds boosting rounds and the
+  RandomForest adds trees, each on the new rows plus a replay sample of the
+  previous training rows (kept in the KNN reference set) so every class is
+  present and old sessions are not forgotten;
+- only the meta-model is refit, from the stacking features extended with the
+  new rows' probabilities under the pre-update base models.
+
+The updated ensemble is then scored end to end on the held-out test rows
+saved with the stacking features (their meta-features recomputed with the
+updated base models); if its accuracy is more than --tolerance below the
+current ensemble's, nothing is written. CSVs already ingested into the
+dataset store are skipped, so re-running on the same file does nothing.
+
+A full rebuild (train_base_model.py + train_meta_model.py) stays available on
+demand, e.g. when the hyper-parameters should be searched again.
+
+Usage:
+    python train_incremental.py new_sessions.csv [more.csv ...]
+"""
+import argparse
+import json
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score
+
+from dataset import open_training_store
+from features import SENSOR_NAMES, batch_features, load_spec
+from training import STACKING_DIR, load_stacking_features, make_meta_model, save_stacking_features
+
+MODEL_FILES = {
+    'rf': '../models/random_forest_model.pkl',
+    'xgb': '../models/xgboost_model.pkl',
+    'knn': '../models/knn_model.pkl',
+    'ann': '../models/ann_model.pkl',
+}
+SCALER_FILE = '../models/scaler.pkl'
+META_MODEL_FILE = '../models/meta_model.pkl'
+MODELS_DIR = '../models'
+
+
+def replace_models(artifacts):
+    """
+    Pickle every (object, path) pair next to its path, then move them all into place
+
+    The rescaled base models only fit the new scaler, so none of the files is
+    replaced until every one of them is written; the registry discards a
+    reload during which the files changed (see ModelRegistry.reload_if_changed).
+    """
+    staged = []
+    try:
+        for obj, path in artifacts:
+            tmp = path + '.tmp'
+            joblib.dump(obj, tmp)
+            staged.append((tmp, path))
+    except BaseException:
+        for tmp, _ in staged:
+            os.remove(tmp)
+        raise
+    for tmp, path in staged:
+        os.replace(tmp, path)
+
+
+def load_labelled(paths):
+    """Read labelled CSVs in the processed_data.csv layout"""
+    df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    X = df.drop(columns=['DATE', 'TIME', 'Start Time', 'Label'])
+    return df, X, df['Label'].to_numpy().astype(int)
+
+
+def rolling_frame(df, spec):
+    """Rolling features of labelled rows, for models trained with --features rolling"""
+    timestamps = pd.to_datetime(df['DATE'] + ' ' + df['TIME'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+    features = batch_features(
+        df[SENSOR_NAMES].to_numpy(), timestamps.to_numpy().astype('datetime64[s]'),
+        df['Start Time'].to_numpy(), spec=spec
+    )
+    return pd.DataFrame(features, columns=spec.names)
+
+
+def update_scaler(scaler, X_new):
+    """
+    Update the scaler with running moments
+
+    Returns:
+        tuple: (a, b) per feature such that new_scaled = a * old_scaled + b
+    """
+    old_mean, old_scale = scaler.mean_.copy(), scaler.scale_.copy()
+    scaler.partial_fit(X_new)
+    return old_scale / scaler.scale_, (old_mean - scaler.mean_) / scaler.scale_
+
+
+class ThresholdMap:
+    """
+    Moves split thresholds of tree models to the new feature scale
+
+    A threshold is re-placed halfway between the same two neighbouring
+    training values it separated before, now expressed in the new scale, so
+    every training row takes the same branch. Thresholds outside the training
+    range are mapped affinely.
+
+    Args:
+        X_old (np.ndarray): Previous training rows in the old scale
+        a, b (np.ndarray): Per-feature change of scale, new = a * old + b
+    """
+
+    def __init__(self, X_old, a, b):
+        self.a, self.b = a, b
+        # Trees compare float32 features, so separate the float32 values they actually saw
+        self.old = [np.unique(X_old[:, f].astype(np.float32)) for f in range(X_old.shape[1])]
+        self.new = [(a[f] * values + b[f]).astype(np.float32) for f, values in enumerate(self.old)]
+
+    def __call__(self, feature, thresholds, strict):
+        """
+        Args:
+            feature (np.ndarray): Split feature of each threshold
+            thresholds (np.ndarray): Old thresholds
+            strict (bool): True for float32 `x < t` splits (XGBoost), False for
+                float64 `x <= t` splits (sklearn)
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        result = self.a[feature] * thresholds + self.b[feature]
+        for f in np.unique(feature):
+            at = np.flatnonzero(feature == f)
+            old, new = self.old[f], self.new[f]
+            idx = np.searchsorted(old, thresholds[at], side='left' if strict else 'right')
+            inner = (idx > 0) & (idx < len(old))
+            lo, hi = new[idx[inner] - 1], new[idx[inner]]
+            middle = (lo.astype(np.float64) + hi) / 2
+            if strict:
+                # A float32 threshold must stay strictly above the lower value
+                middle = middle.astype(np.float32)
+                middle = np.where(middle > lo, middle, np.nextafter(lo, np.float32(np.inf)))
+            result[at[inner]] = middle
+        return result.astype(np.float32) if strict else result
+
+
+def rescale_random_forest(rf, thresholds):
+    for tree in rf.estimators_:
+        internal = tree.tree_.feature >= 0
+        tree.tree_.threshold[internal] = thresholds(tree.tree_.feature[internal], tree.tree_.threshold[internal], strict=False)
+
+
+def rescale_xgboost(model, thresholds):
+    booster = model.get_booster()
+    dump = json.loads(booster.save_raw('json'))
+    for tree in dump['learner']['gradient_booster']['model']['trees']:
+        internal = np.flatnonzero(np.asarray(tree['left_children']) != -1)
+        if len(internal) == 0:
+            continue
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        features = np.asarray(tree['split_indices'])[internal]
+        conditions[internal] = thresholds(features, conditions[internal], strict=True)
+        tree['split_conditions'] = conditions.tolist()
+    booster.load_model(bytearray(json.dumps(dump).encode()))
+
+
+def rescale_mlp(ann, a, b):
+    # h = W.T @ x_old + c with x_old = (x_new - b) / a
+    ann.coefs_[0] = ann.coefs_[0] / a[:, None]
+    ann.intercepts_[0] = ann.intercepts_[0] - b @ ann.coefs_[0]
+
+
+def replay_sample(X_old, y_old, n, rng):
+    """Random rows of the previous training set, with at least one row per class"""
+    picked = set(rng.choice(len(X_old), size=min(n, len(X_old)), replace=False).tolist())
+    for label in np.unique(y_old):
+        if not np.isin(y_old[list(picked)], label).any():
+            picked.add(int(rng.choice(np.flatnonzero(y_old == label))))
+    picked = np.array(sorted(picked))
+    return X_old[picked], y_old[picked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the trained ensemble with new labelled sessions")
+    parser.add_argument('paths', nargs='+', help="CSV files in the processed_data.csv layout")
+    parser.add_argument('--replay', type=float, default=1.0, help="Replayed old rows per new row")
+    parser.add_argument('--extra-trees', type=int, default=20, help="Trees added to the RandomForest")
+    parser.add_argument('--extra-rounds', type=int, default=20, help="Boosting rounds added to XGBoost")
+    parser.add_argument('--ann-epochs', type=int, default=10, help="partial_fit passes for the MLP")
+    parser.add_argument('--no-append', action='store_true', help="Do not append the new rows to the dataset store")
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help="Largest test accuracy drop against the current ensemble that is still saved")
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+
+    store = None if args.no_append else open_training_store()
+    paths = args.paths
+    if store is not None:
+        for path in [path for path in paths if store.ingested(path)]:
+            print(f"{path} was already ingested into the dataset store, skipped")
+        paths = [path for path in paths if not store.ingested(path)]
+        if not paths:
+            print("No new files; nothing to do.")
+            return 0
+
+    df_new, X_new, y_new = load_labelled(paths)
+    print(f"Loaded {len(df_new)} new labelled rows")
+    spec = load_spec(MODELS_DIR)
+    if spec is not None:
+        X_new = rolling_frame(df_new, spec)
+
+    scaler = joblib.load(SCALER_FILE)
+    models = {name: joblib.load(path) for name, path in MODEL_FILES.items()}
+    stacking = load_stacking_features(STACKING_DIR, mmap_mode=None)
+    if 'test_inputs' not in stacking:
+        print(f"{STACKING_DIR} has no held-out test rows; run train_base_model.py once to save them.")
+        return 1
+    test_inputs, test_labels = stacking['test_inputs'], stacking['test_labels'].astype(int)
+
+    def test_accuracy(meta_model):
+        """Accuracy of the whole stack (scaler, base models, meta-model) on the held-out rows"""
+        X_test_scaled = scaler.transform(test_inputs)
+        meta_test = np.hstack([models[name].predict_proba(X_test_scaled) for name in stacking['base_order']])
+        return accuracy_score(test_labels, meta_model.predict(meta_test)), meta_test
+
+    previous_accuracy, _ = test_accuracy(joblib.load(META_MODEL_FILE))
+    print(f"Current ensemble accuracy on the test set: {previous_accuracy:.4f}")
+
+    # 1. Meta features of the new rows from the current base models (which have not seen them)
+    X_new_old_scale = scaler.transform(X_new)
+    meta_new = np.hstack([models[name].predict_proba(X_new_old_scale) for name in stacking['base_order']])
+
+    # 2. Running-moment scaler update; re-express every base model in the new scale
+    knn = models['knn']
+    a, b = update_scaler(scaler, X_new)
+    thresholds = ThresholdMap(knn._fit_X, a, b)
+    rescale_random_forest(models['rf'], thresholds)
+    rescale_xgboost(models['xgb'], thresholds)
+    rescale_mlp(models['ann'], a, b)
+    X_old = a * knn._fit_X + b
+    y_old = knn.classes_[knn._y]
+    X_new_scaled = scaler.transform(X_new)
+
+    # 3. KNN: append to the reference set
+    knn.fit(np.vstack([X_old, X_new_scaled]), np.concatenate([y_old, y_new]))
+    print(f"KNN reference set: {len(X_old)} -> {len(knn._fit_X)} rows")
+
+    # 4. MLP, XGBoost, RandomForest: train on the new rows plus replayed old rows
+    X_replay, y_replay = replay_sample(X_old, y_old, int(args.replay * len(X_new)), rng)
+    X_batch = np.vstack([X_new_scaled, X_replay])
+    y_batch = np.concatenate([y_new, y_replay])
+
+    ann = models['ann']
+    for _ in range(args.ann_epochs):
+        order = rng.permutation(len(X_batch))
+        ann.partial_fit(X_batch[order], y_batch[order])
+    print(f"ANN: {args.ann_epochs} partial_fit epochs on {len(X_batch)} rows")
+
+    xgb = models['xgb']
+    n_rounds = xgb.get_booster().num_boosted_rounds()
+    xgb.set_params(n_estimators=args.extra_rounds)
+    xgb.fit(X_batch, y_batch, xgb_model=xgb.get_booster())
+    xgb.set_params(n_estimators=xgb.get_booster().num_boosted_rounds())
+    print(f"XGBoost: {n_rounds} -> {xgb.get_booster().num_boosted_rounds()} boosting rounds")
+
+    rf = models['rf']
+    n_trees = len(rf.estimators_)
+    rf.set_params(warm_start=True, n_estimators=n_trees + args.extra_trees)
+    rf.fit(X_batch, y_batch)
+    rf.set_params(warm_start=False)
+    print(f"RandomForest: {n_trees} -> {len(rf.estimators_)} trees")
+
+    # 5. Refit only the meta-model, on the stacking features extended with the new rows
+    train_features = np.vstack([stacking['train_features'], meta_new])
+    train_labels = np.concatenate([stacking['train_labels'], y_new])
+    meta_model = make_meta_model()
+    meta_model.fit(train_features, train_labels.astype(int))
+
+    # 6. Score the updated ensemble on the held-out rows; keep the current one if it got worse
+    acc, meta_test = test_accuracy(meta_model)
+    print(f"Updated ensemble accuracy on the test set: {acc:.4f}")
+    if acc < previous_accuracy - args.tolerance:
+        print(f"Accuracy dropped by more than {args.tolerance} ({previous_accuracy:.4f} -> {acc:.4f}); "
+              f"nothing written.")
+        return 1
+
+    save_stacking_features(
+        STACKING_DIR, train_features, train_labels, meta_test, test_labels,
+        base_order=stacking['base_order'], classes=stacking['classes'],
+        test_inputs=test_inputs, test_rows=stacking['test_rows']
+    )
+    replace_models([(models[name], path) for name, path in MODEL_FILES.items()]
+                   + [(scaler, SCALER_FILE), (meta_model, META_MODEL_FILE)])
+
+    if store is not None:
+        for path in paths:
+            store.ingest_processed_csv(path)
+        print(f"Appended {len(df_new)} rows to the dataset store ({len(store)} rows)")
+    print("Ensemble updated incrementally; run train_base_model.py for a full rebuild.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
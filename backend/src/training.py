@@ -0,0 +1,439 @@
+"""
+Training orchestrator for the base models
+
+Runs the hyper-parameter searches of all base models as one job on a shared
+process pool: every (model, params, fold) fit is an independent task, so the
+four grids interleave and wall-clock scales with the number of cores rather
+than with the sum of the grids. Fold scores are cached on disk keyed by
+(data hash, model, params, CV split, fold), so unchanged configurations are
+never refit. With successive halving, each grid is raced over the folds and
+only the best third of its configurations advances to more folds.
+
+The selected configurations also produce out-of-fold class probabilities
+on the training set, stored with the test-set probabilities as .npy
+arrays so the meta-model can be trained without loading the base models.
+The held-out test rows themselves (unscaled model inputs and their rows in
+the dataset store) are stored alongside, so later updates and checks
+evaluate on exactly the rows the base models never trained on.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import KFold, ParameterGrid, StratifiedKFold, check_cv
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neural_network import MLPClassifier
+from xgboost import XGBClassifier
+
+logger = logging.getLogger(__name__)
+
+CV_CACHE_FILE = 'cv_cache.json'
+
+# Fraction of configurations kept after each successive-halving rung is 1 / HALVING_ETA
+HALVING_ETA = 3
+
+# Stacking features written by train_base_model.py and read by train_meta_model.py
+STACKING_DIR = '../models/stacking'
+STACKING_CV = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+
+
+def make_meta_model():
+    """
+    Unfitted meta-model of the stack: one-vs-rest liblinear logistic regressions
+
+    Spelled as a OneVsRestClassifier because newer scikit-learn releases dropped
+    LogisticRegression's multi_class option and liblinear's implicit multiclass support.
+    """
+    return OneVsRestClassifier(LogisticRegression(solver='liblinear', random_state=42))
+
+
+def _xgb_estimator():
+    return XGBClassifier(use_label_encoder=False, eval_metric='mlogloss')
+
+
+# Search spaces of the base models, keyed like registry.BASE_MODEL_FILES
+SEARCH_SPACES = {
+    'rf': {
+        'title': 'RandomForest',
+        'estimator': RandomForestClassifier,
+        'param_grid': {
+            'n_estimators': [100, 200, 300],
+            'max_features': ['sqrt', 'log2'],
+            'random_state': [42]
+        },
+        'cv': 5,
+    },
+    'xgb': {
+        'title': 'XGBoost',
+        'estimator': _xgb_estimator,
+        'param_grid': {
+            'n_estimators': [100, 200, 300],
+            'learning_rate': [0.01, 0.1, 0.2],
+            'random_state': [42]
+        },
+        'cv': 5,
+    },
+    'knn': {
+        'title': 'KNN',
+        'estimator': KNeighborsClassifier,
+        'param_grid': {
+            'n_neighbors': [3, 5, 7, 9],
+            'weights': ['uniform', 'distance'],
+            'metric': ['euclidean', 'manhattan']
+        },
+        'cv': 5,
+    },
+    'ann': {
+        'title': 'ANN',
+        'estimator': lambda: MLPClassifier(random_state=42),
+        'param_grid': {
+            'hidden_layer_sizes': [(50,), (100,), (50, 50)],
+            'activation': ['relu', 'tanh'],
+            'solver': ['adam', 'sgd'],
+            'max_iter': [200, 300, 1000]
+        },
+        'cv': KFold(n_splits=5, shuffle=True, random_state=42),
+    },
+}
+
+
+def data_hash(X, y):
+    """Content hash of a training set"""
+    digest = hashlib.sha256()
+    for array in (X, y):
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _cv_spec(cv):
+    """Stable description of a CV splitter, part of the fold cache key"""
+    return repr(cv)
+
+
+class FoldCache:
+    """
+    On-disk cache of fold scores
+
+    Args:
+        path (str, optional): JSON file backing the cache; in memory only if None
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._scores = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._scores = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable CV cache {path}: {e}")
+
+    @staticmethod
+    def key(data_key, name, params, cv_spec, fold):
+        raw = json.dumps([data_key, name, sorted(params.items()), cv_spec, fold], default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        return self._scores.get(key)
+
+    def put(self, key, score):
+        self._scores[key] = score
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._scores, f)
+        os.replace(tmp_path, self.path)
+
+
+# Training data of a pool worker, set once by the pool initializer
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    _worker_data['X'] = X
+    _worker_data['y'] = y
+
+
+def _build(name, params, single_threaded=False):
+    estimator = SEARCH_SPACES[name]['estimator']()
+    estimator.set_params(**params)
+    # Parallelism comes from the pool; nested thread pools would oversubscribe the cores
+    if single_threaded and 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=1)
+    return estimator
+
+
+def _fit_fold(name, params, train_index, test_index):
+    """Fit one configuration on one fold and return its accuracy"""
+    X, y = _worker_data['X'], _worker_data['y']
+    estimator = _build(name, params, single_threaded=True)
+    estimator.fit(X[train_index], y[train_index])
+    return float(estimator.score(X[test_index], y[test_index]))
+
+
+def _fold_proba(name, params, train_index, test_index):
+    """Fit one configuration on one fold and return its probabilities on the held-out rows"""
+    X, y = _worker_data['X'], _worker_data['y']
+    estimator = _build(name, params, single_threaded=True)
+    estimator.fit(X[train_index], y[train_index])
+    return estimator.predict_proba(X[test_index])
+
+
+def _refit(name, params):
+    """Fit the selected configuration on the whole training set"""
+    estimator = _build(name, params)
+    estimator.fit(_worker_data['X'], _worker_data['y'])
+    return estimator
+
+
+class _Search:
+    """Successive-halving state of one model's grid"""
+
+    def __init__(self, name, space, X, y, data_key, halving):
+        self.name = name
+        self.title = space['title']
+        self.candidates = list(ParameterGrid(space['param_grid']))
+        cv = check_cv(space['cv'], y, classifier=True)
+        self.cv_spec = _cv_spec(cv)
+        self.folds = list(cv.split(X, y))
+        self.data_key = data_key
+        self.scores = {i: {} for i in range(len(self.candidates))}
+        self.alive = list(range(len(self.candidates)))
+        n_folds = len(self.folds)
+        # Number of folds each configuration is scored on at each rung, e.g. 1, 3, 5
+        self.rungs = [n_folds]
+        if halving:
+            folds = 1
+            while folds < n_folds:
+                self.rungs.insert(-1, folds)
+                folds *= HALVING_ETA
+        self.rung = 0
+        self.pruned = 0
+
+    def pending_fits(self):
+        """(candidate, fold) pairs needed to finish the current rung"""
+        n_folds = self.rungs[self.rung]
+        return [(i, fold) for i in self.alive for fold in range(n_folds) if fold not in self.scores[i]]
+
+    def cache_key(self, candidate, fold):
+        return FoldCache.key(self.data_key, self.name, self.candidates[candidate], self.cv_spec, fold)
+
+    def mean_score(self, candidate):
+        return float(np.mean([self.scores[candidate][fold] for fold in range(self.rungs[self.rung])]))
+
+    def advance(self):
+        """
+        Close the current rung: keep the best 1 / HALVING_ETA and move to more folds
+
+        Returns:
+            bool: True when the search is finished
+        """
+        if self.rung == len(self.rungs) - 1:
+            return True
+        # Stable sort keeps grid order among ties, like GridSearchCV's ranking
+        ranked = sorted(self.alive, key=lambda i: -self.mean_score(i))
+        keep = max(1, math.ceil(len(ranked) / HALVING_ETA))
+        self.pruned += len(ranked) - keep
+        self.alive = sorted(ranked[:keep])
+        self.rung = len(self.rungs) - 1 if keep == 1 else self.rung + 1
+        return False
+
+    def best(self):
+        best = max(self.alive, key=lambda i: (self.mean_score(i), -i))
+        return best, self.candidates[best], self.mean_score(best)
+
+
+def run_searches(X, y, names=None, max_workers=None, halving=True, cache_path=CV_CACHE_FILE):
+    """
+    Run the hyper-parameter searches of the base models on one process pool
+
+    Args:
+        X (np.ndarray): Scaled training features
+        y (np.ndarray): Training labels
+        names (list, optional): Models to search; defaults to all of SEARCH_SPACES
+        max_workers (int, optional): Pool size; defaults to the number of cores
+        halving (bool): Race configurations over the folds and drop losers early;
+            without it every configuration is scored on every fold, like GridSearchCV
+        cache_path (str, optional): Fold score cache file; None disables caching
+
+    Returns:
+        dict: Per model name 'title', 'best_params', 'best_accuracy', 'best_estimator'
+            and 'fits' counters (run, cached, pruned configurations)
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    names = list(names or SEARCH_SPACES)
+    cache = FoldCache(cache_path)
+    data_key = data_hash(X, y)
+    searches = {name: _Search(name, SEARCH_SPACES[name], X, y, data_key, halving) for name in names}
+    counters = {name: {'run': 0, 'cached': 0} for name in names}
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(X, y)) as pool:
+        running = {}
+
+        def schedule(search):
+            """Submit the current rung's missing fits; advance through rungs the cache already covers"""
+            while True:
+                submitted = False
+                for candidate, fold in search.pending_fits():
+                    score = cache.get(search.cache_key(candidate, fold))
+                    if score is not None:
+                        search.scores[candidate][fold] = score
+                        counters[search.name]['cached'] += 1
+                        continue
+                    train_index, test_index = search.folds[fold]
+                    future = pool.submit(_fit_fold, search.name, search.candidates[candidate], train_index, test_index)
+                    running[future] = (search, candidate, fold)
+                    submitted = True
+                if submitted or search.advance():
+                    return submitted
+
+        finished = [search for search in searches.values() if not schedule(search)]
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                search, candidate, fold = running.pop(future)
+                score = future.result()
+                search.scores[candidate][fold] = score
+                cache.put(search.cache_key(candidate, fold), score)
+                counters[search.name]['run'] += 1
+                if not search.pending_fits() and not any(s is search for s, _, _ in running.values()):
+                    if search.advance() or not schedule(search):
+                        finished.append(search)
+                        logger.info(f"{search.title}: search finished")
+            cache.save()
+
+        # Refit the winners on the full training set, also in parallel
+        refits = {}
+        results = {}
+        for search in finished:
+            _, params, score = search.best()
+            refits[search.name] = pool.submit(_refit, search.name, params)
+            results[search.name] = {
+                'title': search.title,
+                'best_params': params,
+                'best_accuracy': score,
+                'fits': dict(counters[search.name], pruned=search.pruned, candidates=len(search.candidates)),
+            }
+        for name, future in refits.items():
+            results[name]['best_estimator'] = future.result()
+
+    cache.save()
+    return {name: results[name] for name in names}
+
+
+def out_of_fold_probabilities(X, y, best_params, cv=STACKING_CV, max_workers=None):
+    """
+    Out-of-fold class probabilities of each base model on the training set
+
+    Every row is predicted by a model that did not see it, so the meta-model
+    learns from predictions that behave like those on unseen data.
+
+    Args:
+        X (np.ndarray): Scaled training features
+        y (np.ndarray): Training labels
+        best_params (dict): Selected parameters per model name, in meta-feature order
+        cv: Splitter; folds must contain every class in their training part
+
+    Returns:
+        np.ndarray: (n_rows, n_models * n_classes) probabilities, models side by side
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    n_classes = len(np.unique(y))
+    folds = list(cv.split(X, y))
+    blocks = {name: np.empty((len(X), n_classes)) for name in best_params}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(X, y)) as pool:
+        futures = {
+            pool.submit(_fold_proba, name, params, train_index, test_index): (name, test_index)
+            for name, params in best_params.items()
+            for train_index, test_index in folds
+        }
+        for future, (name, test_index) in futures.items():
+            blocks[name][test_index] = future.result()
+    return np.hstack([blocks[name] for name in best_params])
+
+
+def save_stacking_features(path, train_features, train_labels, test_features, test_labels, base_order, classes,
+                           test_inputs=None, test_rows=None):
+    """
+    Write the meta-model training data as .npy arrays plus columns.json
+
+    Features are stored as float32 and labels as int8.
+
+    Args:
+        test_inputs (np.ndarray, optional): Unscaled model inputs of the held-out test rows
+        test_rows (np.ndarray, optional): Their row numbers in the dataset store
+    """
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'train_features.npy'), np.asarray(train_features, dtype=np.float32))
+    np.save(os.path.join(path, 'train_labels.npy'), np.asarray(train_labels, dtype=np.int8))
+    np.save(os.path.join(path, 'test_features.npy'), np.asarray(test_features, dtype=np.float32))
+    np.save(os.path.join(path, 'test_labels.npy'), np.asarray(test_labels, dtype=np.int8))
+    columns = [f"{name}_{label}" for name in base_order for label in classes]
+    info = {
+        'base_order': list(base_order),
+        'classes': [int(label) for label in classes],
+        'columns': columns,
+        'data_hash': data_hash(train_features, train_labels)
+    }
+    if test_inputs is not None:
+        test_inputs = np.asarray(test_inputs, dtype=np.float64)
+        test_rows = np.asarray(test_rows, dtype=np.int64)
+        np.save(os.path.join(path, 'test_inputs.npy'), test_inputs)
+        np.save(os.path.join(path, 'test_rows.npy'), test_rows)
+        info['test_hash'] = data_hash(test_inputs, np.asarray(test_labels, dtype=np.int8))
+    with open(os.path.join(path, 'columns.json'), 'w') as f:
+        json.dump(info, f, indent=4)
+    return path
+
+
+def load_stacking_features(path, mmap_mode='r'):
+    """
+    Load the arrays written by save_stacking_features
+
+    Returns:
+        dict: 'train_features', 'train_labels', 'test_features', 'test_labels', the
+              columns.json entries, and 'test_inputs' / 'test_rows' when they were saved
+    """
+    with open(os.path.join(path, 'columns.json')) as f:
+        stacking = json.load(f)
+    for name in ('train_features', 'train_labels', 'test_features', 'test_labels'):
+        stacking[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+    for name in ('test_inputs', 'test_rows'):
+        if os.path.exists(os.path.join(path, f'{name}.npy')):
+            stacking[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+    return stacking
+
+
+def load_held_out(path=STACKING_DIR):
+    """
+    The held-out test rows saved with the stacking features
+
+    Returns:
+        tuple: (test_inputs, test_labels), unscaled model inputs and int labels
+
+    Raises:
+        ValueError: If the artifact has no test rows or they do not match its test_hash
+    """
+    if not os.path.exists(os.path.join(path, 'columns.json')):
+        raise ValueError(f"No stacking features in {path}; run train_base_model.py first")
+    stacking = load_stacking_features(path, mmap_mode=None)
+    if 'test_inputs' not in stacking:
+        raise ValueError(f"{path} has no held-out test rows; run train_base_model.py once to save them")
+    test_inputs, test_labels = stacking['test_inputs'], stacking['test_labels']
+    if len(stacking['test_rows']) != len(test_inputs) or data_hash(test_inputs, test_labels) != stacking.get('test_hash'):
+        raise ValueError(f"Held-out test rows in {path} do not match their test_hash")
+    return test_inputs, test_labels.astype(int)
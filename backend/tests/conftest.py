@@ -0,0 +1,25 @@
+import os
+import sys
+
+# Tests import the backend modules the way the API does: from src/ on the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope='session')
+def model_set():
+    """The pickled ensemble in backend/models"""
+    from registry import ModelRegistry
+
+    return ModelRegistry(model_format='pickle', check_interval=None).load()
+
+
+@pytest.fixture(scope='session')
+def sensor_rows(model_set):
+    """300 evenly spaced model inputs from processed_data.csv"""
+    from compiled import _verification_data
+
+    X = _verification_data(model_set.features)
+    return X[np.linspace(0, len(X) - 1, 300).astype(int)]
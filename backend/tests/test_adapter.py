@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+from adapter import ThingSpeakClient, parse_thingspeak_feeds
+
+
+def feed(entry_id):
+    return {'entry_id': entry_id, 'created_at': f'2025-07-22T12:{entry_id // 60:02d}:{entry_id % 60:02d}Z',
+            'field1': '1652', 'field2': '1587', 'field3': '34.1', 'field4': '99.2'}
+
+
+class StubThingSpeak:
+    """Local ThingSpeak stand-in: serves a channel's feeds and records every request"""
+
+    def __init__(self):
+        self.entries = [feed(i) for i in range(1, 21)]
+        self.requests = []
+        self.failures = 0  # Next requests answered 503
+        self.delay = 0.0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                stub.requests.append(params)
+                time.sleep(stub.delay)
+                if stub.failures:
+                    stub.failures -= 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                feeds = stub.entries
+                if 'start' in params:
+                    feeds = [e for e in feeds if e['created_at'].replace('T', ' ').rstrip('Z') >= params['start']]
+                feeds = feeds[-int(params.get('results', 100)):]
+                body = json.dumps({'feeds': feeds}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubThingSpeak()
+    yield server
+    server.close()
+
+
+def test_repeat_poll_only_fetches_new_entries(stub):
+    client = ThingSpeakClient(base_url=stub.url, backoff_factor=0)
+    first = client.fetch_feeds('KEY', 5, '1')
+    assert [e['entry_id'] for e in first] == [16, 17, 18, 19, 20]
+    assert 'start' not in stub.requests[0]
+
+    stub.entries += [feed(21), feed(22)]
+    second = client.fetch_feeds('KEY', 5, '1')
+    assert [e['entry_id'] for e in second] == [18, 19, 20, 21, 22]
+    assert stub.requests[1]['start'] == '2025-07-22 12:00:20'
+
+    # A larger window than cached is fetched in full again
+    assert len(client.fetch_feeds('KEY', 10, '1')) == 10
+    assert 'start' not in stub.requests[2]
+
+
+def test_retries_server_errors(stub):
+    stub.failures = 2
+    client = ThingSpeakClient(base_url=stub.url, retries=3, backoff_factor=0)
+    assert len(client.fetch_feeds('KEY', 5, '1')) == 5
+    assert len(stub.requests) == 3
+
+
+def test_gives_up_after_retries(stub):
+    stub.failures = 10
+    client = ThingSpeakClient(base_url=stub.url, retries=1, backoff_factor=0)
+    assert client.fetch_feeds('KEY', 5, '1') is None
+    assert len(stub.requests) == 2
+
+
+def test_read_timeout_returns_none(stub):
+    stub.delay = 0.5
+    client = ThingSpeakClient(base_url=stub.url, timeout=(1, 0.1), retries=0)
+    started = time.monotonic()
+    assert client.fetch_feeds('KEY', 5, '1') is None
+    assert time.monotonic() - started < 0.5
+
+
+def test_cache_is_bounded(stub):
+    client = ThingSpeakClient(base_url=stub.url, backoff_factor=0, max_channels=3, max_keep=8)
+    for channel in range(5):
+        client.fetch_feeds('KEY', 20, str(channel))
+    assert list(client._cache) == [('2', 'KEY'), ('3', 'KEY'), ('4', 'KEY')]
+    assert all(len(entry['feeds']) == 8 and entry['keep'] == 8 for entry in client._cache.values())
+
+    # Windows above max_keep stay correct: fetched in full every time
+    assert len(client.fetch_feeds('KEY', 20, '4')) == 20
+    assert 'start' not in stub.requests[-1]
+
+
+def test_malformed_created_at_parses_as_nat():
+    entries = [feed(1), {**feed(2), 'created_at': 'yesterday'}, {**feed(3), 'created_at': None}]
+    values, mask, timestamps, entry_ids = parse_thingspeak_feeds(entries)
+    assert mask.all()
+    assert timestamps[0] == np.datetime64('2025-07-22T12:00:01')
+    assert np.isnat(timestamps[1:]).all()
+    assert entry_ids.tolist() == [1, 2, 3]
+
+
+def test_single_attempt_with_call_timeout(stub):
+    stub.failures = 1
+    client = ThingSpeakClient(base_url=stub.url, retries=3, backoff_factor=0)
+    assert client.fetch_feeds('KEY', 5, '1', retry=False) is None
+    assert len(stub.requests) == 1
+
+    stub.delay = 0.5
+    started = time.monotonic()
+    assert client.fetch_feeds('KEY', 5, '2', timeout=0.1, retry=False) is None
+    assert time.monotonic() - started < 0.5
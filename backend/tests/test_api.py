@@ -0,0 +1,135 @@
+import copy
+import json
+import os
+
+import numpy as np
+import pytest
+
+READING = [1650.0, 1560.0, 34.1, 99.2]
+
+
+@pytest.fixture(scope='module')
+def client():
+    # Score in this process, without history, feed polling or micro-batching
+    for name, value in (('HISTORY_DB', ''), ('INFERENCE_WORKERS', '0'), ('FEED_POLL_INTERVAL', '0'),
+                        ('BATCH_MAX_WAIT_MS', '0')):
+        os.environ.setdefault(name, value)
+    import api
+
+    api.app.config['TESTING'] = True
+    return api.app.test_client()
+
+
+def test_batch_predicts_every_row(client):
+    response = client.post('/predict/batch', json={'sensor_data': [READING, READING, [1500.0, 1400.0, 30.0, 80.0]]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['count'] == 3
+    assert len(body['predictions']['meta']['class_label']) == 3
+    assert body['metadata']['model_version']
+
+
+@pytest.mark.parametrize('sensor_data', [
+    [READING, [float('nan'), 1560.0, 34.1, 99.2]],
+    [READING, [float('inf'), 1560.0, 34.1, 99.2]],
+])
+def test_batch_rejects_non_finite_readings(client, sensor_data):
+    # json.dumps writes NaN / Infinity literals, which the API's parser accepts
+    response = client.post('/predict/batch', data=json.dumps({'sensor_data': sensor_data}),
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid sensor_data'
+
+
+@pytest.mark.parametrize('sensor_data', [
+    [],
+    [[1650.0, 1560.0, 34.1]],
+    [READING, [1650.0, 1560.0]],
+    [['a', 'b', 'c', 'd']],
+    'not a matrix',
+    [[None, 1560.0, 34.1, 99.2]],
+])
+def test_batch_rejects_malformed_sensor_data(client, sensor_data):
+    response = client.post('/predict/batch', json={'sensor_data': sensor_data})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid sensor_data'
+
+
+def test_batch_requires_sensor_data(client):
+    assert client.post('/predict/batch', json={'readings': [READING]}).status_code == 400
+    assert client.post('/predict/batch', data='not json', content_type='application/json').status_code == 400
+
+
+
+class PolledChannel:
+    """Stand-in for the background poller, buffering one channel"""
+
+    def __init__(self, channel_id, api_key, X, times):
+        self.key = (channel_id, api_key)
+        self.X, self.times = X, times
+
+    def get_buffer(self, api_key, channel_id=None):
+        if api_key != self.key[1]:
+            return None, None
+        return self.key, self
+
+    def snapshot(self):
+        return self.X, self.times, np.arange(1, len(self.X) + 1)
+
+    def __len__(self):
+        return len(self.X)
+
+    def freshness(self, key):
+        return {}
+
+
+def test_polled_channel_is_scored_from_the_hub_feature_row(client, model_set, monkeypatch):
+    import api
+    from features import FeatureSpec, batch_features
+
+    spec = FeatureSpec()
+    times = np.arange(np.datetime64('2025-07-22T12:00:00'), np.datetime64('2025-07-22T12:01:00'),
+                      np.timedelta64(20, 's'))
+    X = np.array([READING, [1600.0, 1500.0, 33.0, 90.0], [1620.0, 1530.0, 33.5, 95.0]])
+    # The hub saw the whole stream; the buffer only holds its last two readings
+    state = api.stream_hub._state('3018524')
+    with state.lock:
+        expected = state.feature_rows(spec, X, times)[-1]
+    monkeypatch.setattr(api, 'poller', PolledChannel('3018524', 'KEY', X[1:], times[1:]))
+    rolling = copy.copy(model_set)
+    rolling.features = spec
+    monkeypatch.setattr(api.registry, 'get', lambda: rolling)
+    scored = []
+    monkeypatch.setattr(api, 'predict_row', lambda row, *args, **kwargs: scored.append(row) or {})
+
+    response = client.post('/predict', json={'api_key': 'KEY', 'channel_id': '3018524'})
+    assert response.status_code == 200
+    assert response.get_json()['metadata']['prediction_input'] == 'rolling_features'
+    np.testing.assert_array_equal(scored[0], expected)
+    assert not np.allclose(scored[0], batch_features(X[1:], times[1:], spec=spec)[-1])
+
+
+def test_predictions_are_cached_under_the_version_that_made_them(client, monkeypatch):
+    import api
+    from cache import PredictionCache
+
+    class SwappedWorker:
+        """Inference pool whose workers already serve a newer model set than the API process"""
+        calls = 0
+
+        def call(self, fn, *args, **kwargs):
+            self.calls += 1
+            return {'model_version': 'new', 'predictions': {'meta': {'class_label': 'Ngon'}}, 'timings': {}}
+
+    worker = SwappedWorker()
+    monkeypatch.setattr(api, 'inference_pool', worker)
+    monkeypatch.setattr(api, 'batcher', None)
+    monkeypatch.setattr(api, 'prediction_cache', PredictionCache())
+    row = np.array(READING)
+    deadline = api.time.monotonic() + 5
+
+    api.predict_row(row, deadline, 'old')
+    # The old version's key must not serve the new model set's prediction
+    api.predict_row(row, deadline, 'old')
+    assert worker.calls == 2
+    assert api.prediction_cache.get('new', row) == {'meta': {'class_label': 'Ngon'}}
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+from serving import PredictionTimeout
+
+
+def sum_batch(rows):
+    """run_batch stand-in scoring each row with its sum, failing rows containing NaN"""
+    if np.isnan(rows).any():
+        raise ValueError("Input X contains NaN")
+    sums = rows.sum(axis=1).tolist()
+    return {'model_version': 'v1', 'predictions': {'meta': {'class_label': sums}}}
+
+
+def scored_as(total):
+    """What a caller gets for a row sum_batch scored as `total`"""
+    return {'predictions': {'meta': {'class_label': total}}, 'model_version': 'v1'}
+
+
+def test_a_bad_row_only_fails_its_own_caller():
+    batcher = MicroBatcher(max_batch=8, max_wait_ms=50, run_batch=sum_batch)
+    good = batcher.submit([1.0, 2.0])
+    bad = batcher.submit([np.nan, 1.0])
+    other = batcher.submit([3.0, 4.0])
+    assert good.result(timeout=5) == scored_as(3.0)
+    assert other.result(timeout=5) == scored_as(7.0)
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+
+
+def test_timed_out_rows_are_dropped_from_the_queue():
+    release = threading.Event()
+    scored = []
+
+    def slow_batch(rows):
+        release.wait()
+        scored.extend(rows[:, 0].tolist())
+        return sum_batch(rows)
+
+    batcher = MicroBatcher(max_batch=1, max_wait_ms=1, run_batch=slow_batch)
+    blocking = batcher.submit([1.0])
+    time.sleep(0.05)
+    with pytest.raises(PredictionTimeout):
+        batcher.predict([2.0], timeout=0.05)
+    release.set()
+    assert blocking.result(timeout=5) == scored_as(1.0)
+    assert batcher.predict([3.0], timeout=5) == scored_as(3.0)
+    assert scored == [1.0, 3.0]
@@ -0,0 +1,11 @@
+import importlib
+import sys
+
+
+def test_config_is_loaded_on_first_access():
+    sys.modules.pop('config', None)
+    module = importlib.import_module('config')
+    assert module._config is None
+    from config import config
+    assert module._config is config
+    assert config.sensor_features == ['MQ136', 'MQ137', 'TEMP', 'HUMI']
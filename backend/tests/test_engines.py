@@ -0,0 +1,111 @@
+import copy
+
+import numpy as np
+import pytest
+
+import predict
+from cascade import Cascade
+from compiled import PROBABILITY_TOLERANCE, CompiledEnsemble, compare, export_ensemble
+from fast import FastEnsemble, build_arrays
+from predict import predict_batch, run_ensemble
+
+
+@pytest.fixture(scope='module')
+def exported(model_set):
+    return export_ensemble(model_set)
+
+
+@pytest.fixture(scope='module')
+def reference(model_set, sensor_rows):
+    return run_ensemble(sensor_rows, model_set)['probabilities']
+
+
+def test_compiled_kernel_matches_sklearn(model_set, sensor_rows, exported):
+    report = compare(CompiledEnsemble(exported), model_set, sensor_rows)
+    for name, stats in report.items():
+        assert stats['max_abs_diff'] <= PROBABILITY_TOLERANCE, name
+        assert stats['small_batch_max_abs_diff'] <= PROBABILITY_TOLERANCE, name
+        assert stats['label_agreement'] == 1.0, name
+
+
+def test_fast_kernel_keeps_the_meta_labels(model_set, sensor_rows, exported, reference):
+    members = [str(name) for name in exported['base_order']]
+    fast = FastEnsemble(build_arrays(model_set, exported, members, {}))
+    probabilities = fast.run(sensor_rows)['probabilities']
+    assert probabilities['meta'].dtype == np.float32
+    # float32 may flip a tree split at a threshold, never the meta answer on these rows
+    agreement = (np.argmax(probabilities['meta'], axis=1) == np.argmax(reference['meta'], axis=1)).mean()
+    assert agreement >= 0.99
+
+
+def test_fast_kernel_folds_dropped_members_into_the_intercept(model_set, sensor_rows, exported):
+    order = [str(name) for name in exported['base_order']]
+    full = FastEnsemble(build_arrays(model_set, exported, order, {}))
+    kept = [name for name in order if name != 'knn']
+    means = {'knn': np.full(len(exported['classes']), 0.25)}
+    pruned = FastEnsemble(build_arrays(model_set, exported, kept, means))
+
+    probabilities = pruned.run(sensor_rows)['probabilities']
+    assert 'knn' not in probabilities
+    members = full.run(sensor_rows)['probabilities']
+    meta_X = np.hstack([np.tile(means['knn'], (len(sensor_rows), 1)) if name == 'knn' else members[name]
+                        for name in order])
+    expected = model_set.meta_model.predict_proba(meta_X)
+    np.testing.assert_allclose(probabilities['meta'], expected, atol=1e-4)
+
+
+@pytest.fixture
+def cascade_set(model_set, monkeypatch):
+    monkeypatch.setattr(predict, 'INFERENCE_CASCADE', True)
+    cascaded = copy.copy(model_set)
+    cascaded.cascade = Cascade('rf', [0.9] * len(model_set.classes), model_set.version)
+    return cascaded
+
+
+def test_cascade_answers_confident_rows_early_and_escalates_the_rest(cascade_set, sensor_rows, reference):
+    result = run_ensemble(sensor_rows, cascade_set)
+    early = ~result['escalated']
+    assert early.any() and result['escalated'].any()
+    meta = result['probabilities']['meta']
+    np.testing.assert_allclose(meta[early], reference['rf'][early])
+    np.testing.assert_allclose(meta[~early], reference['meta'][~early])
+    assert np.isnan(result['probabilities']['xgb'][early]).all()
+
+
+def test_cascade_without_early_exits_is_the_full_stack(cascade_set, sensor_rows, reference):
+    cascade_set.cascade = Cascade('rf', [None] * len(cascade_set.classes), cascade_set.version)
+    result = run_ensemble(sensor_rows, cascade_set)
+    assert result['escalated'].all()
+    for name, proba in reference.items():
+        np.testing.assert_allclose(result['probabilities'][name], proba)
+
+
+def test_cascade_batch_predictions_leave_out_skipped_models(cascade_set, sensor_rows):
+    result = predict_batch(sensor_rows, cascade_set)
+    escalated = result['predictions']['meta']['escalated']
+    labels = result['predictions']['base_3']['class_label']
+    assert all((label is None) == (not flag) for label, flag in zip(labels, escalated))
+
+
+def test_binary_export_replaces_the_mapped_arrays_without_touching_them(model_set, sensor_rows, exported, tmp_path):
+    path = str(tmp_path / 'ensemble_binary')
+    CompiledEnsemble(exported).save_binary(path)
+    mapped = CompiledEnsemble.load_binary(path)
+    before = mapped.run(sensor_rows)['probabilities']['meta']
+
+    members = [str(name) for name in exported['base_order']]
+    FastEnsemble(build_arrays(model_set, exported, members, {})).save_binary(path)
+    np.testing.assert_array_equal(mapped.run(sensor_rows)['probabilities']['meta'], before)
+    assert CompiledEnsemble.load_binary(path).a['meta_coef'].dtype == np.float32
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['ensemble_binary']
+
+
+def test_compiled_kernel_exports_a_one_vs_rest_meta_model(model_set, sensor_rows, reference):
+    from training import make_meta_model
+
+    refit = copy.copy(model_set)
+    meta_X = np.hstack([reference[name] for name in model_set.base_models])
+    refit.meta_model = make_meta_model().fit(meta_X, np.argmax(reference['meta'], axis=1))
+    compiled = CompiledEnsemble(export_ensemble(refit))
+    np.testing.assert_allclose(compiled.run(sensor_rows)['probabilities']['meta'],
+                               refit.meta_model.predict_proba(meta_X), atol=PROBABILITY_TOLERANCE)
@@ -0,0 +1,16 @@
+import numpy as np
+
+from features import FeatureSpec, RollingFeatures, batch_features
+
+
+def test_readings_without_a_timestamp_match_the_batch_features(sensor_rows):
+    X = np.asarray(sensor_rows[:40, :4], dtype=np.float64)
+    times = np.datetime64('2024-01-01T00:00:00', 's') + np.arange(len(X)) * np.timedelta64(60, 's')
+    times[[0, 7, 8, 21, 39]] = np.datetime64('NaT')
+    spec = FeatureSpec(window=5)
+
+    rolling = RollingFeatures(spec)
+    online = np.array([rolling.update(X[i], None if np.isnat(times[i]) else times[i])
+                       for i in range(len(X))])
+
+    np.testing.assert_allclose(online, batch_features(X, times, spec=spec), rtol=1e-9, atol=1e-9)
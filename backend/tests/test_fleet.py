@@ -0,0 +1,41 @@
+import threading
+import time
+
+from fleet import FleetFetcher
+
+
+def make_fetch(dead, calls):
+    """Stand-in for fetch_thingspeak_data: dead channels hang until the call's timeout"""
+    def fetch(api_key, results, channel_id, timeout=None, retry=True):
+        calls.append((channel_id, timeout, retry, time.monotonic()))
+        if channel_id in dead:
+            threading.Event().wait(timeout)
+            return None
+        return [{'entry_id': 1}]
+    return fetch
+
+
+def test_dead_devices_release_their_thread_at_the_device_timeout():
+    calls = []
+    fetcher = FleetFetcher(max_concurrency=1, device_timeout=0.1)
+    started = time.monotonic()
+    outcomes = fetcher.fetch([('1', 'A'), ('2', 'B'), ('3', 'C')], make_fetch({'1', '2'}, calls))
+    assert [o['status'] for o in outcomes] == ['timeout', 'timeout', 'ok']
+    assert 'device timeout' in outcomes[0]['error']
+    # Single attempts bounded by the device timeout, so the third device did not wait for retries
+    assert all(timeout == 0.1 and retry is False for _, timeout, retry, _ in calls)
+    assert time.monotonic() - started < 1.0
+    fetcher.shutdown()
+
+
+def test_request_deadline_is_reported_as_such():
+    calls = []
+    fetcher = FleetFetcher(max_concurrency=1, device_timeout=5)
+    deadline = time.monotonic() + 0.1
+    outcomes = fetcher.fetch([('1', 'A'), ('2', 'B')], make_fetch({'1'}, calls), deadline=deadline)
+    assert [o['status'] for o in outcomes] == ['timeout', 'timeout']
+    assert outcomes[0]['error'] == "Request deadline passed while fetching"
+    assert outcomes[1]['error'] == "Request deadline passed before the fetch started"
+    # The hung call was given what was left of the deadline, not the device timeout
+    assert calls[0][1] <= 0.1
+    fetcher.shutdown()
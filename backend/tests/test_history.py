@@ -0,0 +1,48 @@
+import time
+from contextlib import closing
+
+import numpy as np
+
+from history import HistoryStore, history_from_env
+
+READING = [1650.0, 1560.0, 34.1, 99.2]
+
+
+def timestamps(seconds):
+    return np.array(seconds, dtype='datetime64[s]')
+
+
+def test_history_is_opt_in(monkeypatch):
+    monkeypatch.delenv('HISTORY_DB', raising=False)
+    assert history_from_env() is None
+
+
+def test_a_failing_item_does_not_drop_its_batch(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    now = int(time.time())
+    items = [
+        ('readings', 'dev', np.array([READING]), np.array([now]), np.array([1])),
+        # No label: violates predictions.class_label NOT NULL
+        ('predictions', [('dev', now, 'predict', None, None, 0.9, 'v1')]),
+        ('predictions', [('dev', now, 'predict', None, 'Thịt bò tươi', 0.8, 'v1')]),
+    ]
+    with closing(store._connect()) as db:
+        store._write(db, items)
+    assert len(store.readings('dev', now, now + 1)) == 1
+    assert [p['class_label'] for p in store.predictions('dev', now, now + 1)] == ['Thịt bò tươi']
+    assert store.info()['write_errors'] == 1
+    (bucket,) = store.rollups('dev', 'minute', now, now + 1)
+    assert bucket['count'] == 1 and list(bucket['labels']) == ['Thịt bò tươi']
+
+
+def test_readings_without_entry_id_are_stored_as_null_and_deduplicated(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.db'))
+    now = int(time.time())
+    values = np.array([READING, READING, [1500.0, 1400.0, 30.0, 80.0]])
+    times = timestamps([now, now + 1, now + 1])
+    store.record_readings('dev', values, times, [0, 0, 0])
+    store.record_readings('dev', values, times, [0, 0, 0])
+    stored = store.readings('dev', now, now + 2)
+    assert len(stored) == 3
+    assert all(reading['entry_id'] is None for reading in stored)
+    assert store.stats['duplicates'] == 3
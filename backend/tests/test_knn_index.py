@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from sklearn.neighbors import KNeighborsClassifier
+
+from knn_index import GridKNNIndex, IndexedKNN
+
+
+@pytest.fixture(scope='module')
+def knn():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(600, 4))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int) + (X[:, 2] > 1)
+    return KNeighborsClassifier(n_neighbors=5, metric='manhattan').fit(X, y)
+
+
+def test_matches_brute_force(knn):
+    index = GridKNNIndex.from_estimator(knn)
+    rng = np.random.default_rng(1)
+    # Includes queries far outside the data, answered by the exact scan
+    queries = np.vstack([rng.normal(size=(200, 4)), rng.normal(scale=10, size=(20, 4))])
+    np.testing.assert_array_equal(index.predict_proba(queries), knn.predict_proba(queries))
+
+
+@pytest.mark.parametrize('value', [np.nan, np.inf])
+def test_rejects_non_finite_input(knn, value):
+    model = IndexedKNN(knn, GridKNNIndex.from_estimator(knn))
+    with pytest.raises(ValueError):
+        model.predict_proba([[0.0, value, 0.0, 0.0]])
+    with pytest.raises(ValueError):
+        model.index.kneighbors([[0.0, value, 0.0, 0.0]])
+
+
+def test_refuses_high_dimensional_points():
+    with pytest.raises(ValueError):
+        GridKNNIndex.build(np.random.default_rng(0).normal(size=(100, 18)), np.zeros(100), 5, 2, 0.5)
+
+
+def test_save_swaps_in_a_new_directory(knn, tmp_path):
+    path = str(tmp_path / 'knn_index')
+    GridKNNIndex.from_estimator(knn).save(path)
+    loaded = GridKNNIndex.load(path)
+    points = np.array(loaded.points)
+
+    # Re-saving over a memory-mapped index must not rewrite the mapped files
+    rng = np.random.default_rng(2)
+    other = KNeighborsClassifier(n_neighbors=5, metric='manhattan').fit(rng.normal(size=(600, 4)), knn._y)
+    GridKNNIndex.from_estimator(other).save(path)
+    np.testing.assert_array_equal(loaded.points, points)
+    assert not np.array_equal(GridKNNIndex.load(path).points, points)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['knn_index']
+
+
+def test_build_writes_nothing_when_the_index_mismatches(knn, tmp_path, monkeypatch):
+    import joblib
+
+    import knn_index
+
+    joblib.dump(knn, tmp_path / 'knn_model.pkl')
+    monkeypatch.setattr(knn_index, 'MODELS_DIR', str(tmp_path))
+    monkeypatch.setattr(GridKNNIndex, 'predict_proba', lambda self, X: np.zeros((len(X), 3)))
+    assert knn_index.main(['knn_index.py', 'build']) == 1
+    assert not (tmp_path / 'knn_index').exists()
@@ -0,0 +1,29 @@
+import os
+import shutil
+
+from registry import ModelRegistry
+
+
+def test_a_set_whose_files_change_while_loading_is_not_swapped_in(tmp_path):
+    models = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+    for name in os.listdir(models):
+        if name.endswith('.pkl'):
+            shutil.copy(os.path.join(models, name), tmp_path / name)
+    registry = ModelRegistry(models_dir=str(tmp_path), check_interval=None, model_format='pickle')
+    current = registry.load()
+
+    load_set = registry._load_set
+
+    def load_while_replaced():
+        model_set = load_set()
+        # Another process finishes replacing the pickles after this load read them
+        os.utime(tmp_path / 'scaler.pkl', ns=(0, 0))
+        return model_set
+
+    os.utime(tmp_path / 'meta_model.pkl', ns=(1, 1))
+    registry._load_set = load_while_replaced
+    assert registry.reload_if_changed() is False
+    assert registry.get() is current
+
+    registry._load_set = load_set
+    assert registry.reload_if_changed() is True
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import pytest
+
+from serving import InferencePool, Overloaded, PredictionTimeout
+
+
+def test_in_process_calls_respect_the_deadline():
+    pool = InferencePool(0, timeout=0.05)
+    started = time.monotonic()
+    with pytest.raises(PredictionTimeout):
+        pool.call(time.sleep, 0.5)
+    assert time.monotonic() - started < 0.4
+    assert pool.info()['timed_out'] == 1
+    pool.shutdown()
+
+
+def test_in_process_calls_are_admission_limited():
+    pool = InferencePool(0, max_pending=1, timeout=5)
+    release = threading.Event()
+    worker = threading.Thread(target=pool.call, args=(release.wait,))
+    worker.start()
+    time.sleep(0.05)
+    with pytest.raises(Overloaded):
+        pool.call(sum, [1, 2])
+    release.set()
+    worker.join()
+    assert pool.call(sum, [1, 2]) == 3
+    pool.shutdown()
+
+
+def test_errors_propagate():
+    pool = InferencePool(0)
+    with pytest.raises(ValueError):
+        pool.call(int, 'x')
+    assert pool.info()['failed'] == 1
+    pool.shutdown()
@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+import pytest
+
+from stream import StreamHub
+
+READING = [1650.0, 1560.0, 34.1, 99.2]
+
+
+def fixed_score(inputs):
+    """Stand-in for the ensemble: every row gets the same meta probabilities"""
+    return {'meta': np.tile([0.1, 0.2, 0.3, 0.4], (len(inputs), 1)), 'classes': np.array([0, 1, 2, 3]),
+            'model_version': 'test'}
+
+
+def feeds(ids):
+    return [{'entry_id': i, 'field1': '1650', 'field2': '1560', 'field3': '34.1', 'field4': '99.2'} for i in ids]
+
+
+def test_duplicate_entries_are_skipped():
+    hub = StreamHub(score=fixed_score)
+    assert len(hub.push_feeds('a', feeds([1, 2, 3]))) == 3
+    assert len(hub.push_feeds('a', feeds([2, 3, 4]))) == 1
+    # Entries without an entry_id cannot be told apart, so they are always scored
+    assert len(hub.push_feeds('a', [{'field1': '1650'}, {'field1': '1651'}])) == 2
+    assert hub.get_state('a')['readings_seen'] == 6
+
+
+def test_failed_scoring_leaves_state_unchanged():
+    def overloaded(inputs):
+        raise RuntimeError('busy')
+
+    hub = StreamHub(score=overloaded)
+    with pytest.raises(RuntimeError):
+        hub.push_feeds('a', feeds([1, 2]))
+    hub.score = fixed_score
+    # The entries were not claimed by the failed push
+    assert len(hub.push_feeds('a', feeds([1, 2]))) == 2
+
+
+def test_device_states_are_bounded():
+    hub = StreamHub(score=fixed_score, max_devices=2)
+    for device in 'abc':
+        hub.push_readings(device, [READING])
+    assert hub.get_state('a') is None
+    assert hub.get_state('c')['readings_seen'] == 1
+
+    hub.state_ttl = 1e-9
+    hub.push_readings('d', [READING])
+    assert hub.get_state('b') is None and hub.get_state('c') is None
+
+
+def test_concurrent_pushes_of_a_device_are_serialized():
+    hub = StreamHub(score=fixed_score)
+    threads = [threading.Thread(target=hub.push_readings, args=('a', np.tile(READING, (50, 1)))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert hub.get_state('a')['readings_seen'] == 400
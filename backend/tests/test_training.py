@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from training import load_held_out, save_stacking_features
+
+
+def stacking(path, **held_out):
+    rng = np.random.default_rng(0)
+    save_stacking_features(str(path), rng.random((20, 8)), rng.integers(0, 2, 20), rng.random((10, 8)),
+                           np.arange(10) % 2, base_order=['rf', 'knn'], classes=[0, 1], **held_out)
+    return str(path)
+
+
+def test_held_out_rows_round_trip(tmp_path):
+    inputs = np.random.default_rng(1).random((10, 4))
+    path = stacking(tmp_path, test_inputs=inputs, test_rows=np.arange(30, 40))
+    X, y = load_held_out(path)
+    np.testing.assert_array_equal(X, inputs)
+    np.testing.assert_array_equal(y, np.arange(10) % 2)
+
+
+def test_held_out_rows_must_match_their_hash(tmp_path):
+    path = stacking(tmp_path, test_inputs=np.ones((10, 4)), test_rows=np.arange(10))
+    np.save(tmp_path / 'test_inputs.npy', np.zeros((10, 4)))
+    with pytest.raises(ValueError, match='test_hash'):
+        load_held_out(path)
+
+
+def test_artifacts_without_held_out_rows_are_refused(tmp_path):
+    with pytest.raises(ValueError):
+        load_held_out(str(tmp_path))
+    with pytest.raises(ValueError, match='no held-out test rows'):
+        load_held_out(stacking(tmp_path))